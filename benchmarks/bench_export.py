@@ -0,0 +1,94 @@
+## CPU latency and throughput of exported build_model models ##
+
+# Exports a randomly initialised build_model model (config as in
+# bench_model.py) to a numpy forward pass and to TFLite (float and
+# dynamic-range quantized), checks each against keras (failing the run
+# if over tolerance), then times single calls across batch sizes, e.g.
+#   python benchmarks/bench_export.py --batch-sizes 1 5 64 320 --out e.json
+
+# packages
+import os
+import json
+import time
+import argparse
+import platform
+import tempfile
+import numpy as np
+from bench_model import model_config, random_inputs
+
+def time_calls(fn, inputs, batch_size, reps):
+    """
+    Median latency (ms) of a call on batch_size rows, and rows per second.
+    """
+    batch = [i[:batch_size] for i in inputs]
+    fn(batch)
+    secs = []
+    for r in range(reps):
+        t = time.perf_counter()
+        fn(batch)
+        secs.append(time.perf_counter() - t)
+    med = float(np.median(secs))
+    return {"latency_ms": 1000 * med, "rows_per_sec": batch_size / med}
+
+def main(batch_sizes, reps=20, fused=False, out_file=None, seed=0,
+         tol=1e-4, quant_tol=0.1, **config_kwargs):
+    import tensorflow as tf
+    from commlit.build_model import build_model
+    from commlit.export import fuse_inputs, export_numpy, export_tflite, \
+        load_exported, check_parity
+    config = model_config(**config_kwargs)
+    inputs, y = random_inputs(config, max(batch_sizes), seed=seed)
+    tf.random.set_seed(seed)
+    model = build_model(**config, fused=fused)
+    if fused:
+        inputs = fuse_inputs(inputs, config["Q"]["n_q"])
+
+    # export to each format and check parity with keras
+    tmp = tempfile.mkdtemp()
+    export_numpy(model, os.path.join(tmp, "model.npz"), **config)
+    export_tflite(model, os.path.join(tmp, "model.tflite"))
+    export_tflite(model, os.path.join(tmp, "model_q.tflite"), quantize=True)
+    runners = {"keras": lambda x: model(x, training=False)}
+    for name, file, t in [("numpy", "model.npz", tol),
+                          ("tflite", "model.tflite", tol),
+                          ("tflite_quant", "model_q.tflite", quant_tol)]:
+        exported = load_exported(os.path.join(tmp, file))
+        diff = check_parity(model, exported, inputs, tol=t)
+        print("%-14s parity: max abs diff %.3g (%.1f KB)"%(
+            name, diff, os.path.getsize(os.path.join(tmp, file)) / 1024))
+        runners[name] = exported.predict
+
+    # time each runner per batch size
+    results = {}
+    for name, fn in runners.items():
+        results[name] = {}
+        for bs in batch_sizes:
+            r = time_calls(fn, inputs, bs, reps)
+            results[name][str(bs)] = r
+            print("%-14s batch %5d %9.2f ms %10.1f rows/s"%(
+                name, bs, r["latency_ms"], r["rows_per_sec"]))
+
+    out = {"meta": {"time": time.strftime("%Y-%m-%d %H:%M:%S"),
+                    "python": platform.python_version(),
+                    "tensorflow": tf.__version__, "numpy": np.__version__,
+                    "machine": platform.machine(), "fused": fused,
+                    "config": config},
+           "results": results}
+    if out_file is not None:
+        with open(out_file, "w") as wf:
+            json.dump(out, wf, indent=2)
+    return out
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--batch-sizes", type=int, nargs="+",
+                        default=[1, 5, 32, 160, 640])
+    parser.add_argument("--reps", type=int, default=20)
+    parser.add_argument("--fused", action="store_true")
+    parser.add_argument("--n-row", type=int, default=125)
+    parser.add_argument("--filters", type=int, default=64)
+    parser.add_argument("--out", default=None)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    main(args.batch_sizes, args.reps, args.fused, args.out, args.seed,
+         n_row=args.n_row, filters=args.filters)
@@ -0,0 +1,131 @@
+## Offline benchmark of lazykaggler downloads against a fake kaggle CLI ##
+
+# Writes a stand-in `kaggle` executable serving a synthetic competition
+# (files of --kb KB each after --latency seconds, with some zipped as the
+# real API does) and puts it first on PATH. Then times a cold setup
+# downloading every file serially and with --jobs threads, and a warm
+# rerun that should skip everything, checking the contents of each
+# local file. Listings (paged as the real CLI pages them) are timed cold
+# and from the cache, e.g.
+#   python benchmarks/bench_lazykaggler.py --files 40 --jobs 8 --out k.json
+
+# packages
+import os
+import sys
+import json
+import time
+import shutil
+import hashlib
+import argparse
+import tempfile
+
+# the fake kaggle CLI shared with the tests
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                                "..", "tests"))
+import fake_kaggle
+
+def install_fake(bin_dir, n_files, kb, latency, n_comps=50):
+    """
+    Writes the fake kaggle executable (tests/fake_kaggle.py) to bin_dir
+    and puts it first on PATH, with the competition served set through
+    environment variables.
+    """
+    fake_kaggle.install(bin_dir)
+    os.environ["PATH"] = bin_dir + os.pathsep + os.environ["PATH"]
+    os.environ["FAKE_KAGGLE_FILES"] = str(n_files)
+    os.environ["FAKE_KAGGLE_KB"] = str(kb)
+    os.environ["FAKE_KAGGLE_LATENCY"] = str(latency)
+    os.environ["FAKE_KAGGLE_COMPS"] = str(n_comps)
+
+def expected_sha256(name, kb):
+    return hashlib.sha256(fake_kaggle.content(name, kb)).hexdigest()
+
+def check_files(local_path, names, kb):
+    """
+    Fails the run if a local file is missing or differs from the source.
+    """
+    from commlit.lazykaggler.downloads import file_sha256
+    for name in names:
+        path = os.path.join(local_path, name)
+        if file_sha256(path) != expected_sha256(name, kb):
+            raise AssertionError("%s differs from the source!"%name)
+
+def time_listing(fn, **kwargs):
+    """
+    Seconds taken by a cold and a cached call of a listing function.
+    """
+    t = time.perf_counter()
+    df = fn(refresh=True, **kwargs)
+    cold = time.perf_counter() - t
+    t = time.perf_counter()
+    cached = fn(**kwargs)
+    warm = time.perf_counter() - t
+    if not df.equals(cached):
+        raise AssertionError("Cached listing differs!")
+    return df, {"rows": len(df), "cold_secs": cold, "cached_secs": warm}
+
+def main(n_files=20, kb=256, latency=0.2, jobs=8, n_comps=50,
+         page_size=200, out_file=None):
+    from commlit.lazykaggler.downloads import DownloadManager
+    from commlit.lazykaggler.competitions import competition_files, \
+        competition_list
+    tmp = tempfile.mkdtemp()
+    install_fake(os.path.join(tmp, "bin"), n_files, kb, latency, n_comps)
+    os.environ["LAZYKAGGLER_CACHE"] = os.path.join(tmp, "cache")
+
+    # listings over all pages, cold and cached
+    results = {}
+    listing, results["files_listing"] = time_listing(
+        competition_files, competiton="fake-comp", page_size=page_size)
+    comps, results["comp_listing"] = time_listing(competition_list,
+                                                  n_jobs=jobs)
+    names = list(listing["name"])
+    if len(names) != n_files or len(comps) != n_comps:
+        raise AssertionError("Listings are incomplete!")
+    for label in ["files_listing", "comp_listing"]:
+        r = results[label]
+        print("%-14s %7.2f s  cached %.3f s  (%d rows)"%(
+            label, r["cold_secs"], r["cached_secs"], r["rows"]))
+
+    # cold setups, then a warm rerun of the parallel one
+    for label, n_jobs, local in [("cold_serial", 1, "serial"),
+                                 ("cold_parallel", jobs, "parallel"),
+                                 ("warm_parallel", jobs, "parallel")]:
+        local_path = os.path.join(tmp, local)
+        t = time.perf_counter()
+        res = DownloadManager("fake-comp", local_path,
+                              n_jobs=n_jobs).download_all(listing)
+        secs = time.perf_counter() - t
+        check_files(local_path, names, kb)
+        counts = res["status"].value_counts().to_dict()
+        results[label] = {"secs": secs, "status": counts,
+                          "mb": float(res["bytes"].sum()) / 2**20}
+        print("%-14s %7.2f s  %s"%(label, secs, counts))
+    if results["warm_parallel"]["status"] != {"skipped": len(names)}:
+        raise AssertionError("Warm rerun downloaded files again!")
+    print("parallel speedup %.1fx"%(results["cold_serial"]["secs"] /
+                                    results["cold_parallel"]["secs"]))
+
+    shutil.rmtree(tmp, ignore_errors=True)
+    out = {"meta": {"time": time.strftime("%Y-%m-%d %H:%M:%S"),
+                    "files": n_files, "kb": kb, "latency": latency,
+                    "jobs": jobs, "comps": n_comps,
+                    "page_size": page_size},
+           "results": results}
+    if out_file is not None:
+        with open(out_file, "w") as wf:
+            json.dump(out, wf, indent=2)
+    return out
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--files", type=int, default=20)
+    parser.add_argument("--kb", type=int, default=256)
+    parser.add_argument("--latency", type=float, default=0.2)
+    parser.add_argument("--jobs", type=int, default=8)
+    parser.add_argument("--comps", type=int, default=50)
+    parser.add_argument("--page-size", type=int, default=200)
+    parser.add_argument("--out", default=None)
+    args = parser.parse_args()
+    main(args.files, args.kb, args.latency, args.jobs, args.comps,
+         args.page_size, args.out)
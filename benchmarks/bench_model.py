@@ -0,0 +1,122 @@
+## CPU benchmark of the standard and fused build_model graphs ##
+
+# Builds both graphs for the same config on random inputs shaped like
+# gen_train_data outputs, checks that the fused graph loaded with the
+# standard graph's weights gives the same predictions (failing the run
+# otherwise), then times predict and train throughput of each, e.g.
+#   python benchmarks/bench_model.py --n 4096 --epochs 2 --out model.json
+
+# packages
+import json
+import time
+import argparse
+import platform
+import numpy as np
+
+def model_config(n_row=125, n_vec=96, n_att=40, n_agg=60, n_q=2,
+                 n_quant=39, filters=64):
+    """
+    build_model config for inputs of the given sizes.
+    """
+    return {"cnn": {"shape": (None, n_row, n_vec, 1), "filters": filters,
+                    "acti": "relu", "l2_reg": 1e-4},
+            "att": {"shape": (None, n_row, n_att, 1), "filters": filters,
+                    "acti": "sigmoid", "l2_reg": 1e-4},
+            "agg": {"shape": n_agg, "drop": 0.1, "dense": True, "n": 16,
+                    "acti": "relu", "l2_reg": 1e-4},
+            "Q": {"n_q": n_q, "shape": n_quant, "drop": 0.1, "dense": True,
+                  "n": 16, "acti": "relu", "l2_reg": 1e-4},
+            "extra": {"use": True, "n": 32, "acti": "relu", "l2_reg": 1e-4},
+            "out": {"acti": "linear", "l2_reg": 1e-4}}
+
+def random_inputs(config, n, seed=0):
+    """
+    Standard-layout inputs [x, a, m, *q] and targets for n samples.
+    """
+    rng = np.random.default_rng(seed)
+    inputs = [rng.normal(size=(n,) + tuple(config[k]["shape"][1:])
+                         ).astype(np.float32) for k in ["cnn", "att"]]
+    inputs.append(rng.normal(size=(n, config["agg"]["shape"])
+                             ).astype(np.float32))
+    inputs += [rng.normal(size=(n, config["Q"]["shape"])).astype(np.float32)
+               for q in range(config["Q"]["n_q"])]
+    return inputs, rng.normal(size=n).astype(np.float32)
+
+def check_parity(std, fused, inputs, n_q, tol=1e-5):
+    """
+    Max absolute difference of predictions, raising if above tol.
+    """
+    from commlit.export import fuse_inputs
+    a = std.predict(inputs, batch_size=256, verbose=0)
+    b = fused.predict(fuse_inputs(inputs, n_q), batch_size=256, verbose=0)
+    diff = float(np.abs(a - b).max())
+    if diff > tol:
+        raise AssertionError("Fused predictions differ by %g!"%diff)
+    return diff
+
+def throughput(model, inputs, y, batch_size, epochs):
+    """
+    Samples per second of predict and of fit.
+    """
+    n = len(y)
+    model.predict([i[:batch_size] for i in inputs], verbose=0)
+    t = time.perf_counter()
+    model.predict(inputs, batch_size=batch_size, verbose=0)
+    pred = n / (time.perf_counter() - t)
+    model.fit(inputs, y, batch_size=batch_size, epochs=1, verbose=0)
+    t = time.perf_counter()
+    model.fit(inputs, y, batch_size=batch_size, epochs=epochs, verbose=0)
+    train = n * epochs / (time.perf_counter() - t)
+    return {"predict_per_sec": pred, "train_per_sec": train}
+
+def main(n, batch_size, epochs, out_file=None, seed=0, **config_kwargs):
+    import tensorflow as tf
+    from commlit.build_model import build_model, load_standard_weights
+    from commlit.export import fuse_inputs
+    config = model_config(**config_kwargs)
+    n_q = config["Q"]["n_q"]
+    inputs, y = random_inputs(config, n, seed=seed)
+
+    # fused graph with the standard graph's weights
+    tf.random.set_seed(seed)
+    std = build_model(**config)
+    fused = load_standard_weights(build_model(**config, fused=True), std,
+                                  **config)
+    diff = check_parity(std, fused, inputs, n_q)
+    print("parity: max abs diff %.3g"%diff)
+
+    results = {}
+    for name, model, x in [("standard", std, inputs),
+                           ("fused", fused, fuse_inputs(inputs, n_q))]:
+        model.compile("adam", "mse")
+        results[name] = throughput(model, x, y, batch_size, epochs)
+        print("%-10s %10.1f predict/s %10.1f train/s"%(
+            name, results[name]["predict_per_sec"],
+            results[name]["train_per_sec"]))
+    for k in ["predict_per_sec", "train_per_sec"]:
+        print("fused %s x%.2f"%(k, results["fused"][k] /
+                                results["standard"][k]))
+
+    out = {"meta": {"time": time.strftime("%Y-%m-%d %H:%M:%S"),
+                    "python": platform.python_version(),
+                    "tensorflow": tf.__version__,
+                    "machine": platform.machine(), "n": n,
+                    "batch_size": batch_size, "config": config},
+           "parity_max_abs_diff": diff, "results": results}
+    if out_file is not None:
+        with open(out_file, "w") as wf:
+            json.dump(out, wf, indent=2)
+    return out
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--n", type=int, default=4096)
+    parser.add_argument("--batch-size", type=int, default=64)
+    parser.add_argument("--epochs", type=int, default=2)
+    parser.add_argument("--n-row", type=int, default=125)
+    parser.add_argument("--filters", type=int, default=64)
+    parser.add_argument("--out", default=None)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    main(args.n, args.batch_size, args.epochs, args.out, args.seed,
+         n_row=args.n_row, filters=args.filters)
@@ -0,0 +1,187 @@
+## Offline benchmark of the feature and model pipeline ##
+
+# Runs each stage on synthetic corpora of several sizes using a stand-in
+# spacy pipeline (see commlit.helpers.synthetic), so no data or model
+# downloads are needed. Throughput and peak traced memory (unless
+# --no-memory) of each stage are printed and saved as JSON; pass
+# --compare with an earlier results file to print the change in
+# throughput, e.g.
+#   python benchmarks/bench_pipeline.py --sizes 100 500 --out new.json
+#   python benchmarks/bench_pipeline.py --out new.json --compare old.json
+
+# packages
+import json
+import time
+import argparse
+import platform
+import tracemalloc
+import warnings
+import numpy as np
+import pandas as pd
+from commlit.helpers import synthetic
+
+def measure(fn, n_items, trace_memory=True):
+    """
+    Runs fn, returning wall time and throughput, plus peak memory of
+    numpy and python allocations traced in a second run (as tracing
+    slows the run down) if trace_memory.
+    """
+    t = time.perf_counter()
+    out = fn()
+    secs = time.perf_counter() - t
+    res = {"secs": secs, "items": n_items,
+           "items_per_sec": n_items / max(secs, 1e-9)}
+    if trace_memory:
+        del out
+        tracemalloc.start()
+        out = fn()
+        res["peak_mb"] = tracemalloc.get_traced_memory()[1] / 1024**2
+        tracemalloc.stop()
+    return out, res
+
+def model_config(x, a, m, q):
+    """
+    Small build_model config for the shapes of gen_train_data outputs.
+    """
+    q_shape = list(q.values())[0].shape[1] - 2
+    return {"cnn": {"shape": x.shape, "filters": 16, "acti": "relu",
+                    "l2_reg": 1e-4},
+            "att": {"shape": a.shape, "filters": 16, "acti": "sigmoid",
+                    "l2_reg": 1e-4},
+            "agg": {"shape": m.shape[1] - 2, "drop": 0.1, "dense": True,
+                    "n": 8, "acti": "relu", "l2_reg": 1e-4},
+            "Q": {"n_q": len(q), "shape": q_shape, "drop": 0.1,
+                  "dense": True, "n": 8, "acti": "relu", "l2_reg": 1e-4},
+            "extra": {"use": True, "n": 16, "acti": "relu", "l2_reg": 1e-4},
+            "out": {"acti": "linear", "l2_reg": 1e-4}}
+
+def bench_size(n_docs, nlp, vocab, freq_df, tag_df, stages, seed=0,
+               trace_memory=True):
+    """
+    Benchmarks each selected stage on a corpus of n_docs excerpts.
+    """
+    from commlit.pre_proc import gen_token_df, gen_sent_df
+    from commlit.base_feats import gen_base_features
+    from commlit.feat_eng import gen_batch_features
+    from commlit.raw_feats import gen_raw_word_features
+    from commlit.word_vecs import gen_word_vec_feat
+    from commlit.up_scale import even_upsample
+    from commlit.train_data import gen_train_data
+
+    df = synthetic.gen_corpus(n_docs, vocab=vocab, seed=seed)
+    docs = list(nlp.pipe(df["excerpt"]))
+    n_tokens = sum(len(d) for d in docs)
+    res = {}
+
+    def run(stage, fn, n_items):
+        if stage in stages:
+            out, res[stage] = measure(fn, n_items, trace_memory)
+            return out
+
+    run("gen_token_df", lambda: [gen_token_df(d, freq_df) for d in docs],
+        n_docs)
+    token_dfs = [gen_token_df(d, freq_df) for d in docs]
+    run("gen_base_features", lambda: [
+        gen_base_features(t, gen_sent_df(d), tag_df=tag_df)
+        for t, d in zip(token_dfs, docs)], n_docs)
+    run("gen_batch_features", lambda: gen_batch_features(
+        df, nlp, freq_df, tag_df=tag_df, word_vec_feat=True), n_docs)
+    raw = run("gen_raw_word_features", lambda: [
+        gen_raw_word_features(d, tag_df, freq_df).assign(id=i)
+        for d, i in zip(docs, df["id"])], n_docs)
+    run("gen_word_vec_feat", lambda: [gen_word_vec_feat(d) for d in docs],
+        n_docs)
+
+    # downstream stages need the raw word features
+    if raw is None:
+        raw = [gen_raw_word_features(d, tag_df, freq_df).assign(id=i)
+               for d, i in zip(docs, df["id"])]
+    run("even_upsample", lambda: [even_upsample(r, n_row=125, n_rep=5)
+                                  for r in raw], n_docs)
+    raw = pd.concat(raw, ignore_index=True)
+    tgt_df = df[["id", "target", "standard_error"]]
+    train = run("gen_train_data", lambda: gen_train_data(raw, tgt_df),
+                n_docs)
+
+    # forward pass, only if tensorflow is available
+    if "build_model" in stages:
+        try:
+            from commlit.build_model import build_model
+        except ImportError:
+            print("tensorflow not available, skipping build_model")
+            return res, n_tokens
+        if train is None:
+            train = gen_train_data(raw, tgt_df)
+        x, a, y, m, q, frame, x_cols = train
+        inputs = [x, a, m.drop(columns=["id", "grp_id"]).values] + \
+            [q_df.drop(columns=["id", "grp_id"]).values
+             for q_df in q.values()]
+        model = build_model(**model_config(x, a, m, q))
+        model.predict([i[:2] for i in inputs], verbose=0)
+        run("build_model", lambda: model.predict(inputs, batch_size=256,
+                                                 verbose=0), x.shape[0])
+
+    return res, n_tokens
+
+def compare(results, old_file):
+    """
+    Prints throughput of results relative to an earlier results file.
+    """
+    with open(old_file) as rf:
+        old = json.load(rf)["results"]
+    print("\nthroughput vs %s"%old_file)
+    for size, stages in results.items():
+        for stage, r in stages.items():
+            if stage in old.get(size, {}):
+                ratio = r["items_per_sec"] / old[size][stage]["items_per_sec"]
+                print("%8s %-24s x%.2f"%(size, stage, ratio))
+
+def main(sizes, stages, out_file=None, old_file=None, seed=0,
+         trace_memory=True):
+    warnings.simplefilter("ignore")
+    from commlit.pre_proc import gen_tag_df
+    vocab = synthetic.gen_vocab(seed=seed)
+    nlp = synthetic.stand_in_nlp(vocab, seed=seed)
+    freq_df = synthetic.gen_freq_df(vocab, seed=seed)
+    tag_df = gen_tag_df(synthetic.ALL_TAGS)
+
+    results = {}
+    for n_docs in sizes:
+        res, n_tokens = bench_size(n_docs, nlp, vocab, freq_df, tag_df,
+                                   stages, seed=seed, 
+                                   trace_memory=trace_memory)
+        results[str(n_docs)] = res
+        print("\n%d docs, %d tokens"%(n_docs, n_tokens))
+        for stage, r in res.items():
+            print("%-24s %8.3fs %10.1f items/s %8.1f MB peak"%(
+                stage, r["secs"], r["items_per_sec"], 
+                r.get("peak_mb", np.nan)))
+
+    out = {"meta": {"time": time.strftime("%Y-%m-%d %H:%M:%S"),
+                    "python": platform.python_version(),
+                    "numpy": np.__version__, "pandas": pd.__version__,
+                    "machine": platform.machine(), "sizes": sizes},
+           "results": results}
+    if out_file is not None:
+        with open(out_file, "w") as wf:
+            json.dump(out, wf, indent=2)
+    if old_file is not None:
+        compare(results, old_file)
+    return out
+
+STAGES = ["gen_token_df", "gen_base_features", "gen_batch_features",
+          "gen_raw_word_features", "gen_word_vec_feat", "even_upsample",
+          "gen_train_data", "build_model"]
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", type=int, nargs="+",
+                        default=[100, 500, 2000])
+    parser.add_argument("--stages", nargs="+", default=STAGES)
+    parser.add_argument("--out", default="bench_results.json")
+    parser.add_argument("--compare", default=None)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--no-memory", action="store_true")
+    args = parser.parse_args()
+    main(args.sizes, args.stages, args.out, args.compare, args.seed,
+         not args.no_memory)
@@ -0,0 +1,89 @@
+## Benchmark of the cold-start import cost of each public entry point ##
+
+# Each name is imported from commlit in a fresh interpreter, recording the
+# time taken and which heavy dependencies were loaded. Names importing a
+# dependency outside their allowance, or exceeding --max-secs, fail the
+# run, e.g. `python benchmarks/import_time.py --max-secs 5`.
+
+# packages
+import sys
+import json
+import argparse
+import subprocess
+
+HEAVY = ["tensorflow", "keras", "spacy", "pandas", "tqdm"]
+
+# heavy dependencies each module is allowed to load
+ALLOWED = {
+    "commlit.helpers.config": [],
+    "commlit.lazykaggler.competitions": [],
+    "commlit.lazykaggler.downloads": [],
+    "commlit.lazykaggler.kernels": [],
+    "commlit.doc_cache": ["spacy"],
+    "commlit.feat_cache": ["spacy", "pandas"],
+    "commlit.feat_store": ["pandas"],
+    "commlit.freq_index": ["spacy"],
+    "commlit.pre_proc": ["pandas"],
+    "commlit.base_feats": ["pandas"],
+    "commlit.feat_eng": ["spacy", "pandas", "tqdm"],
+    "commlit.word_vecs": ["pandas"],
+    "commlit.up_scale": [],
+    "commlit.raw_feats": ["spacy", "pandas"],
+    "commlit.train_data": ["pandas"],
+    "commlit.build_model": ["tensorflow"],
+    "commlit.export": [],
+    "commlit.cv": [],
+    "commlit.sweep": [],
+    "commlit.predictor": ["spacy", "pandas"],
+    "commlit.serving": [],
+}
+
+# dependencies that may be loaded by an allowed one
+IMPLIED = {"spacy": ["tqdm"], "tensorflow": ["keras", "pandas"]}
+
+SNIPPET = """
+import sys, time, json
+t = time.perf_counter()
+from commlit import %s
+secs = time.perf_counter() - t
+print(json.dumps({"secs": secs, "loaded": [m for m in %r if m in sys.modules]}))
+"""
+
+def time_import(name):
+    """
+    Imports name from commlit in a new process, returning seconds taken
+    and the heavy dependencies loaded.
+    """
+    x = subprocess.run([sys.executable, "-c", SNIPPET%(name, HEAVY)],
+                       capture_output=True, check=True)
+    return json.loads(x.stdout.decode("utf-8").strip().split("\n")[-1])
+
+def main(max_secs=None, out_file=None):
+    import commlit
+    results = {}
+    failed = False
+    for mod, attrs in commlit.__lazy_attrs__.items():
+        for name in attrs:
+            res = time_import(name)
+            allowed = ALLOWED.get(mod, HEAVY)
+            allowed = set(allowed + [d for a in allowed 
+                                     for d in IMPLIED.get(a, [])])
+            extra = set(res["loaded"]) - allowed
+            res["ok"] = ((len(extra) == 0) and 
+                         (max_secs is None or res["secs"] <= max_secs))
+            failed = failed or not res["ok"]
+            results[name] = res
+            print("%-28s %7.3fs  %-4s %s"%(name, res["secs"],
+                                          "ok" if res["ok"] else "FAIL",
+                                          ", ".join(res["loaded"])))
+    if out_file is not None:
+        with open(out_file, "w") as wf:
+            json.dump(results, wf, indent=2)
+    return failed
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--max-secs", type=float, default=None)
+    parser.add_argument("--out", default=None)
+    args = parser.parse_args()
+    sys.exit(int(main(args.max_secs, args.out)))
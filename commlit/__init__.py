@@ -1,16 +1,70 @@
 
-# support functions
-from commlit.helpers.config import env_config
-from commlit.lazykaggler.competitions import competition_download, \
-    competition_files, competition_list
-from commlit.lazykaggler.kernels import kernel_output_download
+# Public functions are loaded lazily from their modules on first access,
+# so e.g. `from commlit import competition_download` does not pay for
+# importing tensorflow, spacy or pandas.
+import sys
+import types
+import importlib
 
-# main functions
-from commlit.pre_proc import gen_ent_df, gen_sent_df, gen_token_df, gen_tag_df
-from commlit.base_feats import gen_base_features
-from commlit.feat_eng import gen_batch_features
-from commlit.word_vecs import gen_word_vec_feat, gen_word_vec_matrix
-from commlit.up_scale import upscale_targets, even_upsample
-from commlit.raw_feats import gen_raw_word_features
-from commlit.train_data import gen_train_data
-from commlit.build_model import build_model
+__lazy_attrs__ = {
+    # support functions
+    "commlit.helpers.config": ["env_config"],
+    "commlit.lazykaggler.competitions": ["competition_download",
+                                         "competition_files",
+                                         "competition_list"],
+    "commlit.lazykaggler.downloads": ["DownloadManager"],
+    "commlit.lazykaggler.kernels": ["kernel_output_download"],
+
+    # main functions
+    "commlit.doc_cache": ["DocCache"],
+    "commlit.feat_cache": ["FeatureCache"],
+    "commlit.feat_store": ["write_feature_store", "FeatureStore"],
+    "commlit.freq_index": ["FrequencyIndex"],
+    "commlit.pre_proc": ["gen_ent_df", "gen_sent_df", "gen_token_df",
+                         "gen_tag_df", "TagEncoder"],
+    "commlit.base_feats": ["gen_base_features", "gen_corpus_base_features"],
+    "commlit.feat_eng": ["gen_batch_features"],
+    "commlit.word_vecs": ["gen_word_vec_feat", "gen_batch_word_vec_feat",
+                          "gen_word_vec_matrix", "gen_word_vec_rows"],
+    "commlit.up_scale": ["upscale_targets", "even_upsample",
+                         "even_upsample_array", "upsample_idx",
+                         "AugmentationSampler"],
+    "commlit.raw_feats": ["gen_raw_word_features"],
+    "commlit.train_data": ["gen_train_data", "gen_train_batches",
+                           "prep_train_data", "gather_rows"],
+    "commlit.build_model": ["build_model", "build_model_roles",
+                            "load_standard_weights"],
+    "commlit.export": ["fuse_inputs", "is_fused", "export_numpy",
+                       "NumpyModel", "export_tflite", "TFLiteModel",
+                       "load_exported"],
+    "commlit.cv": ["model_inputs", "fold_ids", "run_cv"],
+    "commlit.sweep": ["Choice", "Uniform", "LogUniform", "sample_config",
+                      "run_sweep"],
+    "commlit.predictor": ["Predictor"],
+    "commlit.serving": ["MicroBatcher", "LocalClient", "run_local"],
+}
+__attr_modules__ = {attr: mod for mod, attrs in __lazy_attrs__.items()
+                    for attr in attrs}
+__all__ = list(__attr_modules__)
+
+def __getattr__(name):
+    if name in __attr_modules__:
+        value = getattr(importlib.import_module(__attr_modules__[name]), name)
+        globals()[name] = value
+        return value
+    raise AttributeError("module %r has no attribute %r"%(__name__, name))
+
+def __dir__():
+    return sorted(list(globals()) + __all__)
+
+class __Package__(types.ModuleType):
+    """
+    Keeps functions that share a name with their module (build_model)
+    from being replaced by the module when it is first imported.
+    """
+    def __setattr__(self, name, value):
+        if name in __attr_modules__ and isinstance(value, types.ModuleType):
+            return
+        super().__setattr__(name, value)
+
+sys.modules[__name__].__class__ = __Package__
@@ -3,8 +3,21 @@
 # Baseline features module # ------------------------ #
 # ------------------------ # ------------------------ #
 
+import numpy as np
 import pandas as pd
+from commlit.helpers.profiling import timed
+from commlit.helpers.segments import seg_codes, seg_unique, seg_mean, \
+    seg_std, seg_top_mean, seg_bin_frac, seg_code_frac
 
+# bucket definitions shared by per-doc and corpus features
+LEN_BINS = [1, 5, 7, 10, 100]
+LEN_LAB = ["frac_" + l for l in ["short", "medium", "long", "huge"]]
+COMM_BINS = [0, 0.0005, 0.0025, 0.025, 0.1, 1]
+COMM_LAB = ["frac_" + l for l in
+            ["very_common", "common", "uncommon", "rare", "very_rare"]]
+
+@timed("base_feats.gen_base_features", 
+       rows=lambda token_df, *a, **k: token_df.shape[0])
 def gen_base_features(token_df, sent_df, ent_df=None, 
                       tag_df=None, all_ents=None):
     """
@@ -30,27 +43,24 @@ def gen_base_features(token_df, sent_df, ent_df=None,
         "comm_score_top20": comm_score_df.tail(20)["comm_score"].mean(),
         "comm_score_top10": comm_score_df.tail(10)["comm_score"].mean(),
         "comm_score_top5": comm_score_df.tail(5)["comm_score"].mean(),
-        "words_per_sent": sent_df["length"].mean(),
+        "words_per_sent": sent_df["sent_length"].mean(),
         "noun_chunks_per_sent": sent_df["noun_chunks"].mean(),
         "frac_stop": word_df["stop"].mean()
     }
     
     # add length buckets
-    len_lab = ["frac_" + l for l in ["short", "medium", "long", "huge"]]
     len_df = word_df.copy()[word_df["length"] > 3]
     len_df.loc[:, "len_cat"] = pd.cut(len_df["length"], 
-                                      [1, 5, 7, 10, 100], 
-                                      labels=len_lab)
+                                      LEN_BINS, 
+                                      labels=LEN_LAB)
     features.update(len_df["len_cat"].value_counts(
         normalize=True).sort_index().to_dict())
 
     # add frequency buckets
-    comm_lab = ["frac_" + l for l in 
-                ["very_common", "common", "uncommon", "rare", "very_rare"]]
     comm_score_df.loc[:, "comm_cat"] = pd.cut(
         comm_score_df["comm_score"], 
-        [0, 0.0005, 0.0025, 0.025, 0.1, 1],
-        labels=comm_lab
+        COMM_BINS,
+        labels=COMM_LAB
     )
     features.update(comm_score_df["comm_cat"].value_counts(
         normalize=True).sort_index().to_dict())
@@ -87,3 +97,99 @@ def gen_base_features(token_df, sent_df, ent_df=None,
             features["avg_ent_len"] = 0
         
     return features
+
+@timed("base_feats.gen_corpus_base_features", 
+       rows=lambda token_df, *a, **k: token_df.shape[0])
+def gen_corpus_base_features(token_df, sent_df, ent_df=None,
+                             tag_df=None, all_ents=None,
+                             ids=None, id_col="id"):
+    """
+    Generates the same features as gen_base_features for all docs at once.
+    ***
+    ARGS
+    token_df: DataFrame, tokens of all docs stacked with an id_col column
+    sent_df: DataFrame, sentences of all docs stacked with an id_col column
+    ent_df: DataFrame, entities of all docs stacked with an id_col column
+    ids: array-like, unique doc ids setting the output row order,
+         defaults to order of appearance in token_df
+    ***
+    Token attributes are held in flat arrays with one segment per doc, so
+    every feature is a single vectorised pass over the corpus. Returns a
+    DataFrame with one row per doc, indexed by id.
+    """
+
+    # segment codes per row
+    if ids is None:
+        ids = pd.unique(token_df[id_col])
+    n = len(ids)
+    seg = seg_codes(token_df[id_col], ids)
+
+    # flat token arrays
+    word = pd.factorize(token_df["word"])[0]
+    length = token_df["length"].values.astype(float)
+    alpha = token_df["alpha"].values.astype(bool)
+    stop = token_df["stop"].values.astype(bool)
+    comm = token_df["comm_score"].values.astype(float)
+
+    # unique (word, value) pairs per doc
+    uniq_len = alpha & seg_unique(np.where(alpha, seg, -1), word, length)
+    comm_ok = ~np.isnan(comm) & ~stop
+    uniq_comm = comm_ok & seg_unique(np.where(comm_ok, seg, -1), word, comm)
+
+    # generate main features
+    s_seg = seg_codes(sent_df[id_col], ids)
+    features = {
+        "word_len_avg": seg_mean(length, seg, n, alpha),
+        "word_len_std": seg_std(length, seg, n, alpha),
+        "word_len_top20": seg_top_mean(length, seg, n, 20, uniq_len),
+        "word_len_top10": seg_top_mean(length, seg, n, 10, uniq_len),
+        "word_len_top5": seg_top_mean(length, seg, n, 5, uniq_len),
+        "comm_score_avg": seg_mean(comm, seg, n, uniq_comm),
+        "comm_score_std": seg_std(comm, seg, n, uniq_comm),
+        "comm_score_top20": seg_top_mean(comm, seg, n, 20, uniq_comm),
+        "comm_score_top10": seg_top_mean(comm, seg, n, 10, uniq_comm),
+        "comm_score_top5": seg_top_mean(comm, seg, n, 5, uniq_comm),
+        "words_per_sent": seg_mean(sent_df["sent_length"].values.astype(
+            float), s_seg, n),
+        "noun_chunks_per_sent": seg_mean(sent_df["noun_chunks"].values.astype(
+            float), s_seg, n),
+        "frac_stop": seg_mean(stop.astype(float), seg, n, alpha)
+    }
+
+    # add length and frequency buckets
+    len_frac = seg_bin_frac(length, seg, n, LEN_BINS, alpha & (length > 3))
+    features.update(zip(LEN_LAB, len_frac.T))
+    comm_frac = seg_bin_frac(comm, seg, n, COMM_BINS, uniq_comm)
+    features.update(zip(COMM_LAB, comm_frac.T))
+
+    # get tag features, last of any tags sharing an adjusted tag wins
+    if tag_df is not None:
+        tag_codes, tag_uniq = pd.factorize(token_df["tag"])
+        tag_frac = seg_code_frac(tag_codes, seg, n, len(tag_uniq))
+        tag_frac = np.nan_to_num(np.hstack([tag_frac, np.zeros((n, 1))]))
+        tag_last = tag_df.drop_duplicates("tag_adj", keep="last")
+        tag_idx = pd.Index(tag_uniq).get_indexer(tag_last["tag"])
+        tag_last = dict(zip(tag_last["tag_adj"], tag_idx))
+        features.update((t, tag_frac[:, tag_last[t]])
+                        for t in pd.unique(tag_df["tag_adj"]))
+
+    # gen ent features
+    if ent_df is not None and all_ents is not None:
+        if ent_df.shape[0] > 0:
+            e_seg = seg_codes(ent_df[id_col], ids)
+            type_codes, type_uniq = pd.factorize(ent_df["type"])
+            ent_frac = seg_code_frac(type_codes, e_seg, n, len(type_uniq))
+            ent_frac = np.nan_to_num(np.hstack([ent_frac, np.zeros((n, 1))]))
+            type_idx = pd.Index(type_uniq).get_indexer(all_ents)
+            features.update((e, ent_frac[:, j]) 
+                            for e, j in zip(all_ents, type_idx))
+            features["avg_ent_words"] = np.nan_to_num(seg_mean(
+                ent_df["n_words"].values.astype(float), e_seg, n))
+            features["avg_ent_len"] = np.nan_to_num(seg_mean(
+                ent_df["length"].values.astype(float), e_seg, n))
+        else:
+            features.update((e, np.zeros(n)) for e in all_ents)
+            features["avg_ent_words"] = np.zeros(n)
+            features["avg_ent_len"] = np.zeros(n)
+
+    return pd.DataFrame(features, index=pd.Index(ids, name=id_col))
@@ -1,44 +1,132 @@
-
 # -------------------------- # -------------------------- #
 # Modele building module --- # -------------------------- #
 # -------------------------- # -------------------------- #
 
+import numpy as np
 import tensorflow as tf
 import keras
 
-def build_model(cnn, att, agg, Q, extra, out):
+class GroupedDense(keras.layers.Layer):
+    """
+    Separate dense projections of each group of a (batch x groups x
+    features) input, computed in one einsum. Each group's kernel is
+    initialised and regularised as a Dense layer of its own would be.
+    """
+
+    def __init__(self, units, activation=None, kernel_regularizer=None,
+                 **kwargs):
+        super().__init__(**kwargs)
+        self.units = units
+        self.activation = keras.activations.get(activation)
+        self.kernel_regularizer = keras.regularizers.get(kernel_regularizer)
+
+    def build(self, input_shape):
+        n_grp, n_in = int(input_shape[-2]), int(input_shape[-1])
+        limit = np.sqrt(6 / (n_in + self.units))
+        self.kernel = self.add_weight(
+            name="kernel", shape=(n_grp, n_in, self.units),
+            initializer=keras.initializers.RandomUniform(-limit, limit),
+            regularizer=self.kernel_regularizer)
+        self.bias = self.add_weight(name="bias", shape=(n_grp, self.units),
+                                    initializer="zeros")
+        super().build(input_shape)
+
+    def call(self, inputs):
+        return self.activation(tf.einsum("bgi,gio->bgo", inputs,
+                                         self.kernel) + self.bias)
+
+    def get_config(self):
+        config = super().get_config()
+        config.update({
+            "units": self.units,
+            "activation": keras.activations.serialize(self.activation),
+            "kernel_regularizer": keras.regularizers.serialize(
+                self.kernel_regularizer)})
+        return config
+
+def build_model(cnn, att, agg, Q, extra, out, fused=False):
+    """
+    Builds the keras model scoring token, aggregate and quantile inputs.
+    ***
+    ARGS
+    fused: bool, if True builds the equivalent CPU-friendly graph, taking
+           (rows x width) token inputs projected with Dense layers rather
+           than (rows x width x 1) inputs and (1 x width) convolutions,
+           and one (n_q x shape) input for all Q branches projected by a
+           single GroupedDense layer (see fuse_inputs and
+           load_standard_weights)
+    ***
+    """
+    return build_model_roles(cnn, att, agg, Q, extra, out, fused=fused)[0]
+
+def build_model_roles(cnn, att, agg, Q, extra, out, fused=False):
     """
+    As build_model, also returning a dict of its weighted layers by role
+    ("cnn", "att", "agg_dense", "q%d_dense" or "q_dense" if fused,
+    "extra" and "out").
+    ***
+    Layers of the standard graph keep keras' default names, as in
+    checkpoints saved before fused graphs existed, so roles are tracked
+    here rather than by layer name. Only the fused graph's layers are
+    named by role.
     """
     
     # all inputs and layers
     all_layers = []
     all_inputs = []
+    roles = {}
+    def role(name, layer):
+        roles[name] = layer
+        return layer
+    def names(name):
+        return {"name": name} if fused else {}
     
     # CNN layer
     if cnn is not None:
-        in_cnn = keras.layers.Input(shape=cnn["shape"][1:])
-        all_inputs.append(in_cnn)
-        cnn_x = keras.layers.Conv2D(
-            filters=cnn["filters"], 
-            kernel_size=(1, cnn["shape"][2]),
-            activation=cnn["acti"],
-            kernel_regularizer=keras.regularizers.l2(cnn["l2_reg"])
-        )(in_cnn)
+        if fused:
+            in_cnn = keras.layers.Input(shape=cnn["shape"][1:3])
+            all_inputs.append(in_cnn)
+            cnn_x = role("cnn", keras.layers.Dense(
+                cnn["filters"],
+                activation=cnn["acti"],
+                kernel_regularizer=keras.regularizers.l2(cnn["l2_reg"]),
+                name="cnn"
+            ))(in_cnn)
+        else:
+            in_cnn = keras.layers.Input(shape=cnn["shape"][1:])
+            all_inputs.append(in_cnn)
+            cnn_x = role("cnn", keras.layers.Conv2D(
+                filters=cnn["filters"], 
+                kernel_size=(1, cnn["shape"][2]),
+                activation=cnn["acti"],
+                kernel_regularizer=keras.regularizers.l2(cnn["l2_reg"])
+            ))(in_cnn)
         
         # "Attention" layer
         if att is not None:
-            in_att = keras.layers.Input(shape=att["shape"][1:])
-            all_inputs.append(in_att)
-            att_x = keras.layers.Conv2D(
-                filters=att["filters"], 
-                kernel_size=(1, att["shape"][2]),
-                activation=att["acti"],
-                kernel_regularizer=keras.regularizers.l2(att["l2_reg"])
-            )(in_att)
+            if fused:
+                in_att = keras.layers.Input(shape=att["shape"][1:3])
+                all_inputs.append(in_att)
+                att_x = role("att", keras.layers.Dense(
+                    att["filters"],
+                    activation=att["acti"],
+                    kernel_regularizer=keras.regularizers.l2(att["l2_reg"]),
+                    name="att"
+                ))(in_att)
+            else:
+                in_att = keras.layers.Input(shape=att["shape"][1:])
+                all_inputs.append(in_att)
+                att_x = role("att", keras.layers.Conv2D(
+                    filters=att["filters"], 
+                    kernel_size=(1, att["shape"][2]),
+                    activation=att["acti"],
+                    kernel_regularizer=keras.regularizers.l2(att["l2_reg"])
+                ))(in_att)
             cnn_x = keras.layers.Multiply()([cnn_x, att_x])
         
         cnn_x = tf.math.reduce_mean(cnn_x, axis=1)
-        cnn_x = keras.layers.Flatten()(cnn_x)
+        if not fused:
+            cnn_x = keras.layers.Flatten()(cnn_x)
         all_layers.append(cnn_x)
       
     # agg feature layer
@@ -47,40 +135,89 @@ def build_model(cnn, att, agg, Q, extra, out):
         all_inputs.append(in_agg)
         agg_x = keras.layers.Dropout(agg["drop"])(in_agg)
         if agg["dense"]:
-            agg_x = keras.layers.Dense(
+            agg_x = role("agg_dense", keras.layers.Dense(
                 agg["n"],
                 activation=agg["acti"],
-                kernel_regularizer=keras.regularizers.l2(agg["l2_reg"])
-            )(agg_x)
+                kernel_regularizer=keras.regularizers.l2(agg["l2_reg"]),
+                **names("agg_dense")
+            ))(agg_x)
         all_layers.append(agg_x)
     
-    # add Q layers
-    for q in range(Q["n_q"]):
+    # add Q layers, as one group if fused
+    if fused and Q["n_q"] > 0:
+        in_q = keras.layers.Input(shape=(Q["n_q"], Q["shape"]))
+        all_inputs.append(in_q)
+        q_x = keras.layers.Dropout(Q["drop"])(in_q)
+        if Q["dense"]:
+            q_x = role("q_dense", GroupedDense(
+                Q["n"],
+                activation=Q["acti"],
+                kernel_regularizer=keras.regularizers.l2(Q["l2_reg"]),
+                name="q_dense"
+            ))(q_x)
+        all_layers.append(keras.layers.Flatten()(q_x))
+    for q in range(0 if fused else Q["n_q"]):
         in_q = keras.layers.Input(shape=Q["shape"])
         all_inputs.append(in_q)
         q_x = keras.layers.Dropout(Q["drop"])(in_q)
         if Q["dense"]:
-            q_x = keras.layers.Dense(
+            q_x = role("q%d_dense"%q, keras.layers.Dense(
                 Q["n"],
                 activation=Q["acti"],
                 kernel_regularizer=keras.regularizers.l2(Q["l2_reg"])
-            )(q_x)
+            ))(q_x)
         all_layers.append(q_x)
         
     # concat layers and add extra dense layer if desired
     all_x = keras.layers.Concatenate()(all_layers)
     if extra["use"]:
-        all_x = keras.layers.Dense(
+        all_x = role("extra", keras.layers.Dense(
             extra["n"],
             activation=extra["acti"],
-            kernel_regularizer=keras.regularizers.l2(extra["l2_reg"])
-        )(all_x)
+            kernel_regularizer=keras.regularizers.l2(extra["l2_reg"]),
+            **names("extra")
+        ))(all_x)
     
     # output layer
-    out_y = keras.layers.Dense(
+    out_y = role("out", keras.layers.Dense(
         1, 
         activation=out["acti"],
-        kernel_regularizer=keras.regularizers.l2(out["l2_reg"])
-    )(all_x)
+        kernel_regularizer=keras.regularizers.l2(out["l2_reg"]),
+        **names("out")
+    ))(all_x)
     
-    return keras.Model(inputs=all_inputs, outputs=out_y)
+    return keras.Model(inputs=all_inputs, outputs=out_y), roles
+
+def load_standard_weights(model, source, cnn, att, agg, Q, extra, out):
+    """
+    Loads weights in the layout of the standard graph into a fused model.
+    ***
+    ARGS
+    model: keras Model built by build_model(..., fused=True)
+    source: keras Model built by build_model(..., fused=False) with the
+            same arguments, or the path of its saved weights
+    ***
+    """
+    std, std_roles = build_model_roles(cnn, att, agg, Q, extra, out)
+    if isinstance(source, str):
+        std.load_weights(source)
+    else:
+        std.set_weights(source.get_weights())
+
+    # copy into a fresh fused graph by role, then into model
+    fused, fused_roles = build_model_roles(cnn, att, agg, Q, extra, out,
+                                           fused=True)
+    for name, layer in fused_roles.items():
+        if name in ["cnn", "att"]:
+            # convolution kernels (1 x width x 1 x filters) become dense
+            kernel, bias = std_roles[name].get_weights()
+            layer.set_weights([kernel[0, :, 0, :], bias])
+        elif name == "q_dense":
+            q_w = [std_roles["q%d_dense"%q].get_weights()
+                   for q in range(Q["n_q"])]
+            layer.set_weights([np.stack([k for k, b in q_w]),
+                               np.stack([b for k, b in q_w])])
+        else:
+            layer.set_weights(std_roles[name].get_weights())
+    model.set_weights(fused.get_weights())
+    return model
@@ -0,0 +1,153 @@
+# -------------------------- # -------------------------- #
+# Cross-validation runner -- # -------------------------- #
+# -------------------------- # -------------------------- #
+
+import os
+import time
+import shutil
+import tempfile
+import numpy as np
+import multiprocessing as mp
+from concurrent.futures import ProcessPoolExecutor
+from commlit.helpers.workers import share_arrays, init_worker, \
+    worker_arrays, release_arrays, set_seed, row_batches
+
+def model_inputs(x, a, m, q):
+    """
+    Model inputs in build_model order from the x, a, m and q outputs of
+    gen_train_data, dropping the id columns of m and q.
+    """
+    inputs = [x]
+    if a is not None:
+        inputs.append(a)
+    per_id = [] if m is None else [m]
+    per_id += list(q.values())
+    inputs += [f.drop(columns=["id", "grp_id"]).to_numpy(np.float32)
+               for f in per_id]
+    return inputs
+
+def fold_ids(ids, n_folds=5, seed=42):
+    """
+    Assigns each row to a fold by its id, so all upsampled copies of an
+    id fall in the same fold. Ids are shuffled with seed and dealt to
+    folds in turn, giving folds of near equal numbers of ids.
+    """
+    uniq, codes = np.unique(np.asarray(ids), return_inverse=True)
+    n_id = len(uniq)
+    if n_id < n_folds:
+        raise ValueError("Cannot split %d ids into %d folds!"%(n_id,
+                                                              n_folds))
+    id_fold = np.empty(n_id, dtype=int)
+    id_fold[np.random.default_rng(seed).permutation(n_id)] = \
+        np.arange(n_id) % n_folds
+    return id_fold[codes]
+
+def __run_fold__(task):
+    """
+    Trains a model on the training rows of a fold and predicts its
+    validation rows, returning predictions and timings.
+    """
+    fold, train_idx, val_idx, model_config, compile_kwargs, fit_kwargs, \
+        batch_size, seed, weights_dir = task
+    from commlit.build_model import build_model
+    inputs, y = worker_arrays()
+    set_seed(seed + fold)
+
+    # train on the fold's training rows
+    t = time.perf_counter()
+    model = build_model(**model_config)
+    model.compile(**compile_kwargs)
+    hist = model.fit(row_batches(inputs, y, train_idx, batch_size, True,
+                                 seed + fold), verbose=0, **fit_kwargs)
+    fit_secs = time.perf_counter() - t
+
+    # predict held-out rows in order
+    t = time.perf_counter()
+    pred = model.predict(row_batches(inputs, None, val_idx, batch_size,
+                                     False, seed), verbose=0)
+    pred_secs = time.perf_counter() - t
+    if weights_dir is not None:
+        model.save_weights(os.path.join(weights_dir, "fold_%d.h5"%fold))
+
+    return {"fold": fold, "val_idx": val_idx, "pred": pred.ravel(),
+            "n_train": len(train_idx), "n_val": len(val_idx),
+            "fit_secs": fit_secs, "predict_secs": pred_secs,
+            "history": {k: [float(v) for v in vals]
+                        for k, vals in hist.history.items()},
+            "pid": os.getpid()}
+
+def run_cv(inputs, y, ids, model_config, n_folds=5, n_jobs=None,
+           compile_kwargs=None, fit_kwargs=None, batch_size=32,
+           intra_threads=1, inter_threads=1, seed=42, tmp_dir=None,
+           weights_dir=None):
+    """
+    Trains build_model on K folds split by id in parallel processes.
+    ***
+    ARGS
+    inputs: list of arrays in build_model order (see model_inputs)
+    y: array of targets of each row
+    ids: array of the id of each row, e.g. frame["id"] of gen_train_data
+    model_config: dict, build_model arguments
+    compile_kwargs: dict, arguments of model.compile, by default
+                    {"optimizer": "adam", "loss": "mse"}
+    fit_kwargs: dict, arguments of model.fit, by default {"epochs": 10}
+    n_jobs: int, worker processes; defaults to as many folds as fit in
+            the available cores at intra_threads each, and 1 trains
+            folds one after another in the current process
+    intra_threads: int, tensorflow intra-op threads of each worker
+    inter_threads: int, tensorflow inter-op threads of each worker
+    tmp_dir: str, directory for the shared memory-mapped arrays
+             (a temporary directory removed afterwards by default)
+    weights_dir: str, if given each fold's weights are saved there
+    ***
+    Arrays are written once to memory-mapped files every worker reads
+    from, and batches are gathered from them, so memory does not grow
+    with n_jobs. Returns out-of-fold predictions of each row, the fold
+    of each row, and a DataFrame of per-fold timings and histories.
+    """
+    import pandas as pd
+    if compile_kwargs is None:
+        compile_kwargs = {"optimizer": "adam", "loss": "mse"}
+    if fit_kwargs is None:
+        fit_kwargs = {"epochs": 10}
+    y = np.asarray(y, dtype=np.float32).ravel()
+    folds = fold_ids(ids, n_folds=n_folds, seed=seed)
+    if n_jobs is None:
+        n_jobs = max(1, min(n_folds, (os.cpu_count() or 1) //
+                            max(intra_threads or 1, 1)))
+    if weights_dir is not None and not os.path.isdir(weights_dir):
+        os.makedirs(weights_dir)
+
+    # share arrays through memory-mapped files
+    own_tmp = tmp_dir is None
+    tmp_dir = tempfile.mkdtemp() if own_tmp else tmp_dir
+    try:
+        paths = share_arrays(list(inputs) + [y], tmp_dir)
+        tasks = [(k, np.flatnonzero(folds != k), np.flatnonzero(folds == k),
+                  model_config, compile_kwargs, fit_kwargs, batch_size,
+                  seed, weights_dir) for k in range(n_folds)]
+        initargs = (paths[:-1], paths[-1], intra_threads, inter_threads)
+
+        if n_jobs == 1:
+            init_worker(paths[:-1], paths[-1])
+            results = [__run_fold__(task) for task in tasks]
+            release_arrays()
+        else:
+            # spawned workers, as tensorflow is not fork-safe
+            with ProcessPoolExecutor(max_workers=n_jobs,
+                                     mp_context=mp.get_context("spawn"),
+                                     initializer=init_worker,
+                                     initargs=initargs) as ex:
+                results = list(ex.map(__run_fold__, tasks))
+    finally:
+        if own_tmp:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    # out-of-fold predictions in row order
+    oof = np.full(len(y), np.nan)
+    for r in results:
+        oof[r["val_idx"]] = r["pred"]
+    timings = pd.DataFrame([{k: v for k, v in r.items()
+                             if k not in ["val_idx", "pred"]}
+                            for r in results]).set_index("fold")
+    return oof, folds, timings
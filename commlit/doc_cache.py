@@ -0,0 +1,99 @@
+# -------------------------- # -------------------------- #
+# Parsed document cache ---- # -------------------------- #
+# -------------------------- # -------------------------- #
+
+import srsly
+from spacy.tokens import DocBin
+from commlit.helpers.shard_cache import ShardCache
+
+def __shard_bytes__(docs):
+    """
+    Serialises docs to a DocBin plus the tensor of each doc, which DocBin
+    leaves out but token.vector reads from in models without a vectors
+    table (e.g. en_core_web_sm).
+    """
+    doc_bin = DocBin()
+    for doc in docs:
+        doc_bin.add(doc)
+    return srsly.msgpack_dumps({"docs": doc_bin.to_bytes(),
+                                "tensors": [doc.tensor for doc in docs]})
+
+def __shard_docs__(shard_bytes, vocab):
+    """
+    Rebuilds docs serialised by __shard_bytes__, with their tensors.
+    """
+    shard = srsly.msgpack_loads(shard_bytes)
+    docs = list(DocBin().from_bytes(shard["docs"]).get_docs(vocab))
+    for doc, tensor in zip(docs, shard["tensors"]):
+        if tensor.size > 0:
+            doc.tensor = tensor
+    return docs
+
+class DocCache(ShardCache):
+    """
+    Content-addressed on-disk cache of parsed spacy docs.
+    ***
+    ARGS
+    cache_dir: str, directory holding shards of docs and a manifest
+    nlp: spacy pipeline used to parse misses and rebuild cached docs
+    max_bytes: int, cache size above which least recently used shards
+               are evicted
+    readonly: bool, if True new docs and shard access times are kept
+              in memory (see pop_new) instead of being written, e.g. in
+              worker processes
+    ***
+    Docs are keyed by a hash of the excerpt plus the pipeline name and
+    version, so changing the pipeline never returns stale parses. Any
+    caller of gen_raw_word_features (or other per-doc functions) can
+    use pipe in place of nlp.pipe to only parse misses.
+    """
+    NAME = "DocCache"
+    SUFFIX = ".shard"
+    ITEMS = "docs"
+    LOAD_ERRORS = (IOError, OSError, ValueError, KeyError)
+
+    def __init__(self, cache_dir, nlp, max_bytes=2*1024**3, readonly=False):
+        super().__init__(cache_dir, nlp, max_bytes=max_bytes,
+                         readonly=readonly)
+
+    def __dumps__(self, docs):
+        return __shard_bytes__(docs)
+
+    def __loads__(self, shard_bytes):
+        return __shard_docs__(shard_bytes, self.nlp.vocab)
+
+    def pipe(self, texts, as_tuples=False, batch_size=1000, **kwargs):
+        """
+        Drop-in for nlp.pipe that loads cached docs and only parses misses.
+        Docs are yielded in the order of texts.
+        """
+        texts = iter(texts)
+        while True:
+            batch = [t for _, t in zip(range(batch_size), texts)]
+            if len(batch) == 0:
+                break
+            if as_tuples:
+                batch, context = zip(*batch)
+            keys = [self.key(t) for t in batch]
+            docs = self.get(keys)
+
+            # parse misses and store them
+            miss = [k not in docs for k in keys]
+            miss_keys = [k for k, m in zip(keys, miss) if m]
+            miss_docs = list(self.nlp.pipe([t for t, m in zip(batch, miss)
+                                            if m], **kwargs))
+            docs.update(zip(miss_keys, miss_docs))
+            self.store(miss_keys, miss_docs)
+            self.hits += len(keys) - len(miss_keys)
+            self.misses += len(miss_keys)
+
+            if as_tuples:
+                for k, c in zip(keys, context):
+                    yield docs[k], c
+            else:
+                for k in keys:
+                    yield docs[k]
+
+        # persist access times of hits
+        if not self.readonly:
+            self.__save_manifest__()
@@ -0,0 +1,292 @@
+# -------------------------- # -------------------------- #
+# CPU inference export ----- # -------------------------- #
+# -------------------------- # -------------------------- #
+
+import re
+import json
+import numpy as np
+
+# activations of the layers build_model uses, in numpy
+ACTIVATIONS = {
+    "linear": lambda x: x,
+    "relu": lambda x: np.maximum(x, 0),
+    "sigmoid": lambda x: 1 / (1 + np.exp(-x)),
+    "tanh": np.tanh,
+    "elu": lambda x: np.where(x > 0, x, np.expm1(np.minimum(x, 0))),
+    "softplus": lambda x: np.logaddexp(x, 0),
+}
+
+def fuse_inputs(inputs, n_q):
+    """
+    Converts inputs of a standard model ([x, a, m, *q] with 4-d token
+    arrays) to those of a fused one, with 3-d token arrays and the n_q
+    quantile arrays stacked into one (batch x n_q x shape) array.
+    """
+    n_other = len(inputs) - n_q
+    fused = [i[..., 0] if np.ndim(i) == 4 else i for i in inputs[:n_other]]
+    if n_q > 0:
+        fused.append(np.stack(inputs[n_other:], axis=1))
+    return fused
+
+def is_fused(model):
+    """
+    Whether a model built by build_model (or a TFLiteModel export of one)
+    takes fused inputs, i.e. has a 3-d token or stacked quantile input.
+    Fused models without either take the same inputs as standard ones.
+    """
+    if hasattr(model, "input_shapes"):
+        shapes = model.input_shapes
+    else:
+        shapes = [i.shape for i in getattr(model, "inputs", None) or []]
+    return any(len(s) == 3 for s in shapes)
+
+def __role_weights__(model, config):
+    """
+    Weights of a standard or fused build_model model by layer role, with
+    token kernels as (width x filters) and quantile kernels stacked into
+    (n_q x shape x n).
+    """
+    from commlit.build_model import build_model_roles
+
+    # rebuild the same graph to address layers by role
+    rebuilt, roles = build_model_roles(**config, fused=is_fused(model))
+    rebuilt.set_weights(model.get_weights())
+    weights = {}
+    for name, layer in roles.items():
+        kernel, bias = layer.get_weights()
+        if name in ["cnn", "att"] and kernel.ndim == 4:
+            kernel = kernel[0, :, 0, :]
+        if re.match("q[0-9]+_dense$", name):
+            continue
+        weights[name] = (kernel, bias)
+    if "q0_dense" in roles:
+        q_w = [roles["q%d_dense"%q].get_weights()
+               for q in range(config["Q"]["n_q"])]
+        weights["q_dense"] = (np.stack([k for k, b in q_w]),
+                              np.stack([b for k, b in q_w]))
+    return weights
+
+def export_numpy(model, path, cnn, att, agg, Q, extra, out):
+    """
+    Saves the weights and layout of a model built by build_model (with
+    these arguments, fused or not) as an .npz file for NumpyModel.
+    """
+    layout = {"cnn": None, "att": None, "agg": None, "Q": None,
+              "extra": None, "out": out["acti"]}
+    if cnn is not None:
+        layout["cnn"] = cnn["acti"]
+        if att is not None:
+            layout["att"] = att["acti"]
+    if agg is not None:
+        layout["agg"] = agg["acti"] if agg["dense"] else "none"
+    if Q["n_q"] > 0:
+        layout["Q"] = Q["acti"] if Q["dense"] else "none"
+        layout["n_q"] = Q["n_q"]
+    if extra["use"]:
+        layout["extra"] = extra["acti"]
+    for acti in layout.values():
+        if isinstance(acti, str) and acti != "none" and \
+           acti not in ACTIVATIONS:
+            raise ValueError("Activation %s cannot be exported!"%acti)
+
+    weights = __role_weights__(model, {"cnn": cnn, "att": att, "agg": agg,
+                                       "Q": Q, "extra": extra, "out": out})
+    arrays = {"layout": np.array(json.dumps(layout))}
+    for name, (kernel, bias) in weights.items():
+        arrays[name + "/kernel"] = kernel.astype(np.float32)
+        arrays[name + "/bias"] = bias.astype(np.float32)
+    np.savez(path, **arrays)
+
+class NumpyModel:
+    """
+    Pure numpy forward pass of a model exported with export_numpy, for
+    scoring without loading tensorflow.
+    ***
+    Takes inputs in the order and layout of the standard build_model
+    graph ([x, a, m, *q] with 4-d token arrays, as Predictor.inputs
+    returns them) or of the fused one, and returns (batch x 1) scores.
+    Dropout is inactive, as in keras inference.
+    """
+
+    def __init__(self, layout, weights):
+        self.layout = layout
+        self.weights = weights
+        self.name = "numpy_model"
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as f:
+            layout = json.loads(str(f["layout"]))
+            weights = {}
+            for k in f.files:
+                if k != "layout":
+                    name, part = k.split("/")
+                    weights.setdefault(name, {})[part] = f[k]
+        return cls(layout, {k: (w["kernel"], w["bias"])
+                            for k, w in weights.items()})
+
+    def __dense__(self, name, x, acti):
+        kernel, bias = self.weights[name]
+        return ACTIVATIONS[acti](x @ kernel + bias)
+
+    def predict(self, inputs, batch_size=None):
+        """
+        Scores inputs, batch_size rows at a time if given.
+        """
+        n = len(inputs[0])
+        if batch_size is None or batch_size >= n:
+            return self.__forward__(inputs)
+        return np.concatenate([
+            self.__forward__([i[b:b+batch_size] for i in inputs])
+            for b in range(0, n, batch_size)])
+
+    def __call__(self, inputs, training=False):
+        return self.__forward__(inputs)
+
+    def __forward__(self, inputs):
+        layout = self.layout
+        inputs = [np.asarray(i, dtype=np.float32) for i in inputs]
+        pos = 0
+        layers = []
+
+        # token projections, averaged over rows
+        if layout["cnn"] is not None:
+            x = inputs[pos]
+            x = x[..., 0] if x.ndim == 4 else x
+            cnn_x = self.__dense__("cnn", x, layout["cnn"])
+            pos += 1
+            if layout["att"] is not None:
+                a = inputs[pos]
+                a = a[..., 0] if a.ndim == 4 else a
+                cnn_x = cnn_x * self.__dense__("att", a, layout["att"])
+                pos += 1
+            layers.append(cnn_x.mean(axis=1))
+
+        # aggregate features
+        if layout["agg"] is not None:
+            agg_x = inputs[pos]
+            if layout["agg"] != "none":
+                agg_x = self.__dense__("agg_dense", agg_x, layout["agg"])
+            layers.append(agg_x)
+            pos += 1
+
+        # quantile features, stacked unless already grouped
+        if layout["Q"] is not None:
+            q_in = inputs[pos:]
+            q = q_in[0] if len(q_in) == 1 and q_in[0].ndim == 3 else \
+                np.stack(q_in, axis=1)
+            if layout["Q"] != "none":
+                kernel, bias = self.weights["q_dense"]
+                q = ACTIVATIONS[layout["Q"]](
+                    np.einsum("bgi,gio->bgo", q, kernel) + bias)
+            layers.append(q.reshape(q.shape[0], -1))
+
+        all_x = np.concatenate(layers, axis=1)
+        if layout["extra"] is not None:
+            all_x = self.__dense__("extra", all_x, layout["extra"])
+        return self.__dense__("out", all_x, layout["out"])
+
+def export_tflite(model, path, quantize=False):
+    """
+    Converts a model built by build_model to a TFLite flatbuffer, with
+    dynamic-range quantized weights if quantize. Keras input names are
+    saved alongside (path + ".json") so TFLiteModel feeds inputs in the
+    keras order.
+    """
+    import tensorflow as tf
+    converter = tf.lite.TFLiteConverter.from_keras_model(model)
+    if quantize:
+        converter.optimizations = [tf.lite.Optimize.DEFAULT]
+    with open(path, "wb") as wf:
+        wf.write(converter.convert())
+    with open(path + ".json", "w") as wf:
+        json.dump({"inputs": [i.name.split(":")[0] for i in model.inputs],
+                   "name": model.name}, wf)
+
+class TFLiteModel:
+    """
+    Runs a flatbuffer saved by export_tflite with tflite_runtime if it
+    is installed (so tensorflow is not loaded), else tf.lite.
+    ***
+    ARGS
+    path: str, .tflite file
+    num_threads: int, interpreter threads
+    ***
+    Takes inputs in the order and layout of the exported keras model,
+    whose name it keeps, and returns (batch x 1) scores.
+    """
+
+    def __init__(self, path, num_threads=None):
+        try:
+            from tflite_runtime.interpreter import Interpreter
+        except ImportError:
+            import tensorflow as tf
+            Interpreter = tf.lite.Interpreter
+        self.interpreter = Interpreter(model_path=path,
+                                       num_threads=num_threads)
+        with open(path + ".json") as rf:
+            meta = json.load(rf)
+        self.name = meta["name"]
+        self.batch = None
+
+        # map keras inputs to interpreter inputs by name, else by order
+        details = self.interpreter.get_input_details()
+        by_name = {}
+        for d in details:
+            m = re.match("serving_default_(.+):[0-9]+$", d["name"])
+            by_name[m.group(1) if m else d["name"]] = d["index"]
+        if all(n in by_name for n in meta["inputs"]):
+            self.input_idx = [by_name[n] for n in meta["inputs"]]
+        else:
+            self.input_idx = [d["index"] for d in details]
+        self.output_idx = self.interpreter.get_output_details()[0]["index"]
+        shapes = {d["index"]: d["shape"] for d in details}
+        self.input_shapes = [shapes[idx] for idx in self.input_idx]
+
+    def __forward__(self, inputs):
+        inputs = [np.ascontiguousarray(i, dtype=np.float32) for i in inputs]
+        if self.batch != len(inputs[0]):
+            for idx, i in zip(self.input_idx, inputs):
+                self.interpreter.resize_tensor_input(idx, i.shape)
+            self.interpreter.allocate_tensors()
+            self.batch = len(inputs[0])
+        for idx, i in zip(self.input_idx, inputs):
+            self.interpreter.set_tensor(idx, i)
+        self.interpreter.invoke()
+        return self.interpreter.get_tensor(self.output_idx).copy()
+
+    def predict(self, inputs, batch_size=None):
+        """
+        Scores inputs, batch_size rows at a time if given.
+        """
+        n = len(inputs[0])
+        if batch_size is None or batch_size >= n:
+            return self.__forward__(inputs)
+        return np.concatenate([
+            self.__forward__([i[b:b+batch_size] for i in inputs])
+            for b in range(0, n, batch_size)])
+
+    def __call__(self, inputs, training=False):
+        return self.__forward__(inputs)
+
+def load_exported(path, **kwargs):
+    """
+    Loads an exported model by file type (.npz or .tflite).
+    """
+    if path.endswith(".npz"):
+        return NumpyModel.load(path)
+    if path.endswith(".tflite"):
+        return TFLiteModel(path, **kwargs)
+    raise ValueError("Unknown export format of %s!"%path)
+
+def check_parity(model, exported, inputs, tol=1e-4):
+    """
+    Max absolute difference between keras and exported predictions on
+    inputs of the keras model, raising if above tol.
+    """
+    a = np.asarray(model(inputs, training=False))
+    b = np.asarray(exported.predict(inputs))
+    diff = float(np.abs(a - b).max())
+    if diff > tol:
+        raise AssertionError("Exported predictions differ by %g!"%diff)
+    return diff
@@ -0,0 +1,165 @@
+# -------------------------- # -------------------------- #
+# Feature result cache ----- # -------------------------- #
+# -------------------------- # -------------------------- #
+
+import pickle
+import hashlib
+import numpy as np
+import pandas as pd
+from commlit.freq_index import FrequencyIndex
+from commlit.pre_proc import TagEncoder, gen_token_df, gen_sent_df, \
+    gen_ent_df
+from commlit.base_feats import gen_corpus_base_features
+from commlit.word_vecs import gen_batch_word_vec_feat
+from commlit.raw_feats import gen_raw_word_features
+from commlit.helpers.shard_cache import ShardCache
+
+def __update_hash__(h, obj):
+    """
+    Feeds a canonical encoding of obj into hash h.
+    """
+    if isinstance(obj, dict):
+        h.update(b"{")
+        for k in sorted(obj):
+            __update_hash__(h, k)
+            __update_hash__(h, obj[k])
+        h.update(b"}")
+    elif isinstance(obj, (list, tuple)):
+        h.update(b"[")
+        for v in obj:
+            __update_hash__(h, v)
+        h.update(b"]")
+    elif isinstance(obj, pd.DataFrame):
+        __update_hash__(h, obj.columns.tolist())
+        h.update(pd.util.hash_pandas_object(obj, index=False).values.tobytes())
+    elif isinstance(obj, np.ndarray):
+        h.update(str(obj.dtype).encode("utf-8") + obj.tobytes())
+    elif isinstance(obj, FrequencyIndex):
+        __update_hash__(h, [obj.keys, obj.counts])
+    elif isinstance(obj, TagEncoder):
+        __update_hash__(h, [obj.keys, obj.col_idx, obj.columns])
+    else:
+        h.update(repr(obj).encode("utf-8"))
+
+def param_hash(params):
+    """
+    Hash of the parameters a feature depends on. DataFrames, arrays,
+    FrequencyIndex and TagEncoder objects are hashed by content.
+    """
+    h = hashlib.sha1()
+    __update_hash__(h, params)
+    return h.hexdigest()
+
+class FeatureCache(ShardCache):
+    """
+    On-disk cache of per-doc feature outputs, keyed by a hash of the
+    excerpt plus a hash of only the parameters each feature depends on.
+    ***
+    ARGS
+    cache_dir: str, directory holding pickled shards and a manifest
+    nlp: spacy pipeline, whose name and version are part of doc keys
+    max_bytes: int, cache size above which least recently used shards
+               are evicted
+    readonly: bool, if True new results and shard access times are kept
+              in memory (see pop_new) instead of being written, e.g. in
+              worker processes
+    ***
+    Base features depend on freq_df, tag_df and all_ents, word-vec
+    features on their method and q or nq, and raw word features on
+    tag_df, freq_df and their keyword arguments. Changing e.g. the
+    word-vec quantiles thus only recomputes word-vec features.
+    """
+    NAME = "FeatureCache"
+    SUFFIX = ".pkl"
+    ITEMS = "results"
+    LOAD_ERRORS = (IOError, OSError, EOFError, pickle.UnpicklingError)
+
+    def __dumps__(self, values):
+        return pickle.dumps(list(values), protocol=pickle.HIGHEST_PROTOCOL)
+
+    def __loads__(self, shard_bytes):
+        return pickle.loads(shard_bytes)
+
+    def lookup(self, name, docs, params, compute):
+        """
+        Returns the results of feature name for each doc, loading cached
+        results and computing the rest.
+        ***
+        ARGS
+        name: str, feature group
+        docs: list of parsed docs
+        params: dict, every parameter the results depend on
+        compute: function of a list of missing docs, returning a list of
+                 their results
+        ***
+        """
+        p_key = param_hash(params)
+        keys = ["%s:%s:%s"%(name, self.key(doc.text), p_key) for doc in docs]
+        results = self.get(keys)
+
+        # compute misses and store them
+        miss_keys = [k for k in keys if k not in results]
+        miss_docs = [d for d, k in zip(docs, keys) if k not in results]
+        if len(miss_docs) > 0:
+            new = list(compute(miss_docs))
+            results.update(zip(miss_keys, new))
+            self.store(miss_keys, new)
+        self.hits += len(keys) - len(miss_keys)
+        self.misses += len(miss_keys)
+
+        # persist access times of hits
+        if not self.readonly:
+            self.__save_manifest__()
+
+        return [results[k] for k in keys]
+
+    def base_features(self, docs, freq_df=None, tag_df=None, all_ents=None):
+        """
+        Cached gen_corpus_base_features of docs, as a DataFrame with one
+        row per doc.
+        """
+        def compute(miss_docs):
+            pos = range(len(miss_docs))
+            def stack(frames):
+                return pd.concat(frames, keys=pos, names=["id", None]
+                                 ).reset_index(level=0)
+            ent_df = None
+            if all_ents is not None:
+                ent_df = stack([gen_ent_df(doc) for doc in miss_docs])
+            feat = gen_corpus_base_features(
+                stack([gen_token_df(doc, freq_df) for doc in miss_docs]),
+                stack([gen_sent_df(doc) for doc in miss_docs]), ent_df,
+                tag_df=tag_df, all_ents=all_ents, ids=pos)
+            return feat.to_dict("records")
+        return pd.DataFrame(self.lookup(
+            "base_features", docs, {"freq_df": freq_df, "tag_df": tag_df,
+                                    "all_ents": all_ents}, compute))
+
+    def word_vec_feat(self, docs, method="qval_fp", q=[0.2, 0.8], nq=3,
+                      **kwargs):
+        """
+        Cached gen_batch_word_vec_feat of docs, as a DataFrame with one
+        row per doc.
+        """
+        def compute(miss_docs):
+            return gen_batch_word_vec_feat(miss_docs, method=method, q=q,
+                                           nq=nq, **kwargs
+                                           ).to_dict("records")
+        params = {"method": method}
+        if method == "qval_fp":
+            params["q"] = list(q)
+        else:
+            params["nq"] = nq
+        return pd.DataFrame(self.lookup("word_vec_feat", docs, params,
+                                        compute))
+
+    def raw_word_features(self, docs, tag_df=None, freq_df=None, **kwargs):
+        """
+        Cached gen_raw_word_features of docs, as a list of DataFrames.
+        """
+        def compute(miss_docs):
+            return [gen_raw_word_features(doc, tag_df, freq_df, **kwargs)
+                    for doc in miss_docs]
+        return self.lookup("raw_word_features", docs,
+                           {"tag_df": tag_df, "freq_df": freq_df, **kwargs},
+                           compute)
@@ -1,73 +1,292 @@
-
 # -------------------------- # -------------------------- #
 # Feature engineering module # -------------------------- #
 # -------------------------- # -------------------------- #
 
+import os
 import numpy as np
 import pandas as pd
 from tqdm import tqdm
+from itertools import islice
+from concurrent.futures import ProcessPoolExecutor
+from commlit.doc_cache import DocCache
+from commlit.feat_cache import FeatureCache
+from commlit.freq_index import FrequencyIndex
+from commlit.helpers import profiling
+from commlit.helpers.profiling import stage, timed
 from commlit.pre_proc import gen_ent_df, gen_sent_df, gen_token_df
-from commlit.base_feats import gen_base_features
-from commlit.word_vecs import gen_word_vec_feat, gen_word_vec_matrix
+from commlit.base_feats import gen_corpus_base_features
+from commlit.word_vecs import gen_batch_word_vec_feat, gen_word_vec_matrix
+
+# state shared by all chunks processed in a worker process
+_worker_env = {}
+
+def __doc_features__(doc, freq_df, all_ents=None, n_rep=1,
+                     word_vec_raw=False):
+    """
+    Extracts token, sentence and entity frames and (optionally n_rep)
+    word vector matrices from a single parsed doc.
+    """
+
+    # pre-process doc
+    token_df = gen_token_df(doc, freq_df)
+    sent_df = gen_sent_df(doc)
+    if all_ents is not None:
+        ent_df = gen_ent_df(doc)
+    else:
+        ent_df = None
+
+    # extract word vectors and re-sample for each repetition
+    if word_vec_raw:
+        word_vec = [gen_word_vec_matrix(doc) for n in range(n_rep)]
+    else:
+        word_vec = None
+
+    return token_df, sent_df, ent_df, word_vec
+
+@timed("feat_eng.chunk_features", rows=lambda docs, *a, **k: len(docs))
+def __chunk_features__(docs, freq_df, tag_df=None, all_ents=None, n_rep=1,
+                       word_vec_raw=False, word_vec_feat=False,
+                       feat_cache=None, **kwargs):
+    """
+    Extracts features from a chunk of parsed docs, with basic and
+    word-vec features computed for the whole chunk at once, or loaded
+    from feat_cache where available.
+    """
+    if feat_cache is not None:
+        base_df = feat_cache.base_features(docs, freq_df, tag_df=tag_df,
+                                           all_ents=all_ents)
+        if word_vec_feat:
+            wv_df = feat_cache.word_vec_feat(docs, **kwargs)
+        else:
+            wv_df = pd.DataFrame(index=base_df.index)
+        if word_vec_raw:
+            word_vec = [[gen_word_vec_matrix(doc) for n in range(n_rep)]
+                        for doc in docs]
+        else:
+            word_vec = [None] * len(docs)
+        return base_df, wv_df, word_vec
+
+    doc_feats = [__doc_features__(doc, freq_df, all_ents=all_ents,
+                                  n_rep=n_rep, word_vec_raw=word_vec_raw)
+                 for doc in docs]
+
+    # stack frames of all docs, keyed by position in the chunk
+    pos = range(len(doc_feats))
+    def stack(k):
+        return pd.concat([f[k] for f in doc_feats], keys=pos,
+                         names=["id", None]).reset_index(level=0)
+
+    # extract basic features
+    base_df = gen_corpus_base_features(
+        stack(0), stack(1), stack(2) if all_ents is not None else None,
+        tag_df=tag_df, all_ents=all_ents, ids=pos
+    ).reset_index(drop=True)
+
+    # add word-vec features if True
+    if word_vec_feat:
+        wv_df = gen_batch_word_vec_feat(docs, [f[0] for f in doc_feats],
+                                        **kwargs)
+    else:
+        wv_df = pd.DataFrame(index=base_df.index)
+
+    return base_df, wv_df, [f[3] for f in doc_feats]
+
+def __chunks__(items, chunk_size):
+    """
+    Splits an iterable into lists of up to chunk_size items.
+    """
+    items = iter(items)
+    chunk = list(islice(items, chunk_size))
+    while len(chunk) > 0:
+        yield chunk
+        chunk = list(islice(items, chunk_size))
+
+def __init_worker__(nlp, feat_kwargs, cache_dir=None, profile=None,
+                    feat_cache_dir=None):
+    """
+    Stores the spacy pipeline and feature arguments in a worker process,
+    along with read-only views of the doc and feature caches if used.
+    Stats are collected if profile is set (to the trace_memory setting).
+    """
+    if profile is not None:
+        profiling.start_collecting(trace_memory=profile)
+    _worker_env["nlp"] = nlp
+    _worker_env["feat_kwargs"] = feat_kwargs
+    if cache_dir is not None:
+        _worker_env["doc_cache"] = DocCache(cache_dir, nlp, readonly=True)
+    else:
+        _worker_env["doc_cache"] = None
+    if feat_cache_dir is not None:
+        feat_kwargs["feat_cache"] = FeatureCache(feat_cache_dir, nlp,
+                                                 readonly=True)
+
+def __process_chunk__(chunk):
+    """
+    Parses a chunk of (excerpt, id) tuples and extracts their features
+    in a worker process, returning results in the order received. Docs
+    newly parsed by a cache-backed worker and any stats collected are
+    returned for the parent process to store, as are features newly
+    computed by a worker with a feature cache.
+    """
+    seed, doc_tups = chunk
+    np.random.seed(seed)
+    doc_cache = _worker_env["doc_cache"]
+    if doc_cache is None:
+        docs = __parse__(doc_tups, _worker_env["nlp"].pipe)
+        cache_res = None
+    else:
+        hits, misses = doc_cache.hits, doc_cache.misses
+        docs = __parse__(doc_tups, doc_cache.pipe)
+        cache_res = (doc_cache.hits - hits, doc_cache.misses - misses,
+                     *doc_cache.pop_new())
+    feat_kwargs = _worker_env["feat_kwargs"]
+    feat_cache = feat_kwargs.get("feat_cache")
+    if feat_cache is not None:
+        hits, misses = feat_cache.hits, feat_cache.misses
+    res = __chunk_features__(docs, **feat_kwargs)
+    if feat_cache is not None:
+        feat_cache_res = (feat_cache.hits - hits, feat_cache.misses - misses,
+                          *feat_cache.pop_new())
+    else:
+        feat_cache_res = None
+    stats = profiling.pop_stats() if profiling.enabled() else None
+    return res, cache_res, feat_cache_res, stats
+
+def __parse__(doc_tups, doc_pipe):
+    """
+    Parses (excerpt, id) tuples with nlp.pipe or DocCache.pipe.
+    """
+    with stage("feat_eng.parse", rows=len(doc_tups)):
+        return [doc for doc, i in doc_pipe(doc_tups, as_tuples=True)]
+
+def __run_serial__(chunks, doc_pipe, feat_kwargs):
+    """
+    Yields chunk features processed in the current process.
+    """
+    with tqdm(total=sum(len(c) for c in chunks)) as pbar:
+        for doc_tups in chunks:
+            res = __chunk_features__(__parse__(doc_tups, doc_pipe), 
+                                     **feat_kwargs)
+            pbar.update(len(doc_tups))
+            yield res
 
-def gen_batch_features(df, nlp, freq_df, 
+def gen_batch_features(df, nlp, freq_df,
                        tag_df=None, all_ents=None,
                        n_rep=1, noisy_y=False,
                        word_vec_raw=False,
-                       word_vec_feat=False, **kwargs):
+                       word_vec_feat=False, *,
+                       n_jobs=1, chunk_size=200,
+                       doc_cache=None, feat_cache=None, **kwargs):
     """
+    Generates features for all excerpts in df.
+    ***
+    ARGS
+    n_jobs: int, number of worker processes used to parse docs and
+            extract features; 1 runs in the current process and -1
+            uses all available cores
+    chunk_size: int, number of excerpts processed at a time
+    doc_cache: DocCache, if provided parsed docs are loaded from it and
+               only excerpts missing from the cache are parsed
+    feat_cache: FeatureCache, if provided base and word-vec features are
+                loaded from it and only invalidated ones are computed
+    ***
+    freq_df may be a DataFrame or a FrequencyIndex; DataFrames are
+    indexed once up front rather than merged onto every doc.
+    Results are returned in the same order as the rows of df
+    regardless of n_jobs.
     """
-    
+
     doc_tups = list(df[["excerpt","id"]].itertuples(index=False, name=None))
-    feat_vec = []
+    if not isinstance(freq_df, FrequencyIndex):
+        freq_df = FrequencyIndex.from_df(freq_df)
+    feat_kwargs = {"freq_df": freq_df, "tag_df": tag_df,
+                   "all_ents": all_ents, "n_rep": n_rep,
+                   "word_vec_raw": word_vec_raw,
+                   "word_vec_feat": word_vec_feat, **kwargs}
+    if feat_cache is not None and n_jobs == 1:
+        feat_kwargs["feat_cache"] = feat_cache
+    if n_jobs == -1:
+        n_jobs = os.cpu_count()
+
+    # parse docs and extract features in this process or in workers
+    chunks = list(__chunks__(doc_tups, chunk_size))
+    if n_jobs == 1:
+        doc_pipe = nlp.pipe if doc_cache is None else doc_cache.pipe
+        chunk_feats = __run_serial__(chunks, doc_pipe, feat_kwargs)
+    else:
+        seeds = np.random.randint(2**31 - 1, size=len(chunks))
+        chunk_feats = __run_workers__(chunks, seeds, nlp, feat_kwargs,
+                                      n_jobs, doc_cache, feat_cache)
+
+    base_vec = []
+    wv_feat_vec = []
     word_vec = []
-    y_vec = []
-    id_vec = []
-    
-    for doc, i in tqdm(nlp.pipe(doc_tups, as_tuples=True)):
-
-        # pre-process doc
-        token_df = gen_token_df(doc, freq_df) 
-        sent_df = gen_sent_df(doc)
-        if all_ents is not None:
-            ent_df = gen_ent_df(doc)
-        else:
-            ent_df = None
-
-        # get target value and its st. dev.
-        y, sd = df.query("id == @i")[["target", "standard_error"]].values[0]
-        
-        # extract basic features
-        features = gen_base_features(token_df, sent_df, ent_df, 
-                                     tag_df=tag_df, all_ents=all_ents)
-        features["id"] = i
-        
-        # add word-vec features if True
-        if word_vec_feat:
-            features.update(gen_word_vec_feat(doc, token_df, **kwargs))
-        
-        # repeat feature extraction if desired
-        for n in range(n_rep):
-            
-            # add new set of basic features and ids each time
-            id_vec.append(i)
-            feat_vec.append(features)
-            
-            # extract word vectors and re-sample
-            if word_vec_raw:
-                word_vec.append(gen_word_vec_matrix(doc))
-              
-            # add noise to y-measuers or append as is   
-            if noisy_y:
-                y_vec.append(y + sd*np.random.randn(1))
-            else:
-                y_vec.append(y)
-    
-    # compile, format and return data    
-    feat_df = pd.DataFrame(feat_vec)
-    y_vec = np.array(y_vec)
+    for base_df, wv_df, wv in chunk_feats:
+        base_vec.append(base_df)
+        wv_feat_vec.append(wv_df)
+        word_vec += wv
+    if doc_cache is not None:
+        doc_cache.report()
+    if feat_cache is not None:
+        feat_cache.report()
+
+    # compile features, repeating each doc n_rep times
+    with stage("feat_eng.assemble", rows=len(doc_tups)):
+        feat_df = pd.concat(base_vec, ignore_index=True)
+        feat_df["id"] = df["id"].values
+        feat_df = pd.concat([feat_df, 
+                             pd.concat(wv_feat_vec, ignore_index=True)],
+                            axis=1)
+        feat_df = feat_df.loc[np.repeat(feat_df.index, n_rep)
+                              ].reset_index(drop=True)
+        id_vec = feat_df["id"].tolist()
+        if word_vec_raw:
+            word_vec = np.stack([w for wv in word_vec for w in wv]
+                                )[:, :, :, np.newaxis]
+
+    # add noise to y-measuers or repeat as is
+    y, sd = df[["target", "standard_error"]].values.T
+    y_vec = np.repeat(y, n_rep)
+    if noisy_y:
+        y_vec = (y_vec + np.repeat(sd, n_rep)*
+                 np.random.randn(len(y_vec)))[:, np.newaxis]
+
+    # format and return data
     if word_vec_raw:
-        word_vec = np.stack(word_vec)[:, :, :, np.newaxis]
         return feat_df, word_vec, y_vec, id_vec
     else:
         return feat_df, y_vec, id_vec
+
+def __run_workers__(chunks, seeds, nlp, feat_kwargs, n_jobs, doc_cache=None,
+                    feat_cache=None):
+    """
+    Yields chunk features processed in a pool of worker
+    processes, preserving the original order of chunks.
+    """
+    cache_dir = None if doc_cache is None else doc_cache.cache_dir
+    feat_cache_dir = None if feat_cache is None else feat_cache.cache_dir
+    stats = profiling.current()
+    profile = None if stats is None else profiling.memory_traced()
+    with ProcessPoolExecutor(max_workers=n_jobs,
+                             initializer=__init_worker__,
+                             initargs=(nlp, feat_kwargs, cache_dir, 
+                                       profile, feat_cache_dir)) as ex:
+        with tqdm(total=sum(len(c) for c in chunks)) as pbar:
+            for res, cache_res, feat_cache_res, w_stats in ex.map(
+                    __process_chunk__, zip(seeds, chunks)):
+                pbar.update(len(res[0]))
+
+                # store docs parsed by workers and tally hits/misses
+                if cache_res is not None:
+                    hits, misses, keys, shard_bytes, used = cache_res
+                    doc_cache.hits += hits
+                    doc_cache.misses += misses
+                    doc_cache.put_bytes(keys, shard_bytes, used)
+                if feat_cache_res is not None:
+                    hits, misses, keys, shard_bytes, used = feat_cache_res
+                    feat_cache.hits += hits
+                    feat_cache.misses += misses
+                    feat_cache.put_bytes(keys, shard_bytes, used)
+                if w_stats is not None:
+                    stats.merge(w_stats)
+                yield res
@@ -0,0 +1,131 @@
+# -------------------------- # -------------------------- #
+# Token feature store ------ # -------------------------- #
+# -------------------------- # -------------------------- #
+
+import os
+import json
+import numpy as np
+import pandas as pd
+
+def write_feature_store(token_df, path, id_col="id", word_col="word",
+                        dtype=np.float64):
+    """
+    Writes the per-token features of a corpus (e.g. stacked outputs of
+    gen_raw_word_features with an id column) to a directory.
+    ***
+    ARGS
+    token_df: DataFrame, one row per token with an id_col column
+    path: str, directory to write the store to
+    word_col: str, text column stored as integer codes plus vocabulary
+    dtype: numpy dtype of the feature matrix
+    ***
+    Files written:
+    tokens.npy: (tokens x features) matrix, rows ordered by id
+    offsets.npy: start offset of each id's rows, plus the total
+    words.npy: integer codes of word_col (if present)
+    meta.json: ids, column names and original dtypes, word vocabulary
+    """
+    if not os.path.isdir(path):
+        os.makedirs(path)
+
+    # order rows by id, keeping token order within ids
+    ids, codes = np.unique(token_df[id_col].values, return_inverse=True)
+    order = np.argsort(codes, kind="stable")
+    offsets = np.concatenate([[0], np.cumsum(np.bincount(codes))])
+    feat_cols = [c for c in token_df.columns if c not in [id_col, word_col]]
+
+    # write feature matrix column by column into a memmap
+    mat = np.lib.format.open_memmap(os.path.join(path, "tokens.npy"),
+                                    mode="w+", dtype=dtype,
+                                    shape=(len(order), len(feat_cols)))
+    for j, c in enumerate(feat_cols):
+        mat[:, j] = token_df[c].values[order]
+    mat.flush()
+    del mat
+    np.save(os.path.join(path, "offsets.npy"), offsets)
+
+    # store words as codes
+    meta = {"id_col": id_col, "ids": ids.tolist(), "columns": feat_cols,
+            "dtypes": {c: str(token_df[c].dtype) for c in feat_cols}}
+    if word_col in token_df.columns:
+        w_codes, vocab = pd.factorize(token_df[word_col].values[order])
+        np.save(os.path.join(path, "words.npy"), w_codes.astype(np.int32))
+        meta["word_col"] = word_col
+        meta["vocab"] = vocab.tolist()
+
+    with open(os.path.join(path, "meta.json"), "w") as wf:
+        json.dump(meta, wf)
+
+    return FeatureStore(path)
+
+class FeatureStore:
+    """
+    Read-only, memory-mapped view of a store written by write_feature_store.
+    ***
+    ARGS
+    path: str, directory of the store
+    mmap_mode: str, passed to np.load; the default "r" lets processes on a
+               node share a single page-cached copy of the features
+    ***
+    """
+
+    def __init__(self, path, mmap_mode="r"):
+        self.path = path
+        with open(os.path.join(path, "meta.json")) as rf:
+            self.meta = json.load(rf)
+        self.matrix = np.load(os.path.join(path, "tokens.npy"),
+                              mmap_mode=mmap_mode)
+        self.offsets = np.load(os.path.join(path, "offsets.npy"))
+        self.ids = np.array(self.meta["ids"], dtype=object)
+        self.id_col = self.meta["id_col"]
+        self.columns = self.meta["columns"]
+        if "word_col" in self.meta:
+            self.words = np.load(os.path.join(path, "words.npy"),
+                                 mmap_mode=mmap_mode)
+        else:
+            self.words = None
+
+    def __len__(self):
+        return self.matrix.shape[0]
+
+    def col_idx(self, cols):
+        """
+        Positions of cols in the feature matrix.
+        """
+        return [self.columns.index(c) for c in cols]
+
+    def id_codes(self):
+        """
+        Position in ids of the id of each row.
+        """
+        return np.repeat(np.arange(len(self.ids)), np.diff(self.offsets))
+
+    def to_frame(self, restore_dtypes=False):
+        """
+        DataFrame over the store. Feature columns wrap the memmap without
+        copying unless restore_dtypes is True; ids and words are added
+        as categoricals over the stored codes.
+        """
+        df = pd.DataFrame(self.matrix, columns=self.columns, copy=False)
+        if restore_dtypes:
+            df = df.astype(self.meta["dtypes"])
+        df[self.id_col] = pd.Categorical.from_codes(self.id_codes(),
+                                                    self.ids)
+        if self.words is not None:
+            df[self.meta["word_col"]] = pd.Categorical.from_codes(
+                self.words, self.meta["vocab"])
+        return df
+
+    def doc(self, i):
+        """
+        Features of the tokens of id i, with original dtypes.
+        """
+        k = list(self.ids).index(i)
+        start, end = self.offsets[k], self.offsets[k+1]
+        df = pd.DataFrame(self.matrix[start:end], columns=self.columns
+                          ).astype(self.meta["dtypes"])
+        if self.words is not None:
+            df[self.meta["word_col"]] = np.array(
+                self.meta["vocab"], dtype=object)[self.words[start:end]]
+        df[self.id_col] = i
+        return df
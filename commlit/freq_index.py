@@ -0,0 +1,87 @@
+# -------------------------- # -------------------------- #
+# Word frequency index ----- # -------------------------- #
+# -------------------------- # -------------------------- #
+
+import numpy as np
+from spacy.attrs import LOWER
+from spacy.strings import hash_string
+
+class FrequencyIndex:
+    """
+    Word frequency lookup built once from freq_df, in place of merging
+    freq_df onto the tokens of every doc.
+    ***
+    ARGS
+    words: list of (lowercase) words, missing (NaN or None) words, as
+           read_csv makes of words such as "null" or "nan", are skipped
+    counts: array of word counts
+    ***
+    Words are held as a sorted array of spacy string hashes (the ids of
+    lowercase lexemes) with counts aligned to them, so the counts of all
+    tokens of a doc are found with a single searchsorted. Instances are
+    plain numpy arrays underneath, so they pickle cheaply to worker
+    processes and save to a compact .npz file (see save and load).
+    """
+
+    def __init__(self, words, counts):
+        # missing words match no token, as in a merge on freq_df
+        keep = np.array([w is not None and w == w for w in words], 
+                        dtype=bool)
+        keys = np.array([hash_string(str(w)) for w, k in zip(words, keep) 
+                         if k], dtype=np.uint64)
+        self.__set_arrays__(keys, np.asarray(counts, dtype=float)[keep])
+
+    def __set_arrays__(self, keys, counts):
+        # first count of each word wins, as keys are unique
+        keys, first = np.unique(keys, return_index=True)
+        self.keys = keys
+        self.counts = counts[first]
+        self.min_count = self.counts.min() if len(self.counts) > 0 else 1
+
+    @classmethod
+    def from_df(cls, freq_df, word_col="word", count_col="count"):
+        """
+        Builds the index from a DataFrame of words and counts.
+        """
+        return cls(freq_df[word_col].tolist(), freq_df[count_col].values)
+
+    @classmethod
+    def load(cls, path):
+        """
+        Loads an index written by save.
+        """
+        arrs = np.load(path)
+        index = cls.__new__(cls)
+        index.__set_arrays__(arrs["keys"], arrs["counts"])
+        return index
+
+    def save(self, path):
+        """
+        Writes the index to a .npz file.
+        """
+        np.savez(path, keys=self.keys, counts=self.counts)
+
+    def __len__(self):
+        return len(self.keys)
+
+    def lookup(self, keys):
+        """
+        Counts of an array of word hashes, NaN where not found.
+        """
+        keys = np.asarray(keys, dtype=np.uint64)
+        if len(self.keys) == 0:
+            return np.full(keys.shape, np.nan)
+        pos = np.minimum(np.searchsorted(self.keys, keys), len(self.keys) - 1)
+        return np.where(self.keys[pos] == keys, self.counts[pos], np.nan)
+
+    def lookup_words(self, words):
+        """
+        Counts of a list of words, NaN where not found.
+        """
+        return self.lookup([hash_string(w) for w in words])
+
+    def lookup_doc(self, doc):
+        """
+        Counts of the lowercase text of each token of a spacy doc.
+        """
+        return self.lookup(doc.to_array([LOWER]).ravel())
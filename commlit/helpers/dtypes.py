@@ -0,0 +1,55 @@
+import numpy as np
+import pandas as pd
+
+# compact dtype policy used across the feature pipeline
+FLOAT_DTYPE = np.float32
+FLAG_DTYPE = np.uint8
+CAT_COLS = ["word", "lemma", "pos", "tag", "tag_adj"]
+
+def compact_dtypes(df, cat_cols=CAT_COLS, float_dtype=FLOAT_DTYPE,
+                   flag_dtype=FLAG_DTYPE):
+    """
+    Applies the compact dtype policy to a token-level DataFrame in place.
+    ***
+    ARGS
+    df: DataFrame, e.g. output of gen_token_df or gen_raw_word_features
+    cat_cols: list of text columns stored as categoricals
+    float_dtype: dtype of float features
+    flag_dtype: dtype of boolean flags
+    ***
+    Integer columns (e.g. seq, length, tag dummies) are left as is.
+    """
+    for c in df.columns:
+        dtype = df[c].dtype
+        if c in cat_cols and dtype == object:
+            df[c] = df[c].astype("category")
+        elif dtype == bool:
+            df[c] = df[c].astype(flag_dtype)
+        elif pd.api.types.is_float_dtype(dtype) and dtype != float_dtype:
+            df[c] = df[c].astype(float_dtype)
+    return df
+
+def concat_compact(frames, cat_cols=CAT_COLS, **kwargs):
+    """
+    pd.concat of compact frames keeping categorical columns categorical.
+    ***
+    ARGS
+    frames: list of DataFrames, e.g. per-doc outputs of compact_dtypes
+    cat_cols: list of categorical columns to keep categorical
+    kwargs: passed to pd.concat
+    ***
+    Each frame's categoricals only hold its own values, and pd.concat
+    falls back to object for categoricals of different categories, so
+    every frame is first cast to one dtype over all their categories.
+    """
+    frames = list(frames)
+    shared = {}
+    for c in cat_cols:
+        cols = [f[c] for f in frames if c in f.columns]
+        if len(cols) > 0 and all(isinstance(s.dtype, pd.CategoricalDtype)
+                                 for s in cols):
+            shared[c] = pd.CategoricalDtype(pd.unique(np.concatenate(
+                [s.cat.categories.values for s in cols])))
+    frames = [f.astype({c: d for c, d in shared.items() if c in f.columns})
+              for f in frames]
+    return pd.concat(frames, **kwargs)
@@ -0,0 +1,202 @@
+import time
+import functools
+import tracemalloc
+from contextlib import contextmanager, nullcontext
+
+# stats being collected, None when profiling is disabled
+_state = {"stats": None, "trace_memory": False, "frames": []}
+_null_stage = nullcontext()
+
+class PipelineStats:
+    """
+    Wall time, call counts, rows processed and allocation peaks per stage,
+    as collected within profile().
+    ***
+    Stages are named "<module>.<stage>" and may be nested, so the time
+    of a stage includes that of stages within it. Peaks are the largest
+    memory traced by tracemalloc above the level at the start of a call,
+    and are only recorded with profile(trace_memory=True); before python
+    3.9 they include allocations since tracing started.
+    """
+
+    def __init__(self):
+        self.stages = {}
+
+    def add(self, name, secs, rows=0, peak=0, calls=1):
+        """
+        Adds calls of a stage to its totals.
+        """
+        s = self.stages.get(name)
+        if s is None:
+            s = self.stages[name] = {"calls": 0, "secs": 0.0, "rows": 0,
+                                     "peak_bytes": 0}
+        s["calls"] += calls
+        s["secs"] += secs
+        s["rows"] += rows
+        s["peak_bytes"] = max(s["peak_bytes"], peak)
+
+    def merge(self, stages):
+        """
+        Adds totals of another PipelineStats (or its stages dict), e.g.
+        from a worker process.
+        """
+        if isinstance(stages, PipelineStats):
+            stages = stages.stages
+        for name, s in stages.items():
+            self.add(name, s["secs"], s["rows"], s["peak_bytes"], s["calls"])
+
+    def to_frame(self):
+        """
+        DataFrame of stage totals, slowest first.
+        """
+        import pandas as pd
+        df = pd.DataFrame.from_dict(self.stages, orient="index")
+        if df.shape[0] == 0:
+            return df
+        df.index.name = "stage"
+        df["rows_per_sec"] = df["rows"] / df["secs"].clip(lower=1e-9)
+        return df.sort_values("secs", ascending=False)
+
+    def report(self, logger=None):
+        """
+        Prints (or logs at INFO level) a table of stage totals.
+        """
+        lines = ["%-40s %8s %10s %12s %10s"%("stage", "calls", "secs",
+                                            "rows", "peak_mb")]
+        for name, s in sorted(self.stages.items(),
+                              key=lambda kv: -kv[1]["secs"]):
+            lines.append("%-40s %8d %10.3f %12d %10.1f"%(
+                name, s["calls"], s["secs"], s["rows"],
+                s["peak_bytes"] / 1024**2))
+        if logger is None:
+            print("\n".join(lines))
+        else:
+            logger.info("\n".join(lines))
+
+class __Stage__:
+    """
+    Times one call of a stage into the active PipelineStats.
+    """
+
+    def __init__(self, name, rows):
+        self.name = name
+        self.rows = rows
+
+    def __enter__(self):
+        if _state["trace_memory"]:
+            frames = _state["frames"]
+            current, peak = tracemalloc.get_traced_memory()
+            # hand the peak so far to the enclosing stage before resetting
+            if frames:
+                frames[-1][1] = max(frames[-1][1], peak)
+            if hasattr(tracemalloc, "reset_peak"):
+                tracemalloc.reset_peak()
+            frames.append([current, 0])
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        secs = time.perf_counter() - self.start
+        peak = 0
+        if _state["trace_memory"] and _state["frames"]:
+            frames = _state["frames"]
+            start, inner_peak = frames.pop()
+            abs_peak = max(inner_peak, tracemalloc.get_traced_memory()[1])
+            peak = abs_peak - start
+            if frames:
+                frames[-1][1] = max(frames[-1][1], abs_peak)
+        if _state["stats"] is not None:
+            _state["stats"].add(self.name, secs, self.rows, peak)
+        return False
+
+def stage(name, rows=0):
+    """
+    Context manager timing a stage if profiling is enabled, else a
+    shared no-op context.
+    """
+    if _state["stats"] is None:
+        return _null_stage
+    return __Stage__(name, rows)
+
+def timed(name, rows=None):
+    """
+    Decorator timing every call of a function as a stage, with rows
+    processed given by rows(*args, **kwargs) if provided.
+    """
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if _state["stats"] is None:
+                return fn(*args, **kwargs)
+            n = 0 if rows is None else rows(*args, **kwargs)
+            with __Stage__(name, n):
+                return fn(*args, **kwargs)
+        return wrapper
+    return decorator
+
+def enabled():
+    """
+    Whether stats are being collected.
+    """
+    return _state["stats"] is not None
+
+def current():
+    """
+    The PipelineStats being collected, None if profiling is disabled.
+    """
+    return _state["stats"]
+
+def memory_traced():
+    """
+    Whether allocation peaks are being traced.
+    """
+    return _state["stats"] is not None and _state["trace_memory"]
+
+def start_collecting(trace_memory=False):
+    """
+    Starts collecting stats outside a profile context, e.g. for the rest
+    of the life of a worker process (see pop_stats).
+    """
+    if trace_memory and not tracemalloc.is_tracing():
+        tracemalloc.start()
+    _state.update(stats=PipelineStats(), trace_memory=trace_memory,
+                  frames=[])
+
+def pop_stats():
+    """
+    Returns the stats collected so far and starts afresh.
+    """
+    stats = _state["stats"]
+    _state["stats"] = PipelineStats()
+    return stats
+
+@contextmanager
+def profile(callback=None, logger=None, trace_memory=False):
+    """
+    Collects per-stage stats of the feature pipeline within the context.
+    ***
+    ARGS
+    callback: function, called with the PipelineStats on exit
+    logger: logging.Logger, the report is logged to it on exit
+    trace_memory: bool, if True allocation peaks are traced with
+                  tracemalloc, which slows python code down
+    ***
+    Yields the PipelineStats being collected. Outside a profile context
+    stages cost one dictionary lookup each.
+    """
+    stats = PipelineStats()
+    prev = dict(_state)
+    started = trace_memory and not tracemalloc.is_tracing()
+    if started:
+        tracemalloc.start()
+    _state.update(stats=stats, trace_memory=trace_memory, frames=[])
+    try:
+        yield stats
+    finally:
+        _state.update(prev)
+        if started:
+            tracemalloc.stop()
+        if callback is not None:
+            callback(stats)
+        if logger is not None:
+            stats.report(logger)
@@ -0,0 +1,163 @@
+# -------------------------- # -------------------------- #
+# Segmented array operations # -------------------------- #
+# -------------------------- # -------------------------- #
+
+import numpy as np
+import pandas as pd
+
+def seg_codes(keys, ids):
+    """
+    Maps each row key to the position of its segment in ids (-1 if absent).
+    ***
+    ARGS
+    keys: array-like, segment key of each row (e.g. the "id" column)
+    ids: array-like of unique keys, defines the order of segments
+    ***
+    """
+    return pd.Index(ids).get_indexer(keys)
+
+def seg_offsets(seg, n_seg):
+    """
+    Returns start offsets of n_seg segments (plus the total length)
+    for rows sorted by segment code.
+    """
+    counts = np.bincount(seg[seg >= 0], minlength=n_seg)
+    return np.concatenate([[0], np.cumsum(counts)])
+
+def seg_unique(seg, *keys):
+    """
+    Boolean mask flagging the first occurrence of each key combination
+    within each segment, like drop_duplicates on a per-segment frame.
+    """
+    cols = {"seg": seg}
+    cols.update({"k%d"%i: k for i, k in enumerate(keys)})
+    return ~pd.DataFrame(cols).duplicated().values
+
+def seg_count(seg, n_seg, mask=None):
+    """
+    Number of (masked) rows in each segment.
+    """
+    if mask is not None:
+        seg = seg[mask]
+    return np.bincount(seg[seg >= 0], minlength=n_seg).astype(float)
+
+def seg_sum(values, seg, n_seg, mask=None):
+    """
+    Sum of (masked) values in each segment.
+    """
+    valid = seg >= 0
+    if mask is not None:
+        valid &= mask
+    return np.bincount(seg[valid], weights=values[valid], minlength=n_seg)
+
+def seg_mean(values, seg, n_seg, mask=None):
+    """
+    Mean of (masked) values in each segment, NaN for empty segments.
+    """
+    n = seg_count(seg, n_seg, mask)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return seg_sum(values, seg, n_seg, mask) / n
+
+def seg_std(values, seg, n_seg, mask=None, ddof=1):
+    """
+    Standard deviation of (masked) values in each segment, NaN where
+    a segment has ddof or fewer rows (as in pandas).
+    """
+    n = seg_count(seg, n_seg, mask)
+    avg = seg_mean(values, seg, n_seg, mask)
+    dev = values - avg[np.clip(seg, 0, None)]
+    with np.errstate(invalid="ignore", divide="ignore"):
+        var = seg_sum(dev**2, seg, n_seg, mask) / (n - ddof)
+    var[n <= ddof] = np.nan
+    return np.sqrt(var)
+
+def seg_top_mean(values, seg, n_seg, k, mask=None):
+    """
+    Mean of the k largest (masked) values in each segment, or of all
+    values where a segment has fewer than k rows.
+    """
+    valid = seg >= 0
+    if mask is not None:
+        valid &= mask
+    v, s = values[valid], seg[valid]
+
+    # sort by segment, then descending value, and rank within segment
+    order = np.lexsort((-v, s))
+    v, s = v[order], s[order]
+    rank = np.arange(len(s)) - seg_offsets(s, n_seg)[s]
+
+    return seg_mean(v, s, n_seg, mask=rank < k)
+
+def seg_bin_frac(values, seg, n_seg, bins, mask=None):
+    """
+    Fraction of (masked) values falling in each right-closed bin per
+    segment, as pd.cut(...).value_counts(normalize=True) would give.
+    Values outside the bins are excluded from the denominator.
+    """
+    b = np.searchsorted(bins, values, side="left") - 1
+    valid = (b >= 0) & (b < len(bins) - 1)
+    if mask is not None:
+        valid &= mask
+    return seg_code_frac(np.where(valid, b, -1), seg, n_seg, len(bins) - 1)
+
+def seg_code_frac(codes, seg, n_seg, n_codes):
+    """
+    Fraction of rows in each segment taking each integer code, with
+    negative codes excluded from the denominator. NaN for segments
+    without valid codes.
+    """
+    valid = (codes >= 0) & (seg >= 0)
+    counts = np.bincount(seg[valid]*n_codes + codes[valid],
+                         minlength=n_seg*n_codes).reshape(n_seg, n_codes)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return counts / counts.sum(axis=1, keepdims=True)
+
+def seg_quantiles(values, seg, n_seg, q):
+    """
+    Linearly interpolated quantiles q of the values in each segment, as
+    pandas groupby(...).quantile(q) computes them, with NaN values
+    ignored and NaN for segments without values.
+    ***
+    ARGS
+    values: (rows x cols) array, each column is sorted once per segment
+    seg: array of segment codes of rows (negative codes are ignored)
+    n_seg: int, number of segments
+    q: array-like of quantiles in [0, 1]
+    ***
+    Returns an array of shape (n_seg x len(q) x cols), or (n_seg x
+    len(q)) for 1-d values.
+    """
+    values = np.asarray(values, dtype=float)
+    flat = values.ndim == 1
+    if flat:
+        values = values[:, np.newaxis]
+    valid = seg >= 0
+    values, seg = values[valid], seg[valid]
+    q = np.asarray(q, dtype=float)
+
+    # sort values by segment, then value, with NaNs last in each segment
+    srt = np.empty_like(values)
+    for j in range(values.shape[1]):
+        srt[:, j] = values[np.lexsort((values[:, j], seg)), j]
+    start = seg_offsets(seg, n_seg)[:-1]
+    n = np.stack([np.bincount(seg[~np.isnan(values[:, j])], 
+                              minlength=n_seg)
+                  for j in range(values.shape[1])], axis=1)
+
+    # lower positions and interpolation weights per segment and quantile
+    q_idx = q[np.newaxis, :, np.newaxis] * \
+        (n[:, np.newaxis, :] - 1).astype(float)
+    lo = q_idx.astype(np.int64)
+    frac = q_idx % 1
+    col = np.arange(values.shape[1])
+    pos = np.clip(start[:, np.newaxis, np.newaxis] + lo, 0, 
+                  max(len(seg) - 1, 0))
+    nxt = np.clip(pos + 1, 0, max(len(seg) - 1, 0))
+    if len(seg) == 0:
+        out = np.full(q_idx.shape, np.nan)
+    else:
+        val = srt[pos, col]
+        with np.errstate(invalid="ignore"):
+            out = np.where(frac == 0, val, val + (srt[nxt, col] - val)*frac)
+    out[np.broadcast_to((n == 0)[:, np.newaxis, :], out.shape)] = np.nan
+    return out[..., 0] if flat else out
@@ -0,0 +1,219 @@
+# -------------------------- # -------------------------- #
+# Sharded on-disk LRU cache  # -------------------------- #
+# -------------------------- # -------------------------- #
+
+import os
+import json
+import time
+import uuid
+import hashlib
+
+class ShardCache:
+    """
+    On-disk cache of values stored in shards, with a manifest mapping
+    each key to its shard and least recently used shards evicted first.
+    ***
+    ARGS
+    cache_dir: str, directory holding the shards and a manifest
+    nlp: spacy pipeline, whose name and version are part of keys
+    max_bytes: int, cache size above which least recently used shards
+               are evicted
+    readonly: bool, if True new values and shard access times are kept
+              in memory (see pop_new) instead of being written, e.g. in
+              worker processes
+    ***
+    Subclasses set NAME, SUFFIX, ITEMS (the noun used in stats) and
+    LOAD_ERRORS (raised by unreadable shards, which are skipped), and
+    define how a list of values is serialised to and from shard bytes
+    in __dumps__ and __loads__.
+    """
+    NAME = "ShardCache"
+    SUFFIX = ".shard"
+    ITEMS = "items"
+    LOAD_ERRORS = (IOError, OSError)
+
+    def __init__(self, cache_dir, nlp=None, max_bytes=2*1024**3,
+                 readonly=False):
+        self.cache_dir = cache_dir
+        self.nlp = nlp
+        self.max_bytes = max_bytes
+        self.readonly = readonly
+        if nlp is None:
+            self.pipeline_id = ""
+        else:
+            self.pipeline_id = "%s_%s-%s"%(nlp.meta.get("lang", ""),
+                                           nlp.meta.get("name", ""),
+                                           nlp.meta.get("version", ""))
+        self.hits = 0
+        self.misses = 0
+        self.new_items = []
+        self.used = {}
+        if not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir)
+        self.manifest = self.__load_manifest__()
+
+    def __dumps__(self, values):
+        raise NotImplementedError
+
+    def __loads__(self, shard_bytes):
+        raise NotImplementedError
+
+    def __manifest_path__(self):
+        return os.path.join(self.cache_dir, "manifest.json")
+
+    def __shard_path__(self, shard):
+        return os.path.join(self.cache_dir, shard + self.SUFFIX)
+
+    def __load_manifest__(self):
+        if os.path.exists(self.__manifest_path__()):
+            with open(self.__manifest_path__()) as rf:
+                return json.load(rf)
+        return {"keys": {}, "shards": {}}
+
+    def __save_manifest__(self):
+        tmp_path = self.__manifest_path__() + "." + uuid.uuid4().hex
+        with open(tmp_path, "w") as wf:
+            json.dump(self.manifest, wf)
+        os.replace(tmp_path, self.__manifest_path__())
+
+    def key(self, text):
+        """
+        Cache key of an excerpt for this pipeline.
+        """
+        return hashlib.sha1(("%s\n%s"%(self.pipeline_id, text)
+                             ).encode("utf-8")).hexdigest()
+
+    def get(self, keys):
+        """
+        Returns dict of cached values found for keys.
+        """
+
+        # group requested keys by shard
+        by_shard = {}
+        for k in keys:
+            if k in self.manifest["keys"]:
+                shard, idx = self.manifest["keys"][k]
+                by_shard.setdefault(shard, []).append((k, idx))
+
+        # load each shard once, skipping missing or unreadable ones
+        values = {}
+        for shard, key_idx in by_shard.items():
+            try:
+                with open(self.__shard_path__(shard), "rb") as rf:
+                    shard_values = self.__loads__(rf.read())
+            except self.LOAD_ERRORS:
+                continue
+            values.update((k, shard_values[idx]) for k, idx in key_idx)
+            self.used[shard] = time.time()
+            if not self.readonly:
+                self.manifest["shards"][shard]["last_used"] = \
+                    self.used[shard]
+
+        return values
+
+    def put(self, keys, values):
+        """
+        Writes values to a new shard and evicts old shards if over
+        max_bytes.
+        """
+        if len(keys) == 0:
+            return
+        self.put_bytes(keys, self.__dumps__(list(values)))
+
+    def put_bytes(self, keys, shard_bytes, used=None):
+        """
+        Writes serialised values for keys (see pop_new) to a new shard,
+        and records access times of shards read by a read-only cache.
+        """
+        if len(keys) == 0 and not used:
+            return
+        if self.readonly:
+            raise ValueError("Cannot write to a read-only %s!"%self.NAME)
+
+        # shards read elsewhere count as recently used
+        shards = self.manifest["shards"]
+        for shard, t in (used or {}).items():
+            if shard in shards:
+                shards[shard]["last_used"] = max(shards[shard]["last_used"],
+                                                 t)
+
+        # write shard, then record its keys in the manifest
+        if len(keys) > 0:
+            shard = uuid.uuid4().hex
+            with open(self.__shard_path__(shard), "wb") as wf:
+                wf.write(shard_bytes)
+            shards[shard] = {"bytes": len(shard_bytes),
+                             "last_used": time.time()}
+            self.manifest["keys"].update((k, [shard, i])
+                                         for i, k in enumerate(keys))
+            self.evict()
+        self.__save_manifest__()
+
+    def store(self, keys, values):
+        """
+        Stores newly computed values: written to a shard, or kept for
+        pop_new if read-only.
+        """
+        if self.readonly:
+            self.new_items += list(zip(keys, values))
+        else:
+            self.put(keys, values)
+
+    def pop_new(self):
+        """
+        Returns keys and serialised values computed by a read-only cache
+        since the last call, and the access times of shards it read, for
+        a writable cache to put_bytes.
+        """
+        keys = [k for k, v in self.new_items]
+        shard_bytes = self.__dumps__([v for k, v in self.new_items])
+        used = self.used
+        self.new_items = []
+        self.used = {}
+        return keys, shard_bytes, used
+
+    def evict(self):
+        """
+        Removes least recently used shards until under max_bytes.
+        """
+        shards = self.manifest["shards"]
+        total = sum(s["bytes"] for s in shards.values())
+        if total <= self.max_bytes:
+            return
+
+        # drop oldest shards first
+        dropped = set()
+        for shard in sorted(shards, key=lambda s: shards[s]["last_used"]):
+            if total <= self.max_bytes:
+                break
+            total -= shards[shard]["bytes"]
+            dropped.add(shard)
+            if os.path.exists(self.__shard_path__(shard)):
+                os.remove(self.__shard_path__(shard))
+        for shard in dropped:
+            del shards[shard]
+        self.manifest["keys"] = {k: v for k, v in
+                                 self.manifest["keys"].items()
+                                 if v[0] not in dropped}
+
+    def stats(self):
+        """
+        Returns dict of hit/miss counts and current cache size.
+        """
+        shards = self.manifest["shards"]
+        return {"hits": self.hits, "misses": self.misses,
+                "hit_rate": self.hits / max(self.hits + self.misses, 1),
+                "n_%s"%self.ITEMS: len(self.manifest["keys"]),
+                "n_shards": len(shards),
+                "bytes": sum(s["bytes"] for s in shards.values())}
+
+    def report(self):
+        """
+        Prints hit/miss report.
+        """
+        s = self.stats()
+        print("%s: %d hits, %d misses (%.1f%% hit rate), "%(
+            self.NAME, s["hits"], s["misses"], 100*s["hit_rate"]) +
+              "%d %s in %d shards (%.1f MB)"%(
+            s["n_%s"%self.ITEMS], self.ITEMS, s["n_shards"],
+            s["bytes"]/1024**2))
@@ -0,0 +1,133 @@
+import zlib
+import string
+from functools import partial
+import numpy as np
+import pandas as pd
+import spacy
+from spacy.vectors import Vectors
+
+# fixed tags of function words and punctuation, others get an open tag
+CLOSED_TAGS = {"the": ("DT", "DET"), "a": ("DT", "DET"),
+               "and": ("CC", "CCONJ"), "but": ("CC", "CCONJ"),
+               "he": ("PRP", "PRON"), "she": ("PRP", "PRON"),
+               "it": ("PRP", "PRON"), "of": ("IN", "ADP"),
+               "in": ("IN", "ADP"), "to": ("TO", "PART"),
+               ".": (".", "PUNCT"), ",": (",", "PUNCT")}
+OPEN_TAGS = [("NN", "NOUN"), ("NNS", "NOUN"), ("VB", "VERB"),
+             ("VBD", "VERB"), ("JJ", "ADJ"), ("RB", "ADV")]
+ALL_TAGS = sorted(set(t for t, p in CLOSED_TAGS.values()) |
+                  set(t for t, p in OPEN_TAGS))
+
+def gen_vocab(n_words=2000, seed=0):
+    """
+    Random lowercase words, plus the function words of CLOSED_TAGS.
+    """
+    rng = np.random.default_rng(seed)
+    letters = np.array(list(string.ascii_lowercase))
+    words = ["".join(rng.choice(letters, n)) for n in
+             rng.integers(2, 14, size=n_words)]
+    return list(dict.fromkeys(words + [w for w in CLOSED_TAGS
+                                       if w.isalpha()]))
+
+def gen_corpus(n_docs, vocab=None, n_sents=(6, 12), sent_len=(6, 20),
+               seed=0):
+    """
+    Synthetic excerpts with the columns of the competition data. Words
+    are drawn from vocab with Zipf-like frequencies.
+    """
+    rng = np.random.default_rng(seed)
+    if vocab is None:
+        vocab = gen_vocab(seed=seed)
+    p = 1 / np.arange(1, len(vocab) + 1)
+    p = p / p.sum()
+
+    excerpts = []
+    for i in range(n_docs):
+        sents = []
+        for s in range(rng.integers(*n_sents)):
+            words = list(rng.choice(vocab, rng.integers(*sent_len), p=p))
+            if len(words) > 4 and rng.random() < 0.5:
+                words[rng.integers(1, len(words)-1)] += ","
+            sents.append(" ".join(words) + ".")
+        excerpts.append(" ".join(sents))
+
+    return pd.DataFrame({"id": ["syn%06d"%i for i in range(n_docs)],
+                         "excerpt": excerpts,
+                         "target": rng.normal(-1, 1, n_docs),
+                         "standard_error": rng.uniform(0.4, 0.6, n_docs)})
+
+def gen_freq_df(vocab, frac=0.8, seed=0):
+    """
+    Word frequency table covering a random fraction of vocab.
+    """
+    rng = np.random.default_rng(seed)
+    words = [w for w in vocab if rng.random() < frac]
+    return pd.DataFrame({"word": words,
+                         "count": rng.integers(1, 10**7, len(words))})
+
+def __rule_tagger__(doc):
+    """
+    Sets tags from CLOSED_TAGS or a hash of the word, and a flat parse
+    with the first token of each sentence as its root.
+    """
+    for token in doc:
+        tag, pos = CLOSED_TAGS.get(token.lower_, OPEN_TAGS[
+            sum(map(ord, token.lower_)) % len(OPEN_TAGS)])
+        token.tag_ = tag
+        token.pos_ = pos
+    for sent in doc.sents:
+        for token in sent:
+            if token.i != sent.start:
+                token.head = doc[sent.start]
+                token.dep_ = "dobj" if token.pos_ == "NOUN" else "dep"
+            else:
+                token.dep_ = "ROOT"
+    return doc
+
+def __word_tensor__(doc, dim=96):
+    """
+    Sets doc.tensor to a random vector per token seeded by its lowercase
+    form, which spacy returns as token.vector without a vectors table.
+    """
+    doc.tensor = np.array([np.random.default_rng(
+        zlib.crc32(t.lower_.encode("utf-8"))).standard_normal(dim)
+                           for t in doc], dtype=np.float32).reshape(-1, dim)
+    return doc
+
+def stand_in_nlp(vocab, dim=96, seed=0, tensor=False):
+    """
+    Local stand-in for a spacy model, needing no downloads: a blank
+    English pipeline with a sentencizer, rule-based tagger and random
+    word vectors for vocab. With tensor=True there is no vectors table
+    and token vectors come from doc.tensor, as in en_core_web_sm.
+    """
+    nlp = spacy.blank("en")
+    if int(spacy.__version__.split(".")[0]) >= 3:
+        from spacy.language import Language
+        if not Language.has_factory("rule_tagger"):
+            Language.component("rule_tagger", func=__rule_tagger__)
+        if not Language.has_factory("word_tensor"):
+            Language.factory("word_tensor", default_config={"dim": 96},
+                             func=lambda nlp, name, dim: partial(
+                                 __word_tensor__, dim=dim))
+        nlp.add_pipe("sentencizer")
+        nlp.add_pipe("rule_tagger")
+        if tensor:
+            nlp.add_pipe("word_tensor", config={"dim": dim})
+    else:
+        nlp.add_pipe(nlp.create_pipe("sentencizer"))
+        nlp.add_pipe(__rule_tagger__, name="rule_tagger")
+        if tensor:
+            nlp.add_pipe(partial(__word_tensor__, dim=dim),
+                         name="word_tensor")
+    if tensor:
+        return nlp
+
+    # random vectors
+    rng = np.random.default_rng(seed)
+    vectors = Vectors(shape=(len(vocab), dim))
+    for w in vocab:
+        vectors.add(w, vector=rng.standard_normal(dim).astype(np.float32))
+    nlp.vocab.vectors = vectors
+
+    return nlp
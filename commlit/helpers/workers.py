@@ -0,0 +1,90 @@
+# -------------------------- # -------------------------- #
+# Shared-array model workers # -------------------------- #
+# -------------------------- # -------------------------- #
+
+import os
+import random
+import numpy as np
+
+# memory-mapped arrays shared by all tasks run in a worker process
+_worker_env = {}
+
+def share_arrays(arrays, tmp_dir):
+    """
+    Writes arrays once to .npy files under tmp_dir, returning their paths.
+    """
+    paths = []
+    for i, arr in enumerate(arrays):
+        path = os.path.join(tmp_dir, "%d.npy"%i)
+        out = np.lib.format.open_memmap(path, mode="w+", dtype=arr.dtype,
+                                        shape=arr.shape)
+        out[:] = arr
+        out.flush()
+        del out
+        paths.append(path)
+    return paths
+
+def init_worker(paths, y_path, intra_threads=None, inter_threads=None):
+    """
+    Caps tensorflow threads and opens the shared arrays read-only in a
+    worker process (or the current one, with threads left as they are).
+    """
+    if intra_threads is not None:
+        os.environ["OMP_NUM_THREADS"] = str(intra_threads)
+    import tensorflow as tf
+    if intra_threads is not None:
+        tf.config.threading.set_intra_op_parallelism_threads(intra_threads)
+    if inter_threads is not None:
+        tf.config.threading.set_inter_op_parallelism_threads(inter_threads)
+    _worker_env["inputs"] = [np.load(p, mmap_mode="r") for p in paths]
+    _worker_env["y"] = np.load(y_path, mmap_mode="r")
+
+def worker_arrays():
+    """
+    Inputs and targets opened by init_worker in this process.
+    """
+    return _worker_env["inputs"], _worker_env["y"]
+
+def release_arrays():
+    """
+    Drops the arrays opened by init_worker in this process.
+    """
+    _worker_env.clear()
+
+def set_seed(seed):
+    """
+    Seeds python, numpy and tensorflow, e.g. before building a model.
+    """
+    import tensorflow as tf
+    random.seed(seed)
+    np.random.seed(seed)
+    tf.random.set_seed(seed)
+
+def row_batches(inputs, y, idx, batch_size, shuffle, seed):
+    """
+    keras Sequence gathering batches of rows idx from the shared arrays,
+    so a task's training data is never copied as a whole.
+    """
+    import keras
+
+    class RowBatches(keras.utils.Sequence):
+        def __init__(self):
+            super().__init__()
+            self.epoch = 0
+            self.order = idx
+            self.on_epoch_end()
+        def __len__(self):
+            return int(np.ceil(len(idx) / batch_size))
+        def __getitem__(self, b):
+            rows = np.sort(self.order[b*batch_size:(b+1)*batch_size])
+            batch = tuple(np.asarray(i[rows]) for i in inputs)
+            if y is None:
+                return (batch,)
+            return batch, np.asarray(y[rows])
+        def on_epoch_end(self):
+            if shuffle:
+                rng = np.random.default_rng([seed, self.epoch])
+                self.order = rng.permutation(idx)
+            self.epoch += 1
+
+    return RowBatches()
@@ -1,99 +1,177 @@
 import os
+import re
+import time
+import hashlib
 import subprocess
-import pandas as pd
 from io import StringIO
-from zipfile import ZipFile
+from concurrent.futures import ThreadPoolExecutor
+from commlit.lazykaggler.downloads import DownloadManager
 
-def competition_list(group = None, category = None, 
-                     sort_by = None, search_for = None):
+# listings are cached here (or in $LAZYKAGGLER_CACHE) for ttl seconds
+CACHE_DIR = os.path.join(os.path.expanduser("~"), ".cache", "lazykaggler")
+
+def __run__(args):
+    """
+    Runs the kaggle CLI with a list of arguments, returning its output.
+    """
+    res = subprocess.run(["kaggle"] + args, capture_output = True)
+    out = res.stdout.decode("utf-8")
+    if res.returncode != 0:
+        raise RuntimeError("kaggle %s failed: %s"%(
+            " ".join(args), (res.stderr.decode("utf-8") or out).strip()))
+    return out
+
+def __parse_page__(out, header):
     """
+    DataFrame of the CSV in a page of CLI output starting at the header
+    line, and the token of the next page if any.
     """
+    import pandas as pd
+    token = re.search("^Next Page Token = (\\S+)", out, flags = re.M)
+    lines = out.splitlines()
+    start = [i for i, l in enumerate(lines) if l.startswith(header)]
+    if len(start) == 0:
+        return None, None
+    df = pd.read_csv(StringIO("\n".join(lines[start[0]:])))
+    return df, token.group(1) if token else None
+
+def __cached__(name, args, ttl, refresh, fetch):
+    """
+    Result of fetch, pickled under the cache directory by name and args
+    and reused for ttl seconds unless refresh.
+    """
+    import pandas as pd
+    cache_dir = os.environ.get("LAZYKAGGLER_CACHE", CACHE_DIR)
+    key = hashlib.sha1(repr(args).encode("utf-8")).hexdigest()[:16]
+    path = os.path.join(cache_dir, "%s-%s.pkl"%(name, key))
+    if not refresh and ttl and os.path.exists(path) and \
+       time.time() - os.path.getmtime(path) < ttl:
+        return pd.read_pickle(path)
+    df = fetch()
+    if ttl:
+        if not os.path.isdir(cache_dir):
+            os.makedirs(cache_dir, exist_ok = True)
+        tmp = "%s.%d.tmp"%(path, os.getpid())
+        df.to_pickle(tmp)
+        os.replace(tmp, path)
+    return df
 
-    # Argument checks - must be one of the valid options from Kaggle API
-    # TBC
+def competition_list(group = None, category = None, sort_by = None,
+                     search_for = None, n_jobs = 4, max_pages = None,
+                     ttl = 3600, refresh = False):
+    """
+    Lists competitions over all pages of the CLI output.
+    ***
+    ARGS
+    group, category, sort_by, search_for: str, filters of
+        `kaggle competitions list` (--group, --category, --sort-by and
+        --search)
+    n_jobs: int, pages fetched concurrently
+    max_pages: int, stop after this many pages
+    ttl: int, seconds a cached listing is reused (0 disables the cache)
+    refresh: bool, fetch again even if cached
+    ***
+    Pages are numbered, so they are fetched n_jobs at a time until an
+    empty page, and merged in page order.
+    """
+    import pandas as pd
 
-    # arg dict
-    arg_dict = {
-        "group": group, "category": category, "sort_by": sort_by, "search_for": search_for
-    }
-    
     # set up command
-    cmd = "kaggle competitions list"
-    for k, v in arg_dict.items():
+    args = ["competitions", "list", "--csv"]
+    for flag, v in [("--group", group), ("--category", category),
+                    ("--sort-by", sort_by), ("--search", search_for)]:
         if v is not None:
-            cmd = cmd + " --" + k + " " + v
-    cmd = cmd + " -v --csv"
+            args += [flag, v]
 
-    # run command and get output
-    x = subprocess.run(cmd, capture_output=True)
-    df = pd.read_csv(StringIO(x.stdout.decode("utf-8")))
+    def page(p):
+        return __parse_page__(__run__(args + ["--page", str(p)]), "ref,")[0]
 
-    return df
+    def fetch():
+        pages, done = [], False
+        with ThreadPoolExecutor(max_workers = max(1, n_jobs)) as ex:
+            while not done and (max_pages is None or
+                                len(pages) < max_pages):
+                n = n_jobs if max_pages is None else \
+                    min(n_jobs, max_pages - len(pages))
+                for df in ex.map(page, range(len(pages) + 1,
+                                             len(pages) + n + 1)):
+                    if df is None or len(df) == 0:
+                        done = True
+                        break
+                    pages.append(df)
+        if len(pages) == 0:
+            return pd.DataFrame()
+        return pd.concat(pages, ignore_index = True)
+
+    return __cached__("list", (args, max_pages), ttl, refresh, fetch)
 
-def competition_files(competiton):
+def competition_files(competiton, page_size = 200, ttl = 3600,
+                      refresh = False):
     """
-    Issues
-    - Not all files shown at once
-    - there appears to be a limit of 500 for "smaller files"
-      - e.g. the image data for OSIC PFP
-    - may have to compile iteratively
-    - unclear whether the 500 file names are extracted at random
+    Lists all files of a competition, walking every page of the CLI
+    output (one page shows at most page_size files).
+    ***
+    ARGS
+    competiton: str, competition name
+    page_size: int, files per page
+    ttl: int, seconds a cached listing is reused (0 disables the cache)
+    refresh: bool, fetch again even if cached
+    ***
+    Each page gives the token of the next one, so pages are fetched in
+    turn. CLIs before paging was added (kaggle<1.6, e.g. 1.5.12) reject
+    the paging flags and list every file at once, so a single unpaged
+    call is made instead. Returns a DataFrame of name, size and
+    creationDate.
     """
+    import pandas as pd
 
     # set up command
-    cmd = " ".join(["kaggle competitions files", competiton, "-v -csv"])
+    args = ["competitions", "files", competiton, "-v", "--csv"]
+    paging = ["--page-size", str(page_size)]
 
-    # run command and get output
-    x = subprocess.run(cmd, capture_output=True)
-    df = pd.read_csv(StringIO(x.stdout.decode("utf-8")))
+    def fetch():
+        pages, token = [], None
+        while True:
+            try:
+                out = __run__(args + paging + ([] if token is None else
+                                               ["--page-token", token]))
+            except RuntimeError as e:
+                if token is not None or \
+                   "unrecognized arguments" not in str(e):
+                    raise
+                # older CLIs list all files without paging flags
+                out = __run__(args)
+            df, token = __parse_page__(out, "name,")
+            if df is not None:
+                pages.append(df)
+            if token is None:
+                break
+        if len(pages) == 0:
+            return pd.DataFrame(columns = ["name", "size", "creationDate"])
+        return pd.concat(pages, ignore_index = True)
 
-    return df
+    return __cached__("files", args + paging, ttl, refresh, fetch)
 
 def competition_download(competition, file_name = None, local_path = None,
                          re_download = False):
     """
+    Downloads file_name (or the whole competition if None) to local_path,
+    mirroring its directory on Kaggle, and unzips it. Files already
+    downloaded and unchanged are skipped (see DownloadManager).
     """
 
-    # split file_name in case it is a directory path
-    if file_name is None:
-        file_name_parts = ""
-    else:
-        file_name_parts = file_name.split("/")
-
-    # extend local path to mirror setup on Kaggle
-    if len(file_name_parts) > 1:
-        local_path = os.path.join(local_path, *file_name_parts[:-1])
-        if not os.path.isdir(local_path):
-            os.makedirs(local_path)
-
-        # check that file has not been downloaded
-        full_path = os.path.join(local_path, file_name_parts[-1])
-        if os.path.exists(full_path) and not re_download:
-            print("%s already downloaded"%file_name)
-            return
-        else:
-            pass
-    else:
-        full_path = os.path.join(local_path, competition)
+    # download unless unchanged since the last download
+    if local_path is None:
+        local_path = "."
+    manager = DownloadManager(competition, local_path)
+    status = manager.download(file_name, re_download = re_download)
 
-    # set up command
-    cmd = " ".join(["kaggle competitions download", competition])
-    if file_name is not None:
-        cmd = cmd + " -f \"%s\""%file_name
-    if local_path is not None:
-        cmd = cmd + " -p \"%s\""%local_path
-    
-    # run command
-    subprocess.run(cmd)
-
-    # Check if file is zipped
-    if os.path.exists(full_path+".zip"):
-        with ZipFile(full_path+".zip") as zf:
-            zf.extractall(local_path)
-        os.remove(full_path+".zip")
-        print("Successfully unzipped contents of %s"%(full_path+".zip"))
+    # report outcome
+    name = competition if file_name is None else file_name
+    if status == "skipped":
+        print("%s already downloaded"%name)
+    elif status == "downloaded":
+        print("%s downloaded successfully"%name)
     else:
-        if os.path.exists(full_path):
-            print("%s downloaded successfully"%file_name)
-        else:
-            print("%s could not be downloaded"%file_name)
+        print("%s could not be downloaded: %s"%(name,
+                                                manager.errors[file_name]))
@@ -0,0 +1,235 @@
+import os
+import json
+import shutil
+import hashlib
+import tempfile
+import threading
+import subprocess
+from time import perf_counter
+from zipfile import ZipFile
+from concurrent.futures import ThreadPoolExecutor
+
+# manifest of downloaded files, kept in the local path
+MANIFEST = ".lazykaggler.json"
+
+def file_sha256(path, chunk_size = 1 << 20):
+    """
+    sha256 hex digest of a file, read chunk_size bytes at a time.
+    """
+    h = hashlib.sha256()
+    with open(path, "rb") as rf:
+        for chunk in iter(lambda: rf.read(chunk_size), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+def __copy_hashed__(src, dest, chunk_size = 1 << 20):
+    """
+    Streams a file object to dest, hashing it on the way, and returns
+    its size and sha256.
+    """
+    h = hashlib.sha256()
+    size = 0
+    part = dest + ".part"
+    with open(part, "wb") as wf:
+        for chunk in iter(lambda: src.read(chunk_size), b""):
+            h.update(chunk)
+            wf.write(chunk)
+            size += len(chunk)
+    os.replace(part, dest)
+    return {"size": size, "sha256": h.hexdigest()}
+
+class DownloadManager:
+    """
+    Downloads competition files with the kaggle CLI, skipping files whose
+    local copies are unchanged.
+    ***
+    ARGS
+    competition: str, competition name
+    local_path: str, directory files are saved to, mirroring the
+                directories of file names on Kaggle
+    n_jobs: int, files downloaded concurrently by download_all
+    kaggle: str, kaggle executable (looked up on PATH)
+    verify: bool, if True local files are re-hashed against the manifest
+            before being skipped, else only their sizes are checked
+    ***
+    Each download records the remote size and date it was fetched for
+    (when known) and the size and sha256 of every local file it produced
+    in a manifest in local_path. Zipped downloads are extracted member by
+    member, hashing while writing, and the archive is removed. The error
+    output of failed downloads is kept in errors, by file name.
+    """
+
+    def __init__(self, competition, local_path = ".", n_jobs = 4,
+                 kaggle = "kaggle", verify = False):
+        self.competition = competition
+        self.local_path = local_path
+        self.n_jobs = n_jobs
+        self.kaggle = kaggle
+        self.verify = verify
+        if not os.path.isdir(local_path):
+            os.makedirs(local_path)
+        self.manifest_path = os.path.join(local_path, MANIFEST)
+        self.lock = threading.Lock()
+        self.errors = {}
+        self.manifest = {}
+        if os.path.exists(self.manifest_path):
+            with open(self.manifest_path) as rf:
+                self.manifest = json.load(rf)
+
+    def __save__(self):
+        # called under the lock, replacing the manifest atomically
+        tmp = self.manifest_path + ".tmp"
+        with open(tmp, "w") as wf:
+            json.dump(self.manifest, wf, indent = 1, sort_keys = True)
+        os.replace(tmp, self.manifest_path)
+
+    def __key__(self, file_name):
+        return self.competition + "/" + (file_name or "")
+
+    def is_current(self, file_name = None, remote = None):
+        """
+        True if file_name (or the whole competition if None) was
+        downloaded for the same remote size and date, and its local files
+        are unchanged.
+        """
+        with self.lock:
+            entry = self.manifest.get(self.__key__(file_name))
+        if entry is None:
+            return False
+        if remote is not None and entry["remote"] != remote:
+            return False
+        for rel, rec in entry["files"].items():
+            path = os.path.join(self.local_path, rel)
+            if not os.path.isfile(path) or \
+               os.path.getsize(path) != rec["size"]:
+                return False
+            if self.verify and file_sha256(path) != rec["sha256"]:
+                return False
+        return True
+
+    def __dest__(self, dest_dir, name):
+        # keeps extracted members inside dest_dir
+        path = os.path.normpath(os.path.join(dest_dir, name))
+        root = os.path.normpath(dest_dir)
+        if os.path.commonpath([root, path]) != root:
+            raise ValueError("Archive member %s is outside %s!"%(name,
+                                                                 dest_dir))
+        parent = os.path.dirname(path)
+        if not os.path.isdir(parent):
+            os.makedirs(parent, exist_ok = True)
+        return path
+
+    def download(self, file_name = None, remote = None, re_download = False):
+        """
+        Downloads file_name (or the whole competition if None) unless it
+        is current, returning "skipped", "downloaded" or "failed" (with
+        the CLI's error output in errors[file_name]).
+        ***
+        ARGS
+        file_name: str, file name as listed by competition_files
+        remote: dict, e.g. {"size": ..., "date": ...} of the listing, so
+                files changed on Kaggle are downloaded again
+        re_download: bool, download even if current
+        ***
+        """
+        if not re_download and self.is_current(file_name, remote):
+            return "skipped"
+
+        # the directory of the file on Kaggle, mirrored locally
+        if file_name is None:
+            dest_dir, base = self.local_path, self.competition
+        else:
+            parts = file_name.split("/")
+            dest_dir = os.path.join(self.local_path, *parts[:-1])
+            base = parts[-1]
+        if not os.path.isdir(dest_dir):
+            os.makedirs(dest_dir, exist_ok = True)
+
+        # download into a private directory on the same file system
+        tmp_dir = tempfile.mkdtemp(prefix = ".download-",
+                                   dir = self.local_path)
+        try:
+            cmd = [self.kaggle, "competitions", "download", self.competition,
+                   "-p", tmp_dir, "--force", "--quiet"]
+            if file_name is not None:
+                cmd += ["-f", file_name]
+            res = subprocess.run(cmd, capture_output = True)
+            got = os.listdir(tmp_dir)
+            if res.returncode != 0 or len(got) == 0:
+                err = (res.stderr or res.stdout).decode("utf-8", "replace")
+                with self.lock:
+                    self.errors[file_name] = err.strip() or \
+                        "kaggle exited with code %d"%res.returncode
+                return "failed"
+
+            files = {}
+            for name in got:
+                path = os.path.join(tmp_dir, name)
+                if name == base + ".zip" and name != base:
+                    # stream members out of the archive
+                    with ZipFile(path) as zf:
+                        for info in zf.infolist():
+                            if info.is_dir():
+                                continue
+                            dest = self.__dest__(dest_dir, info.filename)
+                            with zf.open(info) as src:
+                                files[dest] = __copy_hashed__(src, dest)
+                    os.remove(path)
+                else:
+                    dest = self.__dest__(dest_dir, name)
+                    files[dest] = {"size": os.path.getsize(path),
+                                   "sha256": file_sha256(path)}
+                    os.replace(path, dest)
+        finally:
+            shutil.rmtree(tmp_dir, ignore_errors = True)
+
+        with self.lock:
+            self.errors.pop(file_name, None)
+            self.manifest[self.__key__(file_name)] = {
+                "remote": remote,
+                "files": {os.path.relpath(p, self.local_path): rec
+                          for p, rec in files.items()}}
+            self.__save__()
+        return "downloaded"
+
+    def download_all(self, files = None, re_download = False):
+        """
+        Downloads files n_jobs at a time, skipping current ones.
+        ***
+        ARGS
+        files: list of file names, or DataFrame listing them as returned
+               by competition_files (name, size and creationDate columns);
+               all files of the competition are listed if None
+        ***
+        Returns a DataFrame of the status, time taken, local size and
+        error output (of failed downloads) of each file.
+        """
+        import pandas as pd
+        if files is None:
+            from commlit.lazykaggler.competitions import competition_files
+            files = competition_files(self.competition)
+        if isinstance(files, pd.DataFrame):
+            tasks = [(r["name"], {"size": str(r["size"]),
+                                  "date": str(r["creationDate"])})
+                     for r in files.to_dict("records")]
+        else:
+            tasks = [(f, None) for f in files]
+
+        def fetch(task):
+            t = perf_counter()
+            status = self.download(task[0], task[1], re_download)
+            with self.lock:
+                entry = self.manifest.get(self.__key__(task[0]), {})
+                error = self.errors.get(task[0]) if status == "failed" \
+                    else None
+            return {"name": task[0], "status": status,
+                    "secs": perf_counter() - t,
+                    "bytes": sum(f["size"] for f in
+                                 entry.get("files", {}).values()),
+                    "error": error}
+
+        # bounded pool, as each download is a CLI process waiting on I/O
+        with ThreadPoolExecutor(max_workers = max(1, self.n_jobs)) as ex:
+            res = list(ex.map(fetch, tasks))
+        return pd.DataFrame(res, columns = ["name", "status", "secs",
+                                            "bytes", "error"])
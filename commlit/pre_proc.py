@@ -3,7 +3,13 @@
 # Pre-processing module ---- # -------------------------- #
 # -------------------------- # -------------------------- #
 
+import numpy as np
 import pandas as pd
+from commlit.helpers.dtypes import compact_dtypes
+from commlit.helpers.profiling import stage, timed
+
+# spacy (and FrequencyIndex, built on it) is imported where docs or tag
+# hashes are handled, so gen_tag_df loads without it
 
 def gen_tag_df(all_tags, tag_map=None):
     """
@@ -17,21 +23,93 @@ def gen_tag_df(all_tags, tag_map=None):
                    ("WP$", "WPP"), ("PRP$", "PRPP")]
         tag_map = pd.DataFrame(tag_map, columns=["tag_og", "tag_new"])
         
-    # adjust tags and create output
-    adj_tags = []
-    for tag in all_tags:
-        if tag in tag_map["tag_og"].tolist():
-            adj_tags.append(tag_map.query("tag_og == @tag")["tag_new"].values[0])
-        else:
-            adj_tags.append(tag)
+    # adjust tags and create output, first mapping of a tag wins
+    tag_map = tag_map.drop_duplicates("tag_og")
+    tag_dict = dict(zip(tag_map["tag_og"], tag_map["tag_new"]))
+    adj_tags = [tag_dict.get(tag, tag) for tag in all_tags]
     tag_df = pd.DataFrame(zip(all_tags, adj_tags), columns=["tag", "tag_adj"])
     
     return tag_df
 
-def gen_token_df(doc, freq_df=None, freq_norm=1e5):
+class TagEncoder:
+    """
+    One-hot encoder of spacy tags into adjusted tag columns, built once
+    in place of merging tag_df and calling get_dummies on every doc.
+    ***
+    ARGS
+    all_tags: list of tags, as passed to gen_tag_df
+    tag_map: DataFrame of tag_og -> tag_new mappings, as in gen_tag_df
+    columns: list of adjusted tags setting the column order, e.g. the tag
+             columns of x_cols saved from training; defaults to sorted
+             adjusted tags, the order of the get_dummies columns
+    ***
+    Tag hashes (token.tag) are held sorted with the column index of each,
+    so the tags of a doc are encoded with one searchsorted and a scatter
+    into a preallocated array.
+    """
+    
+    def __init__(self, all_tags, tag_map=None, columns=None):
+        from spacy.strings import hash_string
+        tag_df = gen_tag_df(all_tags, tag_map).drop_duplicates("tag")
+        if columns is None:
+            columns = sorted(tag_df["tag_adj"].unique())
+        self.columns = list(columns)
+        
+        # column index of each tag hash, -1 if its column is not kept
+        col_idx = pd.Index(self.columns).get_indexer(tag_df["tag_adj"])
+        keys = np.array([hash_string(t) for t in tag_df["tag"]], 
+                        dtype=np.uint64)
+        order = np.argsort(keys)
+        self.keys = keys[order]
+        self.col_idx = col_idx[order]
+        
+    @classmethod
+    def from_tag_df(cls, tag_df, columns=None):
+        """
+        Builds the encoder from the output of gen_tag_df.
+        """
+        tag_map = pd.DataFrame({"tag_og": tag_df["tag"], 
+                                "tag_new": tag_df["tag_adj"]})
+        return cls(tag_df["tag"].tolist(), tag_map, columns=columns)
+        
+    def lookup(self, keys):
+        """
+        Column index of an array of tag hashes, -1 for tags whose column
+        is not kept and -2 for tags not in all_tags.
+        """
+        keys = np.asarray(keys, dtype=np.uint64)
+        if len(self.keys) == 0:
+            return np.full(keys.shape, -2)
+        pos = np.minimum(np.searchsorted(self.keys, keys), len(self.keys) - 1)
+        return np.where(self.keys[pos] == keys, self.col_idx[pos], -2)
+    
+    def encode(self, doc, out=None):
+        """
+        One-hot tag block of the tokens of a spacy doc.
+        ***
+        Returns a (tokens x columns) uint8 array (written to out if
+        provided) and a mask of tokens whose tag is in all_tags, as 
+        gen_raw_word_features drops other tokens.
+        """
+        from spacy.attrs import TAG
+        col = self.lookup(doc.to_array([TAG]).ravel())
+        if out is None:
+            out = np.zeros((len(col), len(self.columns)), dtype=np.uint8)
+        else:
+            out[:] = 0
+        hot = np.flatnonzero(col >= 0)
+        out[hot, col[hot]] = 1
+        return out, col > -2
+
+@timed("pre_proc.gen_token_df", rows=lambda doc, *a, **k: len(doc))
+def gen_token_df(doc, freq_df=None, freq_norm=1e5, compact=False):
     """
     Generates DataFrame of characteristics for tokens in a spacy doc.
+    freq_df may be a DataFrame or a FrequencyIndex. Set compact to True
+    for float32 features, uint8 flags and categorical text columns (see
+    helpers.dtypes).
     """
+    from commlit.freq_index import FrequencyIndex
 
     # Create token dataframe
     token_list = [{
@@ -47,12 +125,20 @@ def gen_token_df(doc, freq_df=None, freq_norm=1e5):
     token_df = pd.DataFrame(token_list)
     
     # Add word frequencies if available
-    if freq_df is not None:
-        token_df = token_df.merge(freq_df, on="word", how="left")
-        token_df.loc[:, "comm_score"] = freq_norm / token_df["count"]
+    with stage("pre_proc.freq_join", rows=len(doc)):
+        if isinstance(freq_df, FrequencyIndex):
+            token_df.loc[:, "count"] = freq_df.lookup_doc(doc)
+            token_df.loc[:, "comm_score"] = freq_norm / token_df["count"]
+        elif freq_df is not None:
+            token_df = token_df.merge(freq_df, on="word", how="left")
+            token_df.loc[:, "comm_score"] = freq_norm / token_df["count"]
+    
+    if compact:
+        token_df = compact_dtypes(token_df)
     
     return token_df
 
+@timed("pre_proc.gen_sent_df", rows=lambda doc: len(doc))
 def gen_sent_df(doc):
     """
     Generates DataFrame of characteristics for sentences in a spacy doc.
@@ -65,6 +151,7 @@ def gen_sent_df(doc):
     
     return pd.DataFrame(sent_list)
 
+@timed("pre_proc.gen_ent_df", rows=lambda doc: len(doc))
 def gen_ent_df(doc):
     """
     Generates DataFrame of characteristics for entities in a spacy doc.
@@ -0,0 +1,215 @@
+# -------------------------- # -------------------------- #
+# Batch inference module --- # -------------------------- #
+# -------------------------- # -------------------------- #
+
+import json
+import zlib
+import inspect
+import numpy as np
+import pandas as pd
+from commlit.freq_index import FrequencyIndex
+from commlit.pre_proc import gen_sent_df, TagEncoder
+from commlit.raw_feats import gen_raw_word_features
+from commlit.up_scale import upsample_idx
+from commlit.train_data import gen_train_data, prep_train_data, \
+    gather_rows, DROP_COLS, AGG_EXCL, QUANTILES, SENT_NORM, UP_SAMPLE_PARAM
+from commlit.export import fuse_inputs, is_fused, load_exported
+from commlit.helpers.dtypes import concat_compact
+from commlit.helpers.profiling import stage
+
+# gen_train_data options that shape model inputs, with the defaults
+# of the options defaulting to None resolved
+TRAIN_DEFAULTS = {k: v.default for k, v in
+                  inspect.signature(gen_train_data).parameters.items()
+                  if k in ["gen_agg_feat", "rem_punct", "rem_stop",
+                           "min_stop_len", "x_split", "drop_cols",
+                           "agg_excl", "agg_excl_vec", "quant_cols",
+                           "quantiles", "tgt_noise_var", "sent_norm",
+                           "up_sample_param", "seed"]}
+TRAIN_DEFAULTS.update(drop_cols=DROP_COLS, agg_excl=AGG_EXCL,
+                      quantiles=QUANTILES, sent_norm=SENT_NORM,
+                      up_sample_param=UP_SAMPLE_PARAM)
+
+class Predictor:
+    """
+    Scores excerpts with a model built by build_model, holding every
+    artifact needed from parsing to model inputs.
+    ***
+    ARGS
+    nlp: spacy pipeline
+    freq_df: FrequencyIndex (or DataFrame of word counts, indexed once)
+    tag_df: TagEncoder (or output of gen_tag_df, encoded once)
+    x_cols: list, x_cols returned by gen_train_data in training
+    model: keras Model built by build_model (fused or not), or a model
+           exported with export_numpy or export_tflite
+    use_sent: bool, True if sent_df was passed to gen_train_data
+    raw_kwargs: dict, extra arguments of gen_raw_word_features
+    train_kwargs: dict, gen_train_data options used in training, with
+                  defaults as in TRAIN_DEFAULTS
+    ***
+    Token rows of each excerpt are upsampled n_rep times (as in
+    up_sample_param) with a generator seeded by the seed and a hash of
+    the excerpt, so scores do not depend on batch composition, and the
+    predictions of the n_rep resamples are averaged.
+    """
+
+    def __init__(self, nlp, freq_df, tag_df, x_cols, model, use_sent=False,
+                 raw_kwargs=None, train_kwargs=None):
+        self.nlp = nlp
+        if isinstance(freq_df, pd.DataFrame):
+            freq_df = FrequencyIndex.from_df(freq_df)
+        self.freq_index = freq_df
+        if isinstance(tag_df, pd.DataFrame):
+            tag_df = TagEncoder.from_tag_df(tag_df)
+        self.tag_encoder = tag_df
+        self.x_cols = list(x_cols)
+        self.model = model
+        self.use_sent = use_sent
+        self.raw_kwargs = {} if raw_kwargs is None else raw_kwargs
+        self.train_kwargs = {**TRAIN_DEFAULTS, **(train_kwargs or {})}
+
+    @classmethod
+    def from_files(cls, nlp, freq_path, tag_path, x_cols_path, model_path,
+                   model_config=None, **kwargs):
+        """
+        Loads artifacts from disk.
+        ***
+        ARGS
+        nlp: str, spacy model name or path
+        freq_path: str, FrequencyIndex .npz file or csv of word counts
+        tag_path: str, csv of the tag_df used in training
+        x_cols_path: str, JSON list of x_cols
+        model_path: str, saved keras model, weights if model_config, or
+                    model exported to .npz or .tflite (see export)
+        model_config: dict, build_model arguments to build the model from;
+                      with fused=True, weights of the standard graph are
+                      loaded into the fused one
+        ***
+        """
+        import spacy
+        if freq_path.endswith(".npz"):
+            freq_index = FrequencyIndex.load(freq_path)
+        else:
+            freq_index = FrequencyIndex.from_df(pd.read_csv(freq_path))
+        tag_df = pd.read_csv(tag_path, keep_default_na=False)
+        with open(x_cols_path) as rf:
+            x_cols = json.load(rf)
+        if model_path.endswith((".npz", ".tflite")):
+            # exported models are scored without loading tensorflow
+            return cls(spacy.load(nlp), freq_index, tag_df, x_cols,
+                       load_exported(model_path), **kwargs)
+        import keras
+        from commlit.build_model import build_model, GroupedDense, \
+            load_standard_weights
+        if model_config is None:
+            model = keras.models.load_model(
+                model_path, compile=False,
+                custom_objects={"GroupedDense": GroupedDense})
+        elif model_config.get("fused", False):
+            # weights are saved in the layout of the standard graph
+            model = build_model(**model_config)
+            load_standard_weights(model, model_path, **{
+                k: v for k, v in model_config.items() if k != "fused"})
+        else:
+            model = build_model(**model_config)
+            model.load_weights(model_path)
+        return cls(spacy.load(nlp), freq_index, tag_df, x_cols, model,
+                   **kwargs)
+
+    def __draw__(self, texts, offsets, n_rep):
+        """
+        Token rows (excerpts x n_rep x n_row) for each excerpt.
+        """
+        n_row = self.train_kwargs["up_sample_param"]["n_row"]
+        seed = self.train_kwargs["seed"]
+        return np.stack([
+            upsample_idx(offsets[i:i+2], n_row=n_row, n_rep=n_rep,
+                         rng=np.random.default_rng(
+                             [seed, zlib.crc32(t.encode("utf-8"))]))[0]
+            for i, t in enumerate(texts)])
+
+    def inputs(self, texts, docs=None, n_rep=None):
+        """
+        Model inputs [x, a, m, *q] for a list of excerpts, with n_rep rows
+        per excerpt, in the order build_model expects.
+        """
+        kw = self.train_kwargs
+        if n_rep is None:
+            n_rep = kw["up_sample_param"]["n_rep"]
+        if docs is None:
+            with stage("predictor.parse", rows=len(texts)):
+                docs = list(self.nlp.pipe(texts))
+
+        # token features of all excerpts, with positions as ids
+        with stage("predictor.raw_features", rows=len(texts)):
+            raw = concat_compact([gen_raw_word_features(
+                doc, self.tag_encoder, self.freq_index, **self.raw_kwargs)
+                for doc in docs], keys=range(len(docs)),
+                                 names=["id", None]).reset_index(level=0)
+            if self.use_sent:
+                sent_df = pd.concat([gen_sent_df(doc) for doc in docs],
+                                    keys=range(len(docs)),
+                                    names=["id", None]).reset_index(level=0)
+            else:
+                sent_df = None
+
+        # aggregate and quantile features, and token rows
+        data = prep_train_data(
+            raw, sent_df, x_cols=self.x_cols, compact=True,
+            **{k: kw[k] for k in ["gen_agg_feat", "rem_punct", "rem_stop",
+                                  "min_stop_len", "x_split", "drop_cols",
+                                  "agg_excl", "agg_excl_vec", "quant_cols",
+                                  "quantiles", "tgt_noise_var",
+                                  "sent_norm"]})
+        if len(data["n_id"]) < len(docs):
+            raise ValueError("Excerpts without any tokens kept cannot " +
+                             "be scored!")
+
+        # gather upsampled token inputs and repeat per-excerpt inputs
+        with stage("predictor.assemble", rows=len(texts)*n_rep):
+            idx = self.__draw__(texts, data["offsets"], n_rep)
+            idx = idx.reshape(-1, idx.shape[-1])
+            inputs = [gather_rows(data, idx, data["x_idx"])[..., np.newaxis]]
+            if data["a_idx"] is not None:
+                inputs.append(gather_rows(data, idx, data["a_idx"]
+                                          )[..., np.newaxis])
+            per_id = [] if data["m"] is None else [data["m"]]
+            per_id += list(data["q"].values())
+            inputs += [np.repeat(self.__by_id__(f, len(docs)), n_rep, axis=0)
+                       for f in per_id]
+
+        return inputs
+
+    def __by_id__(self, f, n):
+        """
+        Per-excerpt feature rows of f ordered by id (excerpt position),
+        raising if any excerpt has none, e.g. quantile features of an
+        excerpt without alpha tokens.
+        """
+        missing = sorted(set(range(n)) - set(f["id"]))
+        if len(missing) > 0:
+            raise ValueError("Excerpts %s lack features needed for "%(
+                missing) + "scoring, e.g. have no alpha tokens!")
+        return f.set_index("id").loc[list(range(n))].to_numpy(np.float32)
+
+    def predict(self, texts, batch_size=64, n_rep=None):
+        """
+        Scores a list of excerpts batch_size at a time, averaging over
+        n_rep test-time resamples (as in up_sample_param by default).
+        """
+        if n_rep is None:
+            n_rep = self.train_kwargs["up_sample_param"]["n_rep"]
+        texts = list(texts)
+        preds = []
+        for b in range(0, len(texts), batch_size):
+            batch = texts[b:b+batch_size]
+            inputs = self.inputs(batch, n_rep=n_rep)
+            if is_fused(self.model):
+                inputs = fuse_inputs(
+                    inputs, len(self.train_kwargs["quant_cols"] or []))
+            with stage("predictor.model", rows=len(batch)):
+                y = np.asarray(self.model(inputs, training=False))
+            preds.append(y.reshape(len(batch), n_rep).mean(axis=1))
+        if len(preds) == 0:
+            return np.zeros(0)
+        return np.concatenate(preds)
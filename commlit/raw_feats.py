@@ -3,12 +3,23 @@
 # Raw feature extraction --- # -------------------------- #
 # -------------------------- # -------------------------- #
 
+import numpy as np
 import pandas as pd
+from commlit.helpers.dtypes import FLOAT_DTYPE, compact_dtypes
+from commlit.freq_index import FrequencyIndex
+from commlit.pre_proc import TagEncoder
+from commlit.helpers.profiling import stage, timed
 
+@timed("raw_feats.gen_raw_word_features", rows=lambda doc, *a, **k: len(doc))
 def gen_raw_word_features(doc, tag_df=None, freq_df=None,
                           len_norm=20, vec_norm=10, len_vec=96,
-                          freq_norm=None, unknown_comm_score=0.5):
+                          freq_norm=None, unknown_comm_score=0.5,
+                          compact=False):
     """
+    freq_df may be a DataFrame or a FrequencyIndex, and tag_df the output
+    of gen_tag_df or a TagEncoder. Set compact to True for float32 
+    features, uint8 flags and a categorical word column (see 
+    helpers.dtypes).
     """
     
     # get baseline word features
@@ -25,34 +36,53 @@ def gen_raw_word_features(doc, tag_df=None, freq_df=None,
     token_df = pd.DataFrame(token_list)
     
     # create word frequency feature
-    if freq_df is not None:
-        if freq_norm is None:
-            freq_norm = freq_df["count"].min()
-        token_df = token_df.merge(freq_df, on="word", how="left")
-        token_df.loc[:, "comm_score"] = (freq_norm / token_df["count"])
-        alpha_nonstop_miss = ((token_df["alpha"]==True) & 
-                              (token_df["stop"]==False) & 
-                              (token_df["comm_score"].isna()))
-        token_df.loc[alpha_nonstop_miss, "comm_score"] = unknown_comm_score
-        token_df.loc[:, "comm_score"] = token_df["comm_score"].fillna(0)
-        token_df = token_df.drop(["count"], axis=1).sort_values("seq")
+    with stage("raw_feats.freq_join", rows=len(doc)):
+        if freq_df is not None:
+            if isinstance(freq_df, FrequencyIndex):
+                if freq_norm is None:
+                    freq_norm = freq_df.min_count
+                token_df.loc[:, "count"] = freq_df.lookup_doc(doc)
+            else:
+                if freq_norm is None:
+                    freq_norm = freq_df["count"].min()
+                token_df = token_df.merge(freq_df, on="word", how="left")
+            token_df.loc[:, "comm_score"] = (freq_norm / token_df["count"])
+            alpha_nonstop_miss = ((token_df["alpha"]==True) & 
+                                  (token_df["stop"]==False) & 
+                                  (token_df["comm_score"].isna()))
+            token_df.loc[alpha_nonstop_miss, "comm_score"] = unknown_comm_score
+            token_df.loc[:, "comm_score"] = token_df["comm_score"].fillna(0)
+            token_df = token_df.drop(["count"], axis=1).sort_values("seq")
     
     # expand vector embedding lists
     vec_cols = ["v"+str(i) for i in range(len_vec)]
-    token_df[vec_cols] = pd.DataFrame(token_df["vec"].tolist(), 
-                                      index=token_df.index)/vec_norm
-    token_df = token_df.drop(["vec"], axis=1)
+    vecs = np.array(token_df["vec"].tolist(), 
+                    dtype=FLOAT_DTYPE if compact else float)
+    token_df = pd.concat([token_df.drop(["vec"], axis=1),
+                          pd.DataFrame(vecs.reshape(-1, len_vec)/vec_norm, 
+                                       columns=vec_cols, 
+                                       index=token_df.index)], axis=1)
     
-    # generate tag dummies if provided
-    if tag_df is not None:
-        token_df = token_df.merge(tag_df.astype({"tag_adj": "category"}), 
-                                  on="tag").drop(["tag"], axis=1)
-        tag_dums = pd.get_dummies(token_df["tag_adj"], 
-                                  columns=tag_df["tag_adj"])
-        token_df = pd.concat([token_df, tag_dums], axis=1)
-        token_df = token_df.drop(["tag_adj"], axis=1).sort_values("seq")
-    else:
-        token_df = token_df.drop(["tag"], axis=1)
+    # generate tag dummies if provided, dropping tokens with unknown tags
+    with stage("raw_feats.tag_dummies", rows=len(doc)):
+        if isinstance(tag_df, TagEncoder):
+            tag_dums, known = tag_df.encode(doc)
+            tag_dums = pd.DataFrame(tag_dums, columns=tag_df.columns, 
+                                    index=token_df.index)
+            token_df = pd.concat([token_df.drop(["tag"], axis=1), tag_dums], 
+                                 axis=1)[known]
+        elif tag_df is not None:
+            token_df = token_df.merge(tag_df.astype({"tag_adj": "category"}), 
+                                      on="tag").drop(["tag"], axis=1)
+            tag_dums = pd.get_dummies(token_df["tag_adj"], 
+                                      columns=tag_df["tag_adj"])
+            token_df = pd.concat([token_df, tag_dums], axis=1)
+            token_df = token_df.drop(["tag_adj"], axis=1).sort_values("seq")
+        else:
+            token_df = token_df.drop(["tag"], axis=1)
+    
+    if compact:
+        token_df = compact_dtypes(token_df)
         
     return token_df
     
\ No newline at end of file
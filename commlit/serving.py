@@ -0,0 +1,196 @@
+# -------------------------- # -------------------------- #
+# Micro-batch scoring ------ # -------------------------- #
+# -------------------------- # -------------------------- #
+
+import time
+import asyncio
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+class MicroBatcher:
+    """
+    Asyncio front end gathering concurrent single-excerpt requests into
+    micro-batches for a batch scoring function.
+    ***
+    ARGS
+    score_fn: function scoring a list of excerpts, e.g. Predictor.predict
+    max_batch_size: int, most excerpts scored in one call
+    max_wait: float, seconds to wait for more requests after the first
+              request of a batch arrives
+    executor: concurrent.futures executor running score_fn, so the event
+              loop stays responsive; defaults to a single thread
+    ***
+    Batches are scored one at a time, in order of arrival. Use as an
+    async context manager, or call start and stop:
+        async with MicroBatcher(predictor.predict) as batcher:
+            score = await batcher.submit(excerpt)
+    """
+
+    def __init__(self, score_fn, max_batch_size=32, max_wait=0.005,
+                 executor=None):
+        self.score_fn = score_fn
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self.own_executor = executor is None
+        self.executor = executor
+        self.queue = None
+        self.worker = None
+        self.reset_metrics()
+
+    def reset_metrics(self):
+        self.n_requests = 0
+        self.n_batches = 0
+        self.n_errors = 0
+        self.batch_sizes = Counter()
+        self.max_queue_depth = 0
+        self.latency_sum = 0.0
+
+    async def start(self):
+        """
+        Starts the batching task on the running event loop.
+        """
+        if self.executor is None:
+            self.executor = ThreadPoolExecutor(max_workers=1)
+        self.queue = asyncio.Queue()
+        self.worker = asyncio.ensure_future(self.__run__())
+        return self
+
+    async def stop(self):
+        """
+        Scores requests already queued, then stops the batching task.
+        Does nothing if not started.
+        """
+        if self.worker is None:
+            return
+        if not self.worker.done():
+            await self.queue.put(None)
+        await self.worker
+        self.worker = None
+        if self.own_executor and self.executor is not None:
+            self.executor.shutdown(wait=True)
+            self.executor = None
+
+    async def __aenter__(self):
+        return await self.start()
+
+    async def __aexit__(self, *exc):
+        await self.stop()
+
+    async def submit(self, text):
+        """
+        Queues an excerpt and returns its score once its batch is done.
+        """
+        if self.worker is None or self.worker.done():
+            raise RuntimeError("MicroBatcher is not running!")
+        fut = asyncio.get_running_loop().create_future()
+        await self.queue.put((text, fut, time.perf_counter()))
+        self.max_queue_depth = max(self.max_queue_depth, self.queue.qsize())
+        return await fut
+
+    async def __next_batch__(self):
+        """
+        Waits for a request, then collects more until the batch is full or
+        max_wait has passed. Returns None once stopped.
+        """
+        loop = asyncio.get_running_loop()
+        item = await self.queue.get()
+        if item is None:
+            return None
+        batch = [item]
+        deadline = loop.time() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            if not self.queue.empty():
+                item = self.queue.get_nowait()
+            else:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    item = await asyncio.wait_for(self.queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+            if item is None:
+                # score what we have, then stop
+                self.queue.put_nowait(None)
+                break
+            batch.append(item)
+        return batch
+
+    async def __run__(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = await self.__next_batch__()
+            if batch is None:
+                return
+            texts = [text for text, fut, t in batch]
+            try:
+                scores = await loop.run_in_executor(self.executor,
+                                                    self.score_fn, texts)
+                if len(scores) != len(texts):
+                    raise ValueError("score_fn returned %d scores for "%(
+                        len(scores)) + "%d excerpts!"%len(texts))
+            except Exception as e:
+                self.n_errors += 1
+                for text, fut, t in batch:
+                    if not fut.done():
+                        fut.set_exception(e)
+                continue
+
+            # resolve requests and record metrics
+            done = time.perf_counter()
+            for (text, fut, t), score in zip(batch, scores):
+                if not fut.done():
+                    fut.set_result(float(score))
+                self.latency_sum += done - t
+            self.n_requests += len(batch)
+            self.n_batches += 1
+            self.batch_sizes[len(batch)] += 1
+
+    def metrics(self):
+        """
+        Dict of current queue depth and batching stats.
+        """
+        return {"queue_depth": 0 if self.queue is None else
+                self.queue.qsize(),
+                "max_queue_depth": self.max_queue_depth,
+                "requests": self.n_requests,
+                "batches": self.n_batches,
+                "errors": self.n_errors,
+                "mean_batch_size": self.n_requests / max(self.n_batches, 1),
+                "batch_sizes": dict(sorted(self.batch_sizes.items())),
+                "mean_latency_ms": 1000 * self.latency_sum /
+                max(self.n_requests, 1)}
+
+class LocalClient:
+    """
+    In-process client of a MicroBatcher, e.g. for local testing.
+    """
+
+    def __init__(self, batcher):
+        self.batcher = batcher
+
+    async def score(self, text):
+        return await self.batcher.submit(text)
+
+    async def score_many(self, texts, concurrency=None):
+        """
+        Scores excerpts as concurrent single requests, at most
+        concurrency in flight at a time.
+        """
+        sem = asyncio.Semaphore(concurrency or max(len(texts), 1))
+        async def one(text):
+            async with sem:
+                return await self.score(text)
+        return await asyncio.gather(*[one(t) for t in texts])
+
+def run_local(score_fn, texts, concurrency=None, **kwargs):
+    """
+    Scores excerpts through a MicroBatcher from synchronous code,
+    returning the scores and batching metrics.
+    """
+    async def main():
+        async with MicroBatcher(score_fn, **kwargs) as batcher:
+            scores = await LocalClient(batcher).score_many(texts,
+                                                           concurrency)
+        return scores, batcher.metrics()
+    return asyncio.run(main())
@@ -0,0 +1,261 @@
+# -------------------------- # -------------------------- #
+# Hyperparameter sweep ----- # -------------------------- #
+# -------------------------- # -------------------------- #
+
+import os
+import json
+import time
+import shutil
+import tempfile
+import numpy as np
+import multiprocessing as mp
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from commlit.cv import fold_ids
+from commlit.helpers.workers import share_arrays, init_worker, \
+    worker_arrays, release_arrays, set_seed, row_batches
+
+class Choice:
+    """
+    Search space leaf drawing one of values.
+    """
+
+    def __init__(self, values):
+        self.values = list(values)
+
+    def sample(self, rng):
+        return self.values[rng.integers(len(self.values))]
+
+class Uniform:
+    """
+    Search space leaf drawing uniformly from [low, high).
+    """
+
+    def __init__(self, low, high):
+        self.low, self.high = low, high
+
+    def sample(self, rng):
+        return float(rng.uniform(self.low, self.high))
+
+class LogUniform:
+    """
+    Search space leaf drawing log-uniformly from [low, high), e.g. for
+    l2_reg.
+    """
+
+    def __init__(self, low, high):
+        self.low, self.high = low, high
+
+    def sample(self, rng):
+        return float(np.exp(rng.uniform(np.log(self.low),
+                                        np.log(self.high))))
+
+def __sample__(space, rng):
+    if isinstance(space, dict):
+        return {k: __sample__(v, rng) for k, v in space.items()}
+    if isinstance(space, (Choice, Uniform, LogUniform)):
+        return space.sample(rng)
+    return space
+
+def sample_config(space, rng):
+    """
+    Draws a build_model config from a search space: nested dicts as
+    build_model takes them, with Choice, Uniform or LogUniform leaves
+    sampled and any other value used as is. Attention filters follow
+    the sampled cnn filters, as build_model multiplies the two.
+    """
+    config = __sample__(space, rng)
+    if config.get("cnn") is not None and config.get("att") is not None:
+        config["att"]["filters"] = config["cnn"]["filters"]
+    return config
+
+def rungs(min_epochs, max_epochs, eta):
+    """
+    Epochs trained by the end of each successive-halving rung.
+    """
+    out = [min_epochs]
+    while out[-1] * eta < max_epochs:
+        out.append(out[-1] * eta)
+    if out[-1] < max_epochs:
+        out.append(max_epochs)
+    return out
+
+def __model_path__(sweep_dir, cand, epochs):
+    return os.path.join(sweep_dir, "cand_%d_e%d.h5"%(cand, epochs))
+
+def __run_trial__(task):
+    """
+    Trains a candidate from its saved state (or from scratch) up to a
+    number of epochs, saves it, and returns its validation RMSE.
+    """
+    cand, config, start, end, sweep_dir, train_idx, val_idx, \
+        compile_kwargs, batch_size, seed = task
+    import keras
+    from commlit.build_model import build_model, GroupedDense
+    inputs, y = worker_arrays()
+    set_seed(seed + cand)
+
+    # resume from the previous rung, keeping the optimizer state; a
+    # model saved before an interruption is only evaluated
+    t = time.perf_counter()
+    path = __model_path__(sweep_dir, cand, end)
+    if os.path.exists(path):
+        model = keras.models.load_model(
+            path, custom_objects={"GroupedDense": GroupedDense})
+    else:
+        if start > 0:
+            model = keras.models.load_model(
+                __model_path__(sweep_dir, cand, start),
+                custom_objects={"GroupedDense": GroupedDense})
+        else:
+            model = build_model(**config)
+            model.compile(**compile_kwargs)
+        model.fit(row_batches(inputs, y, train_idx, batch_size, True,
+                              seed + cand), initial_epoch=start,
+                  epochs=end, verbose=0)
+        model.save(path)
+
+    # validation RMSE against the targets
+    pred = model.predict(row_batches(inputs, None, val_idx, batch_size,
+                                     False, seed), verbose=0).ravel()
+    rmse = float(np.sqrt(np.mean((pred - np.asarray(y[val_idx]))**2)))
+    return {"cand": cand, "epochs": end, "rmse": rmse,
+            "secs": time.perf_counter() - t}
+
+def __rank_rmse__(rmse):
+    """
+    RMSE to rank a trial by, with diverged (NaN) trials ranked last.
+    """
+    return np.inf if np.isnan(rmse) else rmse
+
+def __load_results__(path):
+    """
+    Records of finished trials, keyed by (candidate, epochs).
+    """
+    done = {}
+    if os.path.exists(path):
+        with open(path) as rf:
+            for line in rf:
+                if line.strip():
+                    r = json.loads(line)
+                    done[(r["cand"], r["epochs"])] = r
+    return done
+
+def run_sweep(inputs, y, ids, space, sweep_dir, n_configs=27, min_epochs=1,
+              max_epochs=27, eta=3, val_frac=0.2, n_jobs=None,
+              batch_size=32, compile_kwargs=None, intra_threads=1,
+              inter_threads=1, seed=42, tmp_dir=None):
+    """
+    Successive-halving sweep of build_model configs.
+    ***
+    ARGS
+    inputs: list of arrays in build_model order (see cv.model_inputs)
+    y: array of targets of each row
+    ids: array of the id of each row; validation rows are a 1/val_frac
+         split by id (see cv.fold_ids)
+    space: dict, search space of build_model arguments (see
+           sample_config)
+    sweep_dir: str, directory of the results file and model states
+    n_configs: int, candidates sampled from space with seed
+    min_epochs: int, epochs of the first rung
+    max_epochs: int, epochs of the last rung
+    eta: int, each rung trains eta times as long and keeps the best
+         1/eta of candidates by validation RMSE
+    n_jobs: int, worker processes training candidates concurrently,
+            with intra_threads/inter_threads tensorflow threads each
+    compile_kwargs: dict, arguments of model.compile, by default
+                    {"optimizer": "adam", "loss": "mse"}
+    ***
+    Arrays are shared with workers through memory-mapped files as in
+    run_cv. Each finished trial is appended to sweep_dir/results.jsonl,
+    so rerunning with the same arguments resumes an interrupted sweep.
+    Model states of pruned candidates are deleted, so only those of the
+    best candidates of the last rung are kept. Returns the best config
+    and a DataFrame of all trials.
+    """
+    import pandas as pd
+    if compile_kwargs is None:
+        compile_kwargs = {"optimizer": "adam", "loss": "mse"}
+    if not os.path.isdir(sweep_dir):
+        os.makedirs(sweep_dir)
+    results_path = os.path.join(sweep_dir, "results.jsonl")
+    done = __load_results__(results_path)
+
+    # candidates are drawn the same way on every run
+    rng = np.random.default_rng(seed)
+    configs = [sample_config(space, rng) for c in range(n_configs)]
+    for (cand, epochs), r in done.items():
+        if cand >= n_configs or \
+           json.dumps(r["config"]) != json.dumps(configs[cand]):
+            raise ValueError("Results in %s are from another sweep!"%(
+                sweep_dir))
+
+    # validation split by id
+    y = np.asarray(y, dtype=np.float32).ravel()
+    val = fold_ids(ids, n_folds=int(round(1 / val_frac)), seed=seed) == 0
+    train_idx, val_idx = np.flatnonzero(~val), np.flatnonzero(val)
+    if n_jobs is None:
+        n_jobs = max(1, (os.cpu_count() or 1) // max(intra_threads or 1, 1))
+
+    own_tmp = tmp_dir is None
+    tmp_dir = tempfile.mkdtemp() if own_tmp else tmp_dir
+    ex = None
+    try:
+        paths = share_arrays(list(inputs) + [y], tmp_dir)
+        if n_jobs > 1:
+            ex = ProcessPoolExecutor(
+                max_workers=n_jobs, mp_context=mp.get_context("spawn"),
+                initializer=init_worker,
+                initargs=(paths[:-1], paths[-1], intra_threads,
+                          inter_threads))
+        else:
+            init_worker(paths[:-1], paths[-1])
+
+        # train survivors of each rung, pruning all but the best 1/eta
+        survivors = list(range(n_configs))
+        start = 0
+        for k, end in enumerate(rungs(min_epochs, max_epochs, eta)):
+            tasks = [(c, configs[c], start, end, sweep_dir, train_idx,
+                      val_idx, compile_kwargs, batch_size, seed)
+                     for c in survivors if (c, end) not in done]
+            if ex is None:
+                finished = (__run_trial__(task) for task in tasks)
+            else:
+                finished = (f.result() for f in as_completed(
+                    [ex.submit(__run_trial__, task) for task in tasks]))
+            for r in finished:
+                r["config"] = configs[r["cand"]]
+                r["rung"] = k
+                with open(results_path, "a") as wf:
+                    wf.write(json.dumps(r) + "\n")
+                done[(r["cand"], r["epochs"])] = r
+                if start > 0:
+                    prev = __model_path__(sweep_dir, r["cand"], start)
+                    if os.path.exists(prev):
+                        os.remove(prev)
+
+            ranked = sorted(survivors, key=lambda c: __rank_rmse__(
+                done[(c, end)]["rmse"]))
+            print("rung %d: %d candidates at %d epochs, best RMSE %.4f"%(
+                k, len(survivors), end, done[(ranked[0], end)]["rmse"]))
+            survivors = ranked[:max(1, len(survivors) // eta)]
+            for c in ranked[len(survivors):]:
+                pruned = __model_path__(sweep_dir, c, end)
+                if os.path.exists(pruned):
+                    os.remove(pruned)
+            start = end
+    finally:
+        if ex is not None:
+            ex.shutdown()
+        release_arrays()
+        if own_tmp:
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    # report compute relative to training every candidate fully
+    trials = pd.DataFrame(list(done.values())).sort_values(["rung", "rmse"])
+    best = trials.sort_values(["epochs", "rmse"],
+                              ascending=[False, True]).iloc[0]
+    spent = trials.groupby("cand")["epochs"].max().sum()
+    print("best RMSE %.4f after %d epochs trained (%.0f%% of %d)"%(
+        best["rmse"], spent, 100 * spent / (n_configs * max_epochs),
+        n_configs * max_epochs))
+    return configs[int(best["cand"])], trials.reset_index(drop=True)
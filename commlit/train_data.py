@@ -5,44 +5,81 @@
 
 import re
 import numpy as np
-from commlit.up_scale import even_upsample
+import pandas as pd
+from commlit.up_scale import upsample_idx, AugmentationSampler
+from commlit.feat_store import FeatureStore
+from commlit.helpers.dtypes import FLOAT_DTYPE, concat_compact
+from commlit.helpers.segments import seg_quantiles
+from commlit.helpers.profiling import stage, timed
 
-def gen_train_data(df, 
-                   tgt_df=None,
-                   sent_df=None,
-                   gen_agg_feat=True,
-                   up_sample=True,
-                   rem_punct=False, 
-                   rem_stop=False,
-                   min_stop_len=0.3, 
-                   x_cols=None,
-                   x_split=True,
-                   drop_cols=["seq", "word", "alpha"],
-                   agg_excl=["seq", "word"],
-                   agg_excl_vec=True,
-                   quant_cols=["length", "comm_score"],
-                   quantiles=np.arange(0.025, 1, 0.025),
-                   tgt_noise_var="length",
-                   tgt_noise_mult=2,
-                   sent_norm={"sent_length": 50, 
-                              "noun_chunks": 10},
-                   up_sample_param={"n_row": 125,
-                                    "n_rep": 5},
-                   seed=42):
+# defaults of the list and dict options, which default to None
+DROP_COLS = ("seq", "word", "alpha")
+AGG_EXCL = ("seq", "word")
+QUANT_COLS = ("length", "comm_score")
+QUANTILES = np.arange(0.025, 1, 0.025)
+SENT_NORM = {"sent_length": 50, "noun_chunks": 10}
+UP_SAMPLE_PARAM = {"n_row": 125, "n_rep": 5}
+
+@timed("train_data.prep", rows=lambda df, *a, **k: len(df))
+def prep_train_data(df, sent_df=None, *,
+                    gen_agg_feat=True,
+                    rem_punct=False,
+                    rem_stop=False,
+                    min_stop_len=0.3,
+                    x_cols=None,
+                    x_split=True,
+                    drop_cols=None,
+                    agg_excl=None,
+                    agg_excl_vec=True,
+                    quant_cols=QUANT_COLS,
+                    quantiles=None,
+                    tgt_noise_var="length",
+                    sent_norm=None,
+                    compact=False,
+                    feat_cache=None,
+                    tag_df=None,
+                    freq_df=None,
+                    raw_kwargs=None):
     """
+    Computes per-id aggregate and quantile features and an index of the
+    kept token rows in id order, shared by gen_train_data,
+    gen_train_batches and Predictor. df may be a DataFrame or a
+    FeatureStore, whose memory-mapped matrix is then gathered from
+    without copying. Options are as in gen_train_data, with None for
+    drop_cols, agg_excl, quantiles and sent_norm standing for DROP_COLS,
+    AGG_EXCL, QUANTILES and SENT_NORM. With compact, token features are
+    gathered as float32. With a FeatureCache feat_cache, df holds parsed
+    docs in a doc column with an id column instead, and their raw word
+    features (gen_raw_word_features of tag_df, freq_df and raw_kwargs)
+    are loaded from the cache or computed and cached.
     """
     
-    # set seed
-    np.random.seed(seed)
+    # raw word features of parsed docs from the feature cache
+    if feat_cache is not None:
+        df = __cached_raw_features__(df, feat_cache, tag_df, freq_df,
+                                     raw_kwargs)
     
-    # take copy
-    x = df.copy()
+    # resolve default options
+    if drop_cols is None:
+        drop_cols = DROP_COLS
+    if agg_excl is None:
+        agg_excl = AGG_EXCL
+    if quantiles is None:
+        quantiles = QUANTILES
+    if sent_norm is None:
+        sent_norm = SENT_NORM
+    
+    # open feature stores without copying
+    if isinstance(df, FeatureStore):
+        store, x = df, df.to_frame()
+    else:
+        store, x = None, df
     
     # aggregate selected features
     if gen_agg_feat:
         if agg_excl_vec:
-            agg_excl += [f for f in x.columns if 
-                         bool(re.match("v[0-9]+$", f))]
+            agg_excl = list(agg_excl) + [f for f in x.columns if 
+                                         bool(re.match("v[0-9]+$", f))]
         agg_cols = [f for f in x.columns if f not in agg_excl]
         m = x[agg_cols].groupby("id").mean().reset_index()
         
@@ -58,42 +95,175 @@ def gen_train_data(df,
     # quantile features
     q = {}
     if quant_cols is not None:
-        for qc in quant_cols:
-            q_df = x[x["alpha"]==True].groupby("id")[qc]
-            q_df = q_df.quantile(quantiles).reset_index()
-            q_df = q_df.pivot("id", "level_1", qc)
-            q_df.columns = ["q" + str(np.round(i, 5)) for i in quantiles]
-            q[qc] = q_df.reset_index()  
+        with stage("train_data.quantiles", rows=x.shape[0]):
+            alpha = (x["alpha"]==True).values
+            seg, q_ids = pd.factorize(x["id"][alpha], sort=True)
+            q_arr = seg_quantiles(x.loc[alpha, list(quant_cols)].values, 
+                                  seg, len(q_ids), quantiles)
+            q_names = ["q" + str(np.round(i, 5)) for i in quantiles]
+            for j, qc in enumerate(quant_cols):
+                q_df = pd.DataFrame(q_arr[:, :, j], columns=q_names)
+                q_df.insert(0, "id", q_ids)
+                q[qc] = q_df
     
-    # drop unwanted columns
-    x = x.drop(drop_cols, axis=1)
+    # drop unwanted columns, tracking columns and rows kept without copying
+    cols = [c for c in x.columns if c not in drop_cols]
+    keep = np.ones(x.shape[0], dtype=bool)
     
     # remove punctuation tokens
     if rem_punct:
-        x = x[x["punct"]==False].drop(["punct"], axis=1)
+        keep &= (x["punct"]==False).values
+        cols.remove("punct")
        
     # remove (short) stop words    
     if rem_stop:
-        x = x[(x["stop"]==False) | 
-              (x["length"]>=min_stop_len)].drop(["stop"], axis=1)
+        keep &= ((x["stop"]==False) | 
+                 (x["length"]>=min_stop_len)).values
+        cols.remove("stop")
     
     # drop columns with no variance, unless x_cols pre-specified
     if x_cols is None:
-        x_std = x.std()
-        x = x.drop(x_std[x_std == 0].index.to_list(), axis=1)
-        x_cols = x.columns.to_list()
+        x_std = pd.Series({c: x[c][keep].std() for c in cols 
+                           if pd.api.types.is_numeric_dtype(x[c])})
+        x_cols = [c for c in cols if c not in 
+                  x_std[x_std == 0].index.to_list()]
+    
+    # kept rows ordered by id, with offsets of each id
+    id_codes, ids = pd.factorize(x["id"], sort=True)
+    rows = np.flatnonzero(keep)
+    rows = rows[np.argsort(id_codes[rows], kind="stable")]
+    n_id = pd.Series(np.bincount(id_codes[rows], minlength=len(ids)), 
+                     index=np.asarray(ids, dtype=object))
+    n_id = n_id[n_id > 0]
+    offsets = np.concatenate([[0], np.cumsum(n_id.values)])
+    
+    # features split into vector and non-vector columns up front
+    feat_cols = [c for c in x_cols if c != "id"]
+    if x_split:
+        v_cols = [c for c in feat_cols if re.match("v[0-9]+$", c)]
+        a_cols = [c for c in feat_cols if not re.match("v[0-9]+$", c)]
     else:
-        x = x[x_cols]
+        v_cols, a_cols = feat_cols, []
     
-    # upsample even number of rows per id    
-    if up_sample:
-        x = x.groupby("id").apply(even_upsample,
-                                  n_row=up_sample_param["n_row"],
-                                  n_rep=up_sample_param["n_rep"]
-                                  ).reset_index(drop=True)
+    # source matrix: the memmap of a store, else one contiguous copy
+    if store is not None:
+        src = store.matrix
+        x_idx = __as_slice__(store.col_idx(v_cols))
+        a_idx = __as_slice__(store.col_idx(a_cols))
+    else:
+        src = x[v_cols + a_cols].to_numpy(
+            dtype=FLOAT_DTYPE if compact else float)
+        x_idx = slice(0, len(v_cols))
+        a_idx = slice(len(v_cols), len(v_cols) + len(a_cols))
+    
+    return {"src": src, "rows": rows, "x_idx": x_idx, 
+            "dtype": FLOAT_DTYPE if compact else float,
+            "a_idx": a_idx if x_split else None,
+            "noise": x[tgt_noise_var].to_numpy(dtype=float)[rows],
+            "offsets": offsets, "n_id": n_id, "m": m, "q": q, 
+            "x_cols": x_cols}
+
+def __cached_raw_features__(df, feat_cache, tag_df, freq_df, raw_kwargs):
+    """
+    Stacks the cached raw word features of the docs of df, with ids.
+    """
+    raw = feat_cache.raw_word_features(df["doc"].tolist(), tag_df, freq_df,
+                                       **(raw_kwargs or {}))
+    return concat_compact([r.assign(id=i) for r, i in zip(raw, df["id"])],
+                          ignore_index=True)
+
+def __as_slice__(idx):
+    """
+    Converts a list of consecutive column positions to a slice.
+    """
+    if len(idx) > 0 and list(idx) == list(range(idx[0], idx[-1] + 1)):
+        return slice(idx[0], idx[-1] + 1)
+    return np.array(idx, dtype=int)
+
+def gather_rows(data, idx, col_idx):
+    """
+    Gathers the feature columns col_idx of token positions idx (in id
+    order) from the source matrix in a single indexing operation.
+    """
+    rows = data["rows"][idx]
+    if isinstance(col_idx, slice):
+        out = data["src"][:, col_idx][rows]
+    else:
+        out = data["src"][rows[..., np.newaxis], col_idx]
+    return out.astype(data["dtype"], copy=False)
+
+@timed("train_data.gen_train_data", rows=lambda df, *a, **k: len(df))
+def gen_train_data(df, 
+                   tgt_df=None,
+                   sent_df=None,
+                   gen_agg_feat=True,
+                   up_sample=True,
+                   rem_punct=False, 
+                   rem_stop=False,
+                   min_stop_len=0.3, 
+                   x_cols=None,
+                   x_split=True,
+                   drop_cols=None,
+                   agg_excl=None,
+                   agg_excl_vec=True,
+                   quant_cols=QUANT_COLS,
+                   quantiles=None,
+                   tgt_noise_var="length",
+                   tgt_noise_mult=2,
+                   sent_norm=None,
+                   up_sample_param=None,
+                   seed=42,
+                   *,
+                   compact=False,
+                   feat_cache=None,
+                   tag_df=None,
+                   freq_df=None,
+                   raw_kwargs=None):
+    """
+    List and dict options left as None take the module defaults
+    (DROP_COLS, AGG_EXCL, QUANTILES, SENT_NORM and UP_SAMPLE_PARAM);
+    set quant_cols to None for no quantile features. Set compact to True
+    to return float32 rather than float64 model inputs, as keras would
+    cast them to anyway. With a feat_cache, df holds parsed docs whose
+    raw word features are cached (see prep_train_data).
+    """
+    
+    # set random generator
+    rng = np.random.default_rng(seed)
+    if up_sample_param is None:
+        up_sample_param = UP_SAMPLE_PARAM
+    
+    # per-id features and token matrices
+    data = prep_train_data(
+        df, sent_df, gen_agg_feat=gen_agg_feat, rem_punct=rem_punct,
+        rem_stop=rem_stop, min_stop_len=min_stop_len, x_cols=x_cols,
+        x_split=x_split, drop_cols=drop_cols, agg_excl=agg_excl,
+        agg_excl_vec=agg_excl_vec, quant_cols=quant_cols,
+        quantiles=quantiles, tgt_noise_var=tgt_noise_var,
+        sent_norm=sent_norm, compact=compact, feat_cache=feat_cache,
+        tag_df=tag_df, freq_df=freq_df, raw_kwargs=raw_kwargs)
+    n_id, offsets = data["n_id"], data["offsets"]
+    m, q, x_cols = data["m"], data["q"], data["x_cols"]
+    
+    # row indices of each (id, grp_id), upsampling even number of rows
+    with stage("train_data.upsample", rows=offsets[-1]):
+        if up_sample:
+            n_row = up_sample_param["n_row"]
+            n_rep = up_sample_param["n_rep"]
+            idx = upsample_idx(offsets, n_row=n_row, n_rep=n_rep, 
+                               rng=rng).reshape(-1, n_row)
+            grp_id = np.tile(np.arange(n_rep), len(n_id))
+        else:
+            if (n_id.values != n_id.values[0]).any():
+                raise ValueError("All ids must have the same number of " +
+                                 "rows if up_sample is False!")
+            n_rep = 1
+            idx = offsets[:-1, np.newaxis] + np.arange(n_id.values[0])
+            grp_id = np.zeros(len(n_id), dtype=int)
     
     # get the frame
-    frame = x[["id", "grp_id"]].drop_duplicates()
+    frame = pd.DataFrame({"id": np.repeat(n_id.index.values, n_rep),
+                          "grp_id": grp_id})
     
     # update aggregate features
     if gen_agg_feat:
@@ -104,28 +274,154 @@ def gen_train_data(df,
     
         
     # create target variable
-    if tgt_df is not None:
-        y = x.groupby(["id", "grp_id"])[tgt_noise_var].mean().reset_index()
-        y.loc[:, "diff_avg"] = y.groupby("id")[tgt_noise_var].transform("mean")
-        y.loc[:, "diff_dev"] = 1 - y[tgt_noise_var]/y["diff_avg"]
-        y = y.merge(tgt_df, on="id", how="inner")
-        y = y["target"] + y["diff_dev"]*y["standard_error"]*tgt_noise_mult
-        y = y.values
-    else:
-        y = None
+    with stage("train_data.targets", rows=frame.shape[0]):
+        if tgt_df is not None:
+            y = frame.copy()
+            y.loc[:, tgt_noise_var] = data["noise"][idx].mean(axis=1)
+            y.loc[:, "diff_avg"] = y.groupby("id")[tgt_noise_var
+                                                   ].transform("mean")
+            y.loc[:, "diff_dev"] = 1 - y[tgt_noise_var]/y["diff_avg"]
+            y = y.merge(tgt_df, on="id", how="inner")
+            y = y["target"] + y["diff_dev"]*y["standard_error"]*tgt_noise_mult
+            y = y.values
+        else:
+            y = None
         
-    # convert x to matrix input
-    x = list(x.groupby(["id", "grp_id"]))
-    x = [grp[1].drop(["id", "grp_id"], axis=1).astype(float).values 
-         for grp in x]
-    x = np.stack(x)[:, :, :, np.newaxis]
-    
-    # split x into two 
-    if x_split:
-        v_idx = [bool(re.match("v[0-9]+$", c)) for c in x_cols if c != "id"]
-        a_idx = [not vi for vi in v_idx]
-        x, a = x[:, :, v_idx, :], x[:, :, a_idx, :]  
-    else:
-        a = np.array(0)    
+    # gather x (and a) as matrix input
+    with stage("train_data.gather", rows=idx.size):
+        x = gather_rows(data, idx, data["x_idx"])[:, :, :, np.newaxis]
+        if x_split:
+            a = gather_rows(data, idx, data["a_idx"])[:, :, :, np.newaxis]
+        else:
+            a = np.array(0)
         
     return x, a, y, m, q, frame, x_cols
+
+class TrainBatches(AugmentationSampler):
+    """
+    Batches of model inputs built on the fly from per-token matrices, as
+    returned by gen_train_batches.
+    ***
+    Per-id aggregate features, targets and standard errors are held as
+    the x, y and sd of an AugmentationSampler, with tgt_noise_mult as its
+    noise_mult. Each epoch draws n_rep groups of n_row tokens per id at
+    once (only their row indices are kept), seeded by seed in the first
+    epoch, as gen_train_data draws them, and by (seed, epoch) after;
+    token features are gathered batch by batch. Indexing yields
+    (inputs, y) with inputs ordered as build_model expects:
+    [x, a (if x_split), m (if gen_agg_feat), one array per quant_col];
+    y is omitted if no tgt_df was given.
+    ***
+    """
+    
+    def __init__(self, data, tgt_df=None, batch_size=32, 
+                 n_row=125, n_rep=5, tgt_noise_mult=2, 
+                 shuffle=True, seed=42):
+        self.data = data
+        self.x_cols = data["x_cols"]
+        
+        # per-id inputs aligned with the (sorted) ids
+        ids = data["n_id"].index
+        self.frame = pd.DataFrame({"id": np.repeat(ids.values, n_rep),
+                                   "grp_id": np.tile(np.arange(n_rep), 
+                                                     len(ids))})
+        if data["m"] is not None:
+            m = data["m"].set_index("id").loc[ids].to_numpy(data["dtype"])
+        else:
+            m = np.empty((len(ids), 0), dtype=data["dtype"])
+        self.q = [q_df.set_index("id").loc[ids].to_numpy(data["dtype"]) 
+                  for q_df in data["q"].values()]
+        if tgt_df is not None:
+            tgt = tgt_df.set_index("id").loc[
+                ids, ["target", "standard_error"]].to_numpy(float)
+            y, sd = tgt[:, 0], tgt[:, 1]
+        else:
+            y, sd = None, None
+        super().__init__(m, y, sd, n_rep=n_rep, noise_mult=tgt_noise_mult,
+                         offsets=data["offsets"], n_row=n_row,
+                         batch_size=batch_size, shuffle=shuffle, seed=seed)
+        
+    def __set_order__(self):
+        super().__set_order__()
+        
+        # row indices (ids x n_rep x n_row) of all groups of the epoch
+        seed = self.seed if self.epoch == 0 else [self.seed, self.epoch]
+        self.idx = upsample_idx(self.offsets, n_row=self.n_row,
+                                n_rep=self.n_rep, 
+                                rng=np.random.default_rng(seed))
+        
+    @timed("train_data.batch")
+    def __getitem__(self, b):
+        grp = self.order[b*self.batch_size:(b+1)*self.batch_size]
+        i_idx, r_idx = np.divmod(grp, self.n_rep)
+        rows = self.idx[i_idx, r_idx]
+        
+        # gather inputs
+        inputs = [gather_rows(self.data, rows, self.data["x_idx"]
+                              )[:, :, :, np.newaxis]]
+        if self.data["a_idx"] is not None:
+            inputs.append(gather_rows(self.data, rows, self.data["a_idx"]
+                                      )[:, :, :, np.newaxis])
+        if self.data["m"] is not None:
+            inputs.append(self.x[i_idx])
+        inputs += [q_arr[i_idx] for q_arr in self.q]
+        if self.y is None:
+            return inputs
+        
+        # create target variable from all groups of each id
+        noise = self.data["noise"]
+        diff_dev = 1 - noise[rows].mean(axis=1) / \
+            noise[self.idx[i_idx]].mean(axis=(1, 2))
+        y = self.y[i_idx] + diff_dev*self.sd[i_idx]*self.noise_mult
+        
+        return inputs, y
+
+def gen_train_batches(df, 
+                      tgt_df=None,
+                      sent_df=None,
+                      *,
+                      batch_size=32,
+                      shuffle=True,
+                      gen_agg_feat=True,
+                      rem_punct=False, 
+                      rem_stop=False,
+                      min_stop_len=0.3, 
+                      x_cols=None,
+                      x_split=True,
+                      drop_cols=None,
+                      agg_excl=None,
+                      agg_excl_vec=True,
+                      quant_cols=QUANT_COLS,
+                      quantiles=None,
+                      tgt_noise_var="length",
+                      tgt_noise_mult=2,
+                      sent_norm=None,
+                      up_sample_param=None,
+                      seed=42,
+                      compact=False,
+                      feat_cache=None,
+                      tag_df=None,
+                      freq_df=None,
+                      raw_kwargs=None):
+    """
+    Streaming version of gen_train_data, returning a TrainBatches iterator
+    that upsamples tokens batch by batch, so memory depends on batch_size
+    rather than the number of ids x n_rep. Arguments are as in
+    gen_train_data; the x_cols used are available as batches.x_cols.
+    """
+    if up_sample_param is None:
+        up_sample_param = UP_SAMPLE_PARAM
+    data = prep_train_data(
+        df, sent_df, gen_agg_feat=gen_agg_feat, rem_punct=rem_punct,
+        rem_stop=rem_stop, min_stop_len=min_stop_len, x_cols=x_cols,
+        x_split=x_split, drop_cols=drop_cols, agg_excl=agg_excl,
+        agg_excl_vec=agg_excl_vec, quant_cols=quant_cols,
+        quantiles=quantiles, tgt_noise_var=tgt_noise_var,
+        sent_norm=sent_norm, compact=compact, feat_cache=feat_cache,
+        tag_df=tag_df, freq_df=freq_df, raw_kwargs=raw_kwargs)
+    batches = TrainBatches(data, tgt_df=tgt_df, batch_size=batch_size,
+                           n_row=up_sample_param["n_row"],
+                           n_rep=up_sample_param["n_rep"],
+                           tgt_noise_mult=tgt_noise_mult,
+                           shuffle=shuffle, seed=seed)
+    return batches
@@ -4,7 +4,6 @@
 # -------------------------- # -------------------------- #
 
 import numpy as np
-import pandas as pd
 
 def upscale_targets(df, n=10):
     """
@@ -25,20 +24,181 @@ def upscale_targets(df, n=10):
     
     return df[og_cols]
 
-def even_upsample(grp, n_row=100, n_rep=5):
+def get_rng(rng=None):
     """
+    Returns rng if it is a numpy Generator, a Generator seeded with rng if
+    it is an int, or one seeded from the global numpy random state if None
+    (so np.random.seed still makes results reproducible).
     """
-    n_grp = grp.shape[0]
-    grp_df = []
-    
-    for i in range(n_rep):
-        if n_grp >= n_row:
-            i_df = grp.sample(n_row)
-        else:
-            i_df = pd.concat([grp]*(n_row // n_grp) + 
-                             [grp.sample(n_row % n_grp)], 
-                             ignore_index=True)
-        i_df.loc[:, "grp_id"] = i
-        grp_df.append(i_df)
+    if isinstance(rng, np.random.Generator):
+        return rng
+    if rng is None:
+        rng = np.random.randint(2**31 - 1)
+    return np.random.default_rng(rng)
+
+def upsample_idx(offsets, n_row=100, n_rep=5, rng=None):
+    """
+    Draws row indices resampling each segment of a flat array to n_row
+    rows, n_rep times, with the semantics of even_upsample: segments with
+    at least n_row rows are sampled without replacement, smaller ones are
+    repeated whole and topped up with a sample of the remainder.
+    ***
+    ARGS
+    offsets: array of segment start offsets plus the total number of rows
+    rng: numpy Generator, int seed or None (see get_rng)
+    ***
+    Returns (n_seg x n_rep x n_row) array of row indices.
+    """
+    rng = get_rng(rng)
+    offsets = np.asarray(offsets)
+    n = np.diff(offsets)
+    if (n == 0).any():
+        raise ValueError("Cannot upsample empty segments!")
+    n_seg, start, total = len(n), offsets[0], offsets[-1] - offsets[0]
+    seg = np.repeat(np.arange(n_seg), n)
+    local = np.arange(total) - (offsets[seg] - start)
+
+    # whole copies of small segments fill the first rows
+    n_full = np.where(n >= n_row, 0, n_row // n) * n
+    n_samp = np.where(n >= n_row, n_row, n_row % n)
+    pos = np.arange(n_row)
+    idx = np.broadcast_to(offsets[:-1, np.newaxis] + 
+                          pos[np.newaxis, :] % n[:, np.newaxis],
+                          (n_rep, n_seg, n_row)).transpose(1, 0, 2).copy()
+
+    # random order within each segment, keeping the first n_samp rows
+    order = np.argsort(seg + rng.random((n_rep, total)), axis=1)
+    keep = local < n_samp[seg]
+    rep, p = np.nonzero(np.broadcast_to(keep, (n_rep, total)))
+    idx[seg[p], rep, n_full[seg[p]] + local[p]] = order[rep, p] + start
+
+    return idx
+
+def even_upsample_array(x, offsets, n_row=100, n_rep=5, rng=None, out=None):
+    """
+    Resamples each segment of a (rows x features) array as even_upsample
+    does, gathering straight into a (n_seg x n_rep x n_row x features)
+    array (preallocated out if provided).
+    """
+    idx = upsample_idx(offsets, n_row=n_row, n_rep=n_rep, rng=rng)
+    return np.take(x, idx, axis=0, out=out)
+
+def even_upsample(grp, n_row=100, n_rep=5, rng=None):
+    """
+    """
+    idx = upsample_idx([0, grp.shape[0]], n_row=n_row, n_rep=n_rep, rng=rng)
+    grp_df = grp.iloc[idx.ravel()].reset_index(drop=True)
+    grp_df.loc[:, "grp_id"] = np.repeat(np.arange(n_rep), n_row)
         
-    return pd.concat(grp_df, ignore_index=True)
+    return grp_df
+
+class AugmentationSampler:
+    """
+    Batches of per-doc features augmented at batch time, so each doc is
+    stored once however many augmented copies are drawn.
+    ***
+    ARGS
+    x: (docs x features) array of doc features, e.g. the numeric columns
+       of gen_batch_features(..., n_rep=1)
+    y: array of targets, or None for unlabelled batches
+    sd: array of target standard errors scaling the target noise
+    n_rep: int, augmented copies of each doc per epoch
+    noise_mult: float, target noise is noise_mult*sd*N(0, 1); 0 for none
+    vecs: (tokens x dims) array of word vectors of all docs, in doc order
+    offsets: array of start offsets of each doc in vecs plus the total
+    n_row: int, word vector rows drawn per copy (as gen_word_vec_matrix)
+    ***
+    Every epoch, each of the n_rep copies of a doc gets fresh target
+    noise and word vector draws, seeded by (seed, epoch, batch), and
+    copies are shuffled if shuffle. Indexing yields (inputs, y) with
+    inputs [x] or [vecs, x]; y is omitted if not given.
+    """
+
+    def __init__(self, x, y=None, sd=None, n_rep=1, noise_mult=1, 
+                 vecs=None, offsets=None, n_row=100, batch_size=32, 
+                 shuffle=True, seed=42):
+        self.x = np.asarray(x)
+        self.y = None if y is None else np.asarray(y, dtype=float)
+        self.sd = None if sd is None else np.asarray(sd, dtype=float)
+        self.vecs = vecs
+        self.offsets = None if offsets is None else np.asarray(offsets)
+        self.n_rep = n_rep
+        self.noise_mult = noise_mult
+        self.n_row = n_row
+        self.batch_size = batch_size
+        self.shuffle = shuffle
+        self.seed = seed
+        self.epoch = 0
+        self.n_items = self.x.shape[0]
+        self.__set_order__()
+
+    def __set_order__(self):
+        n_grp = self.n_items * self.n_rep
+        if self.shuffle:
+            rng = np.random.default_rng([self.seed, self.epoch])
+            self.order = rng.permutation(n_grp)
+        else:
+            self.order = np.arange(n_grp)
+
+    def __len__(self):
+        return int(np.ceil(len(self.order) / self.batch_size))
+
+    def __getitem__(self, b):
+        grp = self.order[b*self.batch_size:(b+1)*self.batch_size]
+        i_idx = grp // self.n_rep
+        rng = np.random.default_rng([self.seed, self.epoch, b])
+
+        # draw word vector rows of each copy
+        inputs = [self.x[i_idx]]
+        if self.vecs is not None:
+            rows = np.stack([upsample_idx(self.offsets[i:i+2], 
+                                          n_row=self.n_row, n_rep=1, 
+                                          rng=rng)[0, 0] for i in i_idx])
+            inputs.insert(0, self.vecs[rows][..., np.newaxis])
+        if self.y is None:
+            return inputs
+
+        # add fresh target noise
+        y = self.y[i_idx]
+        if self.noise_mult and self.sd is not None:
+            y = y + (self.noise_mult * self.sd[i_idx] * 
+                     rng.standard_normal(len(i_idx)))
+        return inputs, y
+
+    def __iter__(self):
+        for b in range(len(self)):
+            yield self[b]
+        self.on_epoch_end()
+
+    def on_epoch_end(self):
+        """
+        Moves to the next epoch, with new draws and order.
+        """
+        self.epoch += 1
+        self.__set_order__()
+
+    def generator(self):
+        """
+        Endless generator of batches over epochs, for model.fit with
+        steps_per_epoch=len(self).
+        """
+        while True:
+            for batch in self:
+                yield batch
+
+    def to_sequence(self):
+        """
+        Wraps batches in a keras.utils.Sequence for model.fit.
+        """
+        import keras
+        batches = self
+
+        class BatchSequence(keras.utils.Sequence):
+            def __len__(self):
+                return len(batches)
+            def __getitem__(self, b):
+                return batches[b]
+            def on_epoch_end(self):
+                batches.on_epoch_end()
+
+        return BatchSequence()
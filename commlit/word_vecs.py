@@ -1,23 +1,125 @@
-
 # ---------------------------- # ---------------------------- #
 # Word vector trasnform module # ---------------------------- #
 # ---------------------------- # ---------------------------- #
 
+import numpy as np
 import pandas as pd
-from commlit.feat_eng import gen_token_df
+from commlit.up_scale import upsample_idx
+from commlit.helpers.profiling import timed
+
+def __vec_width__(docs, len_vec=96):
+    """
+    Word vector width of docs, read from a token as models without a
+    vectors table (e.g. en_core_web_sm) give vectors from doc.tensor,
+    or len_vec if all docs are empty.
+    """
+    for doc in docs:
+        if len(doc) > 0:
+            return doc[0].vector.shape[0]
+    return len_vec
 
-def __quantile_means__(x, nq=3):
+def __token_vecs__(doc, token_df=None, width=None):
     """
+    Returns (tokens x dims) array of word vectors for alpha, non-stop,
+    non-punctuation tokens of a doc.
     """
-    if nq > 1:
-        q = pd.qcut(x, nq)
-        return x.groupby(q).mean().values
-    elif nq == 1:
-        return x.mean()
+    if token_df is not None:
+        keep = ((token_df["alpha"] == True) &
+                (token_df["stop"] == False) &
+                (token_df["punct"] == False)).values
     else:
+        keep = np.array([t.is_alpha and not t.is_stop and not t.is_punct
+                         for t in doc], dtype=bool)
+    if width is None:
+        width = __vec_width__([doc])
+    vecs = np.array([token.vector for token, k in zip(doc, keep) if k],
+                    dtype=float)
+    return vecs.reshape(-1, width)
+
+def __pad_sort__(arrs):
+    """
+    Sorts each column of each (tokens x dims) array and stacks them into
+    a (docs x max tokens x dims) array padded with NaN, plus token counts.
+    """
+    n = np.array([a.shape[0] for a in arrs])
+    x = np.full((len(arrs), max(n.max(), 1), arrs[0].shape[1]), np.nan)
+    for i, a in enumerate(arrs):
+        x[i, :n[i]] = a
+    return np.sort(x, axis=1), n
+
+def __sorted_quantiles__(x, n, q):
+    """
+    Linearly interpolated quantiles q of sorted, NaN-padded x per doc and
+    dim, as in pandas/numpy. Returns (docs x len(q) x dims) array.
+    """
+    q = np.asarray(q, dtype=float)
+    pos = q[np.newaxis, :] * (np.maximum(n, 1)[:, np.newaxis] - 1)
+    lo = np.floor(pos).astype(int)
+    hi = np.minimum(lo + 1, np.maximum(n, 1)[:, np.newaxis] - 1)
+    frac = (pos - lo)[:, :, np.newaxis]
+    x_lo = np.take_along_axis(x, lo[:, :, np.newaxis], axis=1)
+    x_hi = np.take_along_axis(x, hi[:, :, np.newaxis], axis=1)
+    out = x_lo + (x_hi - x_lo) * frac
+    out[n == 0] = np.nan
+    return out
+
+def __quantile_means__(x, n, nq=3):
+    """
+    Means of values in each of nq quantile bins (as in pd.qcut) of sorted,
+    NaN-padded x per doc and dim. Returns (docs x nq x dims) array.
+    """
+    if nq < 1:
         print("nq must be 1 or greater!")
-        return     
-    
+        return
+    edges = __sorted_quantiles__(x, n, np.linspace(0, 1, nq + 1))
+
+    # number of values up to each bin edge, bins closed on the right
+    n_le = (x[:, :, np.newaxis, :] <=
+            edges[:, np.newaxis, 1:-1, :]).sum(axis=1)
+    n_le = np.concatenate([np.zeros_like(n_le[:, :1]), n_le,
+                           np.broadcast_to(n[:, np.newaxis, np.newaxis],
+                                           n_le[:, :1].shape)], axis=1)
+
+    # bin sums from cumulative sums of sorted values
+    cs = np.concatenate([np.zeros_like(x[:, :1]),
+                         np.cumsum(np.nan_to_num(x), axis=1)], axis=1)
+    cs = np.take_along_axis(cs, n_le, axis=1)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return (cs[:, 1:] - cs[:, :-1]) / (n_le[:, 1:] - n_le[:, :-1])
+
+def __word_vec_feat_names__(n_dim, method="qval_fp", q=[0.2, 0.8], nq=3):
+    """
+    Feature names in the order produced by gen_word_vec_feat.
+    """
+    vec_cols = ["vec_" + str(i) for i in range(n_dim)]
+    if method == "qmeans":
+        return [v + "_q_" + str(k+1) for v in vec_cols for k in range(nq)]
+    if method == "qval_fp":
+        return [v + "_" + s for s in ["q"+str(int(q_val*100)) for
+                                      q_val in q] + ["frac_pos"]
+                for v in vec_cols]
+
+def __word_vec_feat_arrays__(arrs, method="qval_fp", q=[0.2, 0.8], nq=3):
+    """
+    Computes word vector summary features for a list of (tokens x dims)
+    arrays, returning a (docs x features) array.
+    """
+    x, n = __pad_sort__(arrs)
+
+    # compute quantile means if selected
+    if method == "qmeans":
+        out = __quantile_means__(x, n, nq=nq)
+        return out.transpose(0, 2, 1).reshape(len(arrs), -1)
+
+    # compute quantile values and frac pos if selected
+    if method == "qval_fp":
+        with np.errstate(invalid="ignore", divide="ignore"):
+            frac_pos = (x > 0).sum(axis=1) / n[:, np.newaxis]
+        out = np.concatenate([__sorted_quantiles__(x, n, q),
+                              frac_pos[:, np.newaxis, :]], axis=1)
+        return out.reshape(len(arrs), -1)
+
+@timed("word_vecs.gen_word_vec_feat", rows=lambda doc, *a, **k: len(doc))
 def gen_word_vec_feat(doc, token_df=None, method="qval_fp",
                       q=[0.2, 0.8], nq=3):
     """
@@ -25,61 +127,65 @@ def gen_word_vec_feat(doc, token_df=None, method="qval_fp",
         "qval_fp": quantile values (passed to q), fraction positive
         "qmeans": means of nq quantiles
     """
-    
-    # gen token metadata df
-    if token_df is None:
-        token_df = gen_token_df(doc)
-    
-    # compile word vectors
-    vecs = [token.vector for token in doc]
-    vec_df = pd.DataFrame(vecs, columns=["vec_" + str(i) for 
-                                         i in range(len(vecs[0]))])
-    
-    # concat token metadata and word vecs
-    df = pd.concat([token_df, vec_df], axis=1)
-    df = df[(df["alpha"] == True) & 
-            (df["stop"] == False) & 
-            (df["punct"] == False)]
-    df = df.drop(columns=[c for c in df.columns 
-                          if not c.startswith("vec_")])
-    
-    # compute quantile means if selected
-    if method == "qmeans":
-        q_df = df.apply(__quantile_means__, axis=0, nq=nq)
-        q_df.loc[:, "q_id"] = ["q_" + str(q+1) for q in range(nq)]
-        q_df = q_df.melt(id_vars="q_id")
-        q_df.loc[:, "variable"] = q_df["variable"] + "_" + q_df["q_id"]
-        
-    # compute quantile values and frac pos if selected
-    if method == "qval_fp":
-        q_df = df.quantile(q).transpose().join((df > 0).mean().rename("v")
-                                               ).reset_index()
-        q_df.columns = ["idx"] + ["q"+str(int(q_val*100)) 
-                                  for q_val in q] + ["frac_pos"]
-        q_df = q_df.melt(id_vars="idx")
-        q_df.loc[:, "variable"] = q_df["idx"] + "_" + q_df["variable"]
-        
-    return dict(zip(q_df["variable"], q_df["value"]))
+    arr = __token_vecs__(doc, token_df)
+    feat = __word_vec_feat_arrays__([arr], method=method, q=q, nq=nq)
+    names = __word_vec_feat_names__(arr.shape[1], method=method, q=q, nq=nq)
+    return dict(zip(names, feat[0]))
 
-def gen_word_vec_matrix(doc, nrows=100, stop_min=4, return_df=False):
+@timed("word_vecs.gen_batch_word_vec_feat", 
+       rows=lambda docs, *a, **k: sum(len(doc) for doc in docs))
+def gen_batch_word_vec_feat(docs, token_dfs=None, method="qval_fp",
+                            q=[0.2, 0.8], nq=3, batch_size=256):
+    """
+    Batch variant of gen_word_vec_feat, returning a DataFrame with one
+    row of features per doc. Docs are processed batch_size at a time
+    on a single padded (docs x tokens x dims) array.
+    """
+    if token_dfs is None:
+        token_dfs = [None] * len(docs)
+    width = __vec_width__(docs)
+    arrs = [__token_vecs__(doc, t, width) for doc, t in zip(docs, token_dfs)]
+    feat = np.vstack([__word_vec_feat_arrays__(arrs[b:b+batch_size],
+                                               method=method, q=q, nq=nq)
+                      for b in range(0, len(arrs), batch_size)])
+    names = __word_vec_feat_names__(arrs[0].shape[1], 
+                                    method=method, q=q, nq=nq)
+    return pd.DataFrame(feat, columns=names)
+
+@timed("word_vecs.gen_word_vec_matrix", rows=lambda doc, *a, **k: len(doc))
+def gen_word_vec_matrix(doc, nrows=100, stop_min=4, return_df=False,
+                        rng=None):
     """
     """
     
     # filter stop words and non-alpha tokens
-    vecs = [token.vector for token in doc if token.is_alpha and
-            ((not token.is_stop) or (token.is_stop and len(token)>stop_min))]
-    vec_df = pd.DataFrame(vecs)
+    vecs = np.array([token.vector for token in doc if token.is_alpha and
+                     ((not token.is_stop) or 
+                      (token.is_stop and len(token)>stop_min))])
     
     # pad or downsample to desired numbers of rows
-    nvecs = vec_df.shape[0]
-    if nvecs < nrows:
-        vec_df = pd.concat([vec_df, vec_df.sample(nrows-nvecs)])
-    elif nvecs > nrows:
-        vec_df = vec_df.sample(nrows)
+    nvecs = vecs.shape[0]
+    if nvecs != nrows:
+        idx = upsample_idx([0, nvecs], n_row=nrows, n_rep=1, rng=rng)
+        vecs = vecs[idx[0, 0]]
         
     # return output in desired format
     if return_df:
-        return vec_df
+        return pd.DataFrame(vecs)
     else:
-        return vec_df.values
-    
\ No newline at end of file
+        return vecs
+
+def gen_word_vec_rows(docs, stop_min=4):
+    """
+    Word vectors of the tokens gen_word_vec_matrix samples from, for all
+    docs in one (tokens x dims) array, plus the start offset of each doc
+    and the total. Used to draw word vector matrices at batch time with
+    AugmentationSampler rather than storing n_rep samples per doc.
+    """
+    width = __vec_width__(docs)
+    vecs = [np.array([token.vector for token in doc if token.is_alpha and
+                      ((not token.is_stop) or len(token)>stop_min)],
+                     dtype=np.float32).reshape(-1, width)
+            for doc in docs]
+    offsets = np.concatenate([[0], np.cumsum([v.shape[0] for v in vecs])])
+    return np.concatenate(vecs), offsets
@@ -0,0 +1,63 @@
+import os
+import numpy as np
+import pytest
+
+@pytest.fixture
+def tiny_config():
+    """
+    build_model config for small inputs, with n_q quantile branches.
+    """
+    def config(n_q=2):
+        return {"cnn": {"shape": (None, 7, 12, 1), "filters": 5,
+                        "acti": "relu", "l2_reg": 1e-4},
+                "att": {"shape": (None, 7, 4, 1), "filters": 5,
+                        "acti": "sigmoid", "l2_reg": 1e-4},
+                "agg": {"shape": 6, "drop": 0.1, "dense": True, "n": 3,
+                        "acti": "relu", "l2_reg": 1e-4},
+                "Q": {"n_q": n_q, "shape": 4, "drop": 0.1, "dense": True,
+                      "n": 3, "acti": "tanh", "l2_reg": 1e-4},
+                "extra": {"use": True, "n": 8, "acti": "elu",
+                          "l2_reg": 1e-4},
+                "out": {"acti": "linear", "l2_reg": 1e-4}}
+    return config
+
+@pytest.fixture
+def tiny_inputs():
+    """
+    Random standard-layout inputs [x, a, m, *q] for a tiny_config.
+    """
+    def inputs(config, n=9, seed=0):
+        rng = np.random.default_rng(seed)
+        arrays = [rng.normal(size=(n,) + config[k]["shape"][1:]
+                             ).astype(np.float32) for k in ["cnn", "att"]]
+        arrays.append(rng.normal(size=(n, config["agg"]["shape"])
+                                 ).astype(np.float32))
+        arrays += [rng.normal(size=(n, config["Q"]["shape"])
+                              ).astype(np.float32)
+                   for q in range(config["Q"]["n_q"])]
+        return arrays
+    return inputs
+
+@pytest.fixture
+def kaggle_cli(tmp_path, monkeypatch):
+    """
+    Puts the fake kaggle CLI (see fake_kaggle.py) first on PATH, serving
+    4 files of 1 KB without latency. Returns a function setting its
+    FAKE_KAGGLE_* options and a log of the calls made.
+    """
+    import fake_kaggle
+    bin_dir = str(tmp_path / "bin")
+    fake_kaggle.install(bin_dir)
+    monkeypatch.setenv("PATH", bin_dir + os.pathsep + os.environ["PATH"])
+    monkeypatch.setenv("LAZYKAGGLER_CACHE", str(tmp_path / "cache"))
+    log = tmp_path / "kaggle.log"
+
+    def configure(**options):
+        for k, v in options.items():
+            monkeypatch.setenv("FAKE_KAGGLE_" + k.upper(), str(v))
+    configure(files=4, kb=1, latency=0, log=log)
+
+    def calls():
+        return log.read_text().splitlines() if log.exists() else []
+    configure.calls = calls
+    return configure
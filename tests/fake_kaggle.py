@@ -0,0 +1,111 @@
+## Stand-in for the kaggle CLI serving a synthetic competition ##
+
+# Run as `kaggle` after install() puts it first on PATH. Configured
+# through environment variables:
+#   FAKE_KAGGLE_FILES    number of files of the competition
+#   FAKE_KAGGLE_KB       size of each file in KB
+#   FAKE_KAGGLE_LATENCY  seconds each call takes
+#   FAKE_KAGGLE_COMPS    number of competitions listed
+#   FAKE_KAGGLE_DATE     creationDate of every file
+#   FAKE_KAGGLE_VERSION  salt of file contents, to change files remotely
+#   FAKE_KAGGLE_MEMBER   name of the member of zipped downloads
+#   FAKE_KAGGLE_PAGING   "0" to reject paging flags, as kaggle<1.6 does
+#   FAKE_KAGGLE_LOG      file each call's arguments are appended to
+
+# packages
+import os
+import sys
+import time
+import zipfile
+import hashlib
+
+def install(bin_dir, python=None):
+    """
+    Writes a `kaggle` executable running this script to bin_dir and
+    returns its path; put bin_dir first on PATH to use it.
+    """
+    os.makedirs(bin_dir, exist_ok=True)
+    path = os.path.join(bin_dir, "kaggle")
+    with open(path, "w") as wf:
+        wf.write('#!/bin/sh\nexec "%s" "%s" "$@"\n'%(
+            python or sys.executable, os.path.abspath(__file__)))
+    os.chmod(path, 0o755)
+    return path
+
+def names(n_files):
+    return ["train.csv", "test.csv"] + \
+        ["train/img_%04d.dcm"%i for i in range(n_files - 2)]
+
+def content(name, kb, version=""):
+    seed = hashlib.sha256((version + name).encode()).digest()
+    return (seed * (kb * 1024 // len(seed) + 1))[:kb * 1024]
+
+def opt(args, flag, default=None):
+    return args[args.index(flag) + 1] if flag in args else default
+
+def main(args):
+    env = os.environ
+    n_files = int(env.get("FAKE_KAGGLE_FILES", "20"))
+    kb = int(env.get("FAKE_KAGGLE_KB", "256"))
+    latency = float(env.get("FAKE_KAGGLE_LATENCY", "0.2"))
+    n_comps = int(env.get("FAKE_KAGGLE_COMPS", "50"))
+    date = env.get("FAKE_KAGGLE_DATE", "2021-05-03 12:00:00")
+    version = env.get("FAKE_KAGGLE_VERSION", "")
+    if "FAKE_KAGGLE_LOG" in env:
+        with open(env["FAKE_KAGGLE_LOG"], "a") as wf:
+            wf.write(" ".join(args) + "\n")
+    time.sleep(latency)
+
+    if args[:2] == ["competitions", "download"]:
+        comp, path, name = args[2], opt(args, "-p", "."), opt(args, "-f")
+        if name is None:
+            with zipfile.ZipFile(os.path.join(path, comp + ".zip"),
+                                 "w") as zf:
+                for n in names(n_files):
+                    zf.writestr(n, content(n, kb, version))
+        elif name not in names(n_files):
+            sys.exit("404 - Not Found")
+        elif name.endswith(".csv"):
+            base = name.split("/")[-1]
+            with zipfile.ZipFile(os.path.join(path, base + ".zip"), "w",
+                                 zipfile.ZIP_DEFLATED) as zf:
+                zf.writestr(env.get("FAKE_KAGGLE_MEMBER", base),
+                            content(name, kb, version))
+        else:
+            with open(os.path.join(path, name.split("/")[-1]), "wb") as wf:
+                wf.write(content(name, kb, version))
+    elif args[:2] == ["competitions", "files"] and args[2] == "missing":
+        sys.exit("404 - Not Found")
+    elif args[:2] == ["competitions", "files"]:
+        paged = [f for f in ["--page-size", "--page-token"] if f in args]
+        if env.get("FAKE_KAGGLE_PAGING") == "0" and len(paged) > 0:
+            # argparse of the CLI before paging was added
+            sys.stderr.write("usage: kaggle competitions files\n" +
+                             "kaggle: error: unrecognized arguments: " +
+                             " ".join(paged) + "\n")
+            sys.exit(2)
+        # pages of --page-size files, the token being the next offset
+        all_names = names(n_files)
+        size = int(opt(args, "--page-size", str(len(all_names))))
+        start = int(opt(args, "--page-token", "0"))
+        if start + size < n_files:
+            print("Next Page Token = %d"%(start + size))
+        print("name,size,creationDate")
+        for n in all_names[start:start + size]:
+            print("%s,%dKB,%s"%(n, kb, date))
+    elif args[:2] == ["competitions", "list"]:
+        # numbered pages of 20 competitions
+        page = int(opt(args, "--page", "1"))
+        comps = range(n_comps)[(page - 1) * 20:page * 20]
+        if len(comps) == 0:
+            print("No competitions found")
+        else:
+            print("ref,deadline,category,reward,teamCount,userHasEntered")
+            for c in comps:
+                print("comp-%d,2030-01-01 00:00:00,Featured,$1000,%d,False"%(
+                    c, c))
+    else:
+        sys.exit("unsupported: " + " ".join(args))
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
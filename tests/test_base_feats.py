@@ -0,0 +1,36 @@
+import pandas as pd
+from commlit.helpers.synthetic import stand_in_nlp, gen_vocab, gen_corpus, \
+    gen_freq_df, ALL_TAGS
+from commlit.pre_proc import gen_tag_df, gen_token_df, gen_sent_df, \
+    gen_ent_df
+from commlit.base_feats import gen_base_features, gen_corpus_base_features
+
+VOCAB = gen_vocab(n_words=300)
+ALL_ENTS = ["PERSON", "ORG", "GPE"]
+
+def test_corpus_features_match_per_doc():
+    nlp = stand_in_nlp(VOCAB)
+    corpus = gen_corpus(6, VOCAB)
+    docs = list(nlp.pipe(corpus["excerpt"]))
+    freq_df = gen_freq_df(VOCAB)
+    tag_df = gen_tag_df(ALL_TAGS)
+    frames = [(gen_token_df(doc, freq_df), gen_sent_df(doc),
+               gen_ent_df(doc)) for doc in docs]
+
+    # per-doc features, one row per doc
+    expected = pd.DataFrame([gen_base_features(*f, tag_df=tag_df,
+                                               all_ents=ALL_ENTS)
+                             for f in frames], index=corpus["id"])
+
+    # the same docs as one segmented corpus
+    def stack(k):
+        return pd.concat([f[k] for f in frames], keys=corpus["id"],
+                         names=["id", None]).reset_index(level=0)
+    res = gen_corpus_base_features(stack(0), stack(1), stack(2),
+                                   tag_df=tag_df, all_ents=ALL_ENTS,
+                                   ids=corpus["id"])
+    assert set(res.columns) == set(expected.columns)
+
+    # docs without entities get integer zeros per doc
+    pd.testing.assert_frame_equal(res[expected.columns], expected,
+                                  check_names=False, check_dtype=False)
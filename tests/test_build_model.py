@@ -0,0 +1,35 @@
+import numpy as np
+import pytest
+
+tf = pytest.importorskip("tensorflow")
+
+from commlit.build_model import build_model, load_standard_weights
+from commlit.export import fuse_inputs, is_fused
+
+@pytest.mark.parametrize("n_q", [0, 2])
+def test_fused_matches_standard(n_q, tiny_config, tiny_inputs):
+    config = tiny_config(n_q)
+    inputs = tiny_inputs(config)
+    tf.random.set_seed(0)
+    std = build_model(**config)
+    fused = load_standard_weights(build_model(**config, fused=True), std,
+                                  **config)
+    a = np.asarray(std(inputs, training=False))
+    b = np.asarray(fused(fuse_inputs(inputs, n_q), training=False))
+    np.testing.assert_allclose(a, b, atol=1e-5)
+    assert is_fused(fused) and not is_fused(std)
+
+def test_standard_weights_file(tmp_path, tiny_config, tiny_inputs):
+    # the standard graph keeps default layer names, as in old checkpoints
+    config = tiny_config()
+    inputs = tiny_inputs(config)
+    std = build_model(**config)
+    assert "cnn" not in [l.name for l in std.layers]
+    path = str(tmp_path / "std.h5")
+    std.save_weights(path)
+    fused = load_standard_weights(build_model(**config, fused=True), path,
+                                  **config)
+    np.testing.assert_allclose(
+        np.asarray(std(inputs, training=False)),
+        np.asarray(fused(fuse_inputs(inputs, 2), training=False)),
+        atol=1e-5)
@@ -0,0 +1,37 @@
+import pytest
+import fake_kaggle
+from commlit.lazykaggler.competitions import competition_files, \
+    competition_list
+
+def test_files_walk_every_page(kaggle_cli):
+    kaggle_cli(files=8)
+    df = competition_files("comp", page_size=3)
+    assert list(df["name"]) == fake_kaggle.names(8)
+    assert len(kaggle_cli.calls()) == 3
+    assert "--page-token 6" in kaggle_cli.calls()[-1]
+
+    # cached until refreshed
+    assert competition_files("comp", page_size=3).equals(df)
+    assert len(kaggle_cli.calls()) == 3
+    competition_files("comp", page_size=3, refresh=True)
+    assert len(kaggle_cli.calls()) == 6
+
+def test_files_without_paging_flags(kaggle_cli):
+    # kaggle<1.6 (e.g. the pinned 1.5.12) rejects the paging flags
+    kaggle_cli(files=8, paging=0)
+    df = competition_files("comp", page_size=3, ttl=0)
+    assert list(df["name"]) == fake_kaggle.names(8)
+    calls = kaggle_cli.calls()
+    assert len(calls) == 2 and "--page-size" not in calls[1]
+
+def test_other_cli_errors_raise(kaggle_cli):
+    with pytest.raises(RuntimeError, match="404"):
+        competition_files("missing", ttl=0)
+    assert len(kaggle_cli.calls()) == 1
+
+def test_list_pages_in_order(kaggle_cli):
+    kaggle_cli(comps=45)
+    df = competition_list(n_jobs=2, ttl=0)
+    assert list(df["ref"]) == ["comp-%d"%c for c in range(45)]
+    df = competition_list(n_jobs=4, max_pages=2, ttl=0)
+    assert len(df) == 40
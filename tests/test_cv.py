@@ -0,0 +1,30 @@
+import os
+import numpy as np
+import pytest
+from commlit.cv import fold_ids, run_cv
+
+def test_fold_ids_keep_ids_together():
+    ids = np.repeat(["a", "b", "c", "d", "e", "f", "g"], 3)
+    folds = fold_ids(ids, n_folds=3, seed=0)
+    for i in np.unique(ids):
+        assert len(set(folds[ids == i])) == 1
+    assert sorted(np.bincount(folds[::3])) == [2, 2, 3]
+    assert np.array_equal(folds, fold_ids(ids, n_folds=3, seed=0))
+    with pytest.raises(ValueError):
+        fold_ids(ids, n_folds=8)
+
+def test_run_cv_one_epoch(tmp_path, tiny_config, tiny_inputs):
+    pytest.importorskip("tensorflow")
+    config = tiny_config()
+    inputs = tiny_inputs(config, n=24)
+    y = np.random.default_rng(0).normal(size=24)
+    ids = np.repeat(np.arange(8), 3)
+    oof, folds, timings = run_cv(
+        inputs, y, ids, config, n_folds=2, n_jobs=1,
+        fit_kwargs={"epochs": 1}, batch_size=8,
+        weights_dir=str(tmp_path))
+    assert oof.shape == (24,) and np.isfinite(oof).all()
+    assert np.array_equal(folds, fold_ids(ids, n_folds=2))
+    assert list(timings.index) == [0, 1]
+    assert (timings["n_train"] + timings["n_val"] == 24).all()
+    assert sorted(os.listdir(str(tmp_path))) == ["fold_0.h5", "fold_1.h5"]
@@ -0,0 +1,37 @@
+import numpy as np
+from commlit.helpers.synthetic import stand_in_nlp, gen_vocab, gen_corpus
+from commlit.doc_cache import DocCache
+
+VOCAB = gen_vocab(n_words=300)
+
+def test_cached_docs_keep_tensor(tmp_path):
+    # token vectors of this pipeline come from doc.tensor
+    nlp = stand_in_nlp(VOCAB, tensor=True)
+    texts = list(gen_corpus(5, VOCAB)["excerpt"])
+    cache = DocCache(str(tmp_path), nlp)
+    parsed = list(cache.pipe(texts))
+    cached = list(DocCache(str(tmp_path), nlp).pipe(texts))
+    assert cache.misses == 5
+    for a, b in zip(parsed, cached):
+        assert [t.text for t in a] == [t.text for t in b]
+        assert np.array_equal(np.array([t.vector for t in a]),
+                              np.array([t.vector for t in b]))
+
+def test_readonly_hits_refresh_lru(tmp_path):
+    nlp = stand_in_nlp(VOCAB)
+    texts = list(gen_corpus(2, VOCAB)["excerpt"])
+    cache = DocCache(str(tmp_path), nlp)
+    list(cache.pipe(texts[:1]))
+    list(cache.pipe(texts[1:]))
+    first, second = sorted(cache.manifest["shards"],
+                           key=lambda s: cache.manifest["shards"][s]
+                           ["last_used"])
+
+    # a worker reads the older shard and hands its access time back
+    worker = DocCache(str(tmp_path), nlp, readonly=True)
+    list(worker.pipe(texts[:1]))
+    cache.put_bytes(*worker.pop_new())
+    shards = cache.manifest["shards"]
+    cache.max_bytes = max(s["bytes"] for s in shards.values())
+    cache.evict()
+    assert list(cache.manifest["shards"]) == [first]
@@ -0,0 +1,71 @@
+import os
+import hashlib
+import pytest
+import fake_kaggle
+from commlit.lazykaggler.downloads import DownloadManager, file_sha256
+from commlit.lazykaggler.competitions import competition_files
+
+NAMES = fake_kaggle.names(4)
+
+def source_sha256(name, version=""):
+    return hashlib.sha256(fake_kaggle.content(name, 1, version)).hexdigest()
+
+def test_download_all_then_skip(tmp_path, kaggle_cli):
+    local = str(tmp_path / "data")
+    listing = competition_files("comp", ttl=0)
+    res = DownloadManager("comp", local, n_jobs=2).download_all(listing)
+    assert list(res["name"]) == NAMES
+    assert set(res["status"]) == {"downloaded"}
+    for name in NAMES:
+        assert file_sha256(os.path.join(local, name)) == source_sha256(name)
+
+    # unchanged files are skipped without calling the CLI
+    n_calls = len(kaggle_cli.calls())
+    res = DownloadManager("comp", local, n_jobs=2).download_all(listing)
+    assert set(res["status"]) == {"skipped"}
+    assert len(kaggle_cli.calls()) == n_calls
+
+@pytest.mark.parametrize("change", [{"kb": 2},
+                                    {"date": "2022-01-01 00:00:00"}])
+def test_remote_change_downloads_again(tmp_path, kaggle_cli, change):
+    local = str(tmp_path / "data")
+    manager = DownloadManager("comp", local)
+    manager.download_all(competition_files("comp", ttl=0))
+
+    # files changed on Kaggle are listed with a new size or date
+    kaggle_cli(version="v2", **change)
+    res = manager.download_all(competition_files("comp", ttl=0))
+    assert set(res["status"]) == {"downloaded"}
+    path = os.path.join(local, "train.csv")
+    assert file_sha256(path) == hashlib.sha256(fake_kaggle.content(
+        "train.csv", change.get("kb", 1), "v2")).hexdigest()
+
+def test_changed_local_file_downloads_again(tmp_path, kaggle_cli):
+    local = str(tmp_path / "data")
+    manager = DownloadManager("comp", local, verify=True)
+    assert manager.download("test.csv") == "downloaded"
+    path = os.path.join(local, "test.csv")
+    with open(path, "r+b") as wf:
+        wf.write(b"x")
+    assert manager.download("test.csv") == "downloaded"
+    assert file_sha256(path) == source_sha256("test.csv")
+
+def test_member_outside_local_path(tmp_path, kaggle_cli):
+    local = str(tmp_path / "data")
+    kaggle_cli(member="../../escaped.csv")
+    manager = DownloadManager("comp", local)
+    with pytest.raises(ValueError):
+        manager.download("train.csv")
+    assert not os.path.exists(str(tmp_path / "escaped.csv"))
+    assert sorted(os.listdir(local)) == []
+    assert not manager.is_current("train.csv")
+
+def test_failed_download_keeps_error(tmp_path, kaggle_cli):
+    local = str(tmp_path / "data")
+    manager = DownloadManager("comp", local)
+    assert manager.download("missing.csv") == "failed"
+    assert "404" in manager.errors["missing.csv"]
+    res = manager.download_all(["missing.csv", "test.csv"])
+    assert list(res["status"]) == ["failed", "downloaded"]
+    assert "404" in res["error"][0] and res["error"][1] is None
+    assert not manager.is_current("missing.csv")
@@ -0,0 +1,18 @@
+import numpy as np
+import pandas as pd
+from commlit.helpers.dtypes import compact_dtypes, concat_compact
+
+def test_concat_keeps_shared_categories():
+    docs = [["the", "cat", "sat"], ["a", "dog", "sat", "the"]]
+    frames = [compact_dtypes(pd.DataFrame({"word": d, "pos": "NOUN",
+                                           "length": np.ones(len(d))}))
+              for d in docs]
+    assert pd.concat(frames)["word"].dtype == object
+
+    res = concat_compact(frames, ignore_index=True)
+    assert isinstance(res["word"].dtype, pd.CategoricalDtype)
+    assert isinstance(res["pos"].dtype, pd.CategoricalDtype)
+    assert res["length"].dtype == np.float32
+    assert res["word"].tolist() == docs[0] + docs[1]
+    assert sorted(res["word"].cat.categories) == ["a", "cat", "dog", "sat",
+                                                  "the"]
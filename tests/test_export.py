@@ -0,0 +1,35 @@
+import numpy as np
+import pytest
+
+tf = pytest.importorskip("tensorflow")
+
+from commlit.build_model import build_model
+from commlit.export import fuse_inputs, is_fused, export_numpy, \
+    export_tflite, load_exported, NumpyModel
+
+@pytest.mark.parametrize("fused", [False, True])
+def test_numpy_export_matches_keras(tmp_path, tiny_config, tiny_inputs,
+                                    fused):
+    config = tiny_config()
+    inputs = tiny_inputs(config)
+    model = build_model(**config, fused=fused)
+    path = str(tmp_path / "model.npz")
+    export_numpy(model, path, **config)
+    exported = load_exported(path)
+    assert isinstance(exported, NumpyModel)
+
+    # keras inputs, and the standard layout for either graph
+    keras_inputs = fuse_inputs(inputs, 2) if fused else inputs
+    expected = np.asarray(model(keras_inputs, training=False))
+    np.testing.assert_allclose(exported.predict(keras_inputs), expected,
+                               atol=1e-5)
+    np.testing.assert_allclose(exported.predict(inputs, batch_size=4),
+                               expected, atol=1e-5)
+
+def test_tflite_export_keeps_fused_inputs(tmp_path, tiny_config):
+    config = tiny_config()
+    path = str(tmp_path / "model.tflite")
+    export_tflite(build_model(**config, fused=True), path)
+    assert is_fused(load_exported(path))
+    export_tflite(build_model(**config), path)
+    assert not is_fused(load_exported(path))
@@ -0,0 +1,82 @@
+import numpy as np
+import pandas as pd
+from commlit.helpers.synthetic import stand_in_nlp, gen_vocab, gen_corpus, \
+    gen_freq_df, ALL_TAGS
+from commlit.freq_index import FrequencyIndex
+from commlit.pre_proc import gen_tag_df
+from commlit.raw_feats import gen_raw_word_features
+from commlit.train_data import gen_train_data
+from commlit.feat_cache import FeatureCache
+
+VOCAB = gen_vocab(n_words=300)
+
+def test_only_changed_features_recomputed(tmp_path):
+    nlp = stand_in_nlp(VOCAB)
+    docs = list(nlp.pipe(gen_corpus(4, VOCAB)["excerpt"]))
+    freq_df = FrequencyIndex.from_df(gen_freq_df(VOCAB))
+    cache = FeatureCache(str(tmp_path), nlp)
+    base = cache.base_features(docs, freq_df)
+    cache.word_vec_feat(docs, q=[0.2, 0.8])
+    assert (cache.hits, cache.misses) == (0, 8)
+
+    # new quantiles only miss the word-vec features
+    again = FeatureCache(str(tmp_path), nlp)
+    pd.testing.assert_frame_equal(again.base_features(docs, freq_df), base)
+    again.word_vec_feat(docs, q=[0.5])
+    assert (again.hits, again.misses) == (4, 4)
+    assert again.stats()["n_results"] == 12
+
+def test_readonly_results_put_by_parent(tmp_path):
+    nlp = stand_in_nlp(VOCAB)
+    docs = list(nlp.pipe(gen_corpus(3, VOCAB)["excerpt"]))
+    cache = FeatureCache(str(tmp_path), nlp)
+    worker = FeatureCache(str(tmp_path), nlp, readonly=True)
+    feat = worker.word_vec_feat(docs)
+    assert cache.stats()["n_results"] == 0
+    cache.put_bytes(*worker.pop_new())
+    pd.testing.assert_frame_equal(cache.word_vec_feat(docs), feat)
+    assert (cache.hits, cache.misses) == (3, 0)
+
+def test_freq_change_only_recomputes_raw_features(tmp_path):
+    nlp = stand_in_nlp(VOCAB)
+    docs = list(nlp.pipe(gen_corpus(4, VOCAB)["excerpt"]))
+    tag_df = gen_tag_df(ALL_TAGS)
+    freq_df = FrequencyIndex.from_df(gen_freq_df(VOCAB))
+    cache = FeatureCache(str(tmp_path), nlp)
+    base = cache.base_features(docs, freq_df)
+    wv = cache.word_vec_feat(docs)
+    raw = cache.raw_word_features(docs, tag_df, freq_df)
+    assert (cache.hits, cache.misses) == (0, 12)
+
+    # a new freq_df misses only the raw word features
+    new_freq_df = FrequencyIndex.from_df(gen_freq_df(VOCAB, seed=1))
+    again = FeatureCache(str(tmp_path), nlp)
+    pd.testing.assert_frame_equal(again.base_features(docs, freq_df), base)
+    pd.testing.assert_frame_equal(again.word_vec_feat(docs), wv)
+    new_raw = again.raw_word_features(docs, tag_df, new_freq_df)
+    assert (again.hits, again.misses) == (8, 4)
+    assert not new_raw[0]["comm_score"].equals(raw[0]["comm_score"])
+    for cached, res in zip(again.raw_word_features(docs, tag_df, freq_df),
+                           raw):
+        pd.testing.assert_frame_equal(cached, res)
+    assert (again.hits, again.misses) == (12, 4)
+
+def test_train_data_from_cached_raw_features(tmp_path):
+    nlp = stand_in_nlp(VOCAB)
+    corpus = gen_corpus(5, VOCAB)
+    df = corpus[["id"]].assign(doc=list(nlp.pipe(corpus["excerpt"])))
+    tgt_df = corpus[["id", "target", "standard_error"]]
+    tag_df, freq_df = gen_tag_df(ALL_TAGS), gen_freq_df(VOCAB)
+    raw = pd.concat([gen_raw_word_features(doc, tag_df, freq_df).assign(id=i)
+                     for doc, i in zip(df["doc"], df["id"])],
+                    ignore_index=True)
+    expected = gen_train_data(raw, tgt_df)
+
+    # computed and cached, then loaded
+    for n_misses in [5, 0]:
+        cache = FeatureCache(str(tmp_path), nlp)
+        res = gen_train_data(df, tgt_df, feat_cache=cache, tag_df=tag_df,
+                             freq_df=freq_df)
+        assert cache.misses == n_misses and res[6] == expected[6]
+        for arr, exp in zip(res[:3], expected[:3]):
+            np.testing.assert_allclose(arr, exp)
@@ -0,0 +1,21 @@
+import io
+import numpy as np
+import pandas as pd
+from commlit.helpers.synthetic import stand_in_nlp
+from commlit.freq_index import FrequencyIndex
+from commlit.pre_proc import gen_token_df
+
+def test_missing_words_are_skipped():
+    # read_csv reads the words "null" and "nan" as NaN
+    freq_df = pd.read_csv(io.StringIO("word,count\nthe,50\nnull,7\n" +
+                                      "cat,3\nnan,9\n"))
+    assert freq_df["word"].isna().sum() == 2
+    index = FrequencyIndex.from_df(freq_df)
+    assert len(index) == 2
+    np.testing.assert_array_equal(index.lookup_words(["cat", "the", "dog"]),
+                                  [3, 50, np.nan])
+
+    # same counts as merging freq_df onto the tokens
+    doc = stand_in_nlp(["the", "cat"])("The cat ate nan null.")
+    pd.testing.assert_frame_equal(gen_token_df(doc, index),
+                                  gen_token_df(doc, freq_df))
@@ -0,0 +1,26 @@
+import numpy as np
+import pandas as pd
+from commlit.helpers.segments import seg_quantiles
+
+Q = [0, 0.025, 0.1, 0.5, 0.7, 0.975, 1]
+
+def test_quantiles_match_pandas():
+    rng = np.random.default_rng(0)
+
+    # unsorted segments of 1 to 40 rows, values with many ties
+    sizes = np.concatenate([[1, 1, 2], rng.integers(1, 40, size=50)])
+    seg = rng.permutation(np.repeat(np.arange(len(sizes)), sizes))
+    values = np.column_stack([rng.integers(0, 5, size=len(seg)),
+                              rng.normal(size=len(seg))]).astype(float)
+
+    res = seg_quantiles(values, seg, len(sizes), Q)
+    expected = pd.DataFrame(values).groupby(seg).quantile(Q)
+    for j in range(values.shape[1]):
+        np.testing.assert_allclose(
+            res[:, :, j], expected[j].unstack().to_numpy(), rtol=1e-12)
+
+def test_quantiles_of_empty_segments_are_nan():
+    seg = np.array([2, 0, 2, -1])
+    res = seg_quantiles(np.array([3., 1., 5., 7.]), seg, 3, [0, 0.5, 1])
+    np.testing.assert_array_equal(res[[0, 2]], [[1, 1, 1], [3, 4, 5]])
+    assert np.isnan(res[1]).all()
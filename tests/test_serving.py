@@ -0,0 +1,23 @@
+import asyncio
+from commlit.serving import MicroBatcher
+
+def test_scores_in_order():
+    async def run():
+        async with MicroBatcher(lambda texts: [len(t) for t in texts],
+                                max_batch_size=4) as batcher:
+            return await asyncio.gather(*[batcher.submit("x" * i)
+                                          for i in range(10)])
+    assert asyncio.run(run()) == list(range(10))
+
+def test_short_scores_fail_every_request():
+    async def run():
+        async with MicroBatcher(lambda texts: [0.0] * (len(texts) - 1),
+                                max_batch_size=4, max_wait=0.05) as batcher:
+            return await asyncio.wait_for(asyncio.gather(
+                *[batcher.submit(str(i)) for i in range(3)],
+                return_exceptions=True), 5)
+    res = asyncio.run(run())
+    assert len(res) == 3 and all(isinstance(r, ValueError) for r in res)
+
+def test_stop_before_start():
+    asyncio.run(MicroBatcher(lambda texts: texts).stop())
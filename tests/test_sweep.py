@@ -0,0 +1,38 @@
+import os
+import numpy as np
+import pytest
+from commlit import sweep
+from commlit.sweep import Choice, sample_config, rungs, run_sweep
+
+def test_sample_config_ties_att_filters():
+    space = {"cnn": {"filters": Choice([4, 8, 16])}, "att": {"filters": 1},
+             "extra": {"n": 3}}
+    config = sample_config(space, np.random.default_rng(0))
+    assert config["att"]["filters"] == config["cnn"]["filters"]
+    assert config["extra"] == {"n": 3}
+    assert rungs(1, 27, 3) == [1, 3, 9, 27]
+    assert rungs(1, 10, 3) == [1, 3, 9, 10]
+
+def test_nan_ranked_last_and_pruned_states_deleted(tmp_path, monkeypatch):
+    pytest.importorskip("tensorflow")
+
+    # candidate 0 diverges, the others score their own number
+    def fake_trial(task):
+        cand, config, start, end, sweep_dir = task[:5]
+        open(os.path.join(sweep_dir, "cand_%d_e%d.h5"%(cand, end)),
+             "w").close()
+        return {"cand": cand, "epochs": end, "secs": 0.0,
+                "rmse": float("nan") if cand == 0 else float(cand)}
+    monkeypatch.setattr(sweep, "__run_trial__", fake_trial)
+
+    space = {"extra": {"n": Choice([1, 2, 3, 4, 5])}}
+    inputs = [np.zeros((20, 2), np.float32)]
+    best, trials = run_sweep(inputs, np.zeros(20), np.arange(20), space,
+                             str(tmp_path), n_configs=3, min_epochs=1,
+                             max_epochs=3, eta=3, n_jobs=1)
+    rng = np.random.default_rng(42)
+    configs = [sample_config(space, rng) for c in range(3)]
+    assert best == configs[1]
+    assert sorted(f for f in os.listdir(str(tmp_path))
+                  if f.endswith(".h5")) == ["cand_1_e3.h5"]
+    assert len(trials) == 4
@@ -0,0 +1,36 @@
+import numpy as np
+import pandas as pd
+from commlit.helpers.synthetic import stand_in_nlp, gen_vocab, gen_corpus, \
+    gen_freq_df, ALL_TAGS
+from commlit.pre_proc import gen_tag_df
+from commlit.raw_feats import gen_raw_word_features
+from commlit.train_data import gen_train_data, gen_train_batches
+
+VOCAB = gen_vocab(n_words=300)
+
+def test_streamed_batches_match_train_data():
+    nlp = stand_in_nlp(VOCAB)
+    corpus = gen_corpus(7, VOCAB)
+    tag_df, freq_df = gen_tag_df(ALL_TAGS), gen_freq_df(VOCAB)
+    raw = pd.concat([gen_raw_word_features(doc, tag_df, freq_df).assign(id=i)
+                     for doc, i in zip(nlp.pipe(corpus["excerpt"]),
+                                       corpus["id"])], ignore_index=True)
+    tgt_df = corpus[["id", "target", "standard_error"]]
+    kw = {"up_sample_param": {"n_row": 40, "n_rep": 3}, "seed": 3}
+    x, a, y, m, q, frame, x_cols = gen_train_data(raw, tgt_df, **kw)
+
+    # unshuffled batches of the first epoch, stacked
+    batches = gen_train_batches(raw, tgt_df, batch_size=4, shuffle=False,
+                                **kw)
+    inputs, ys = zip(*batches)
+    assert batches.x_cols == x_cols
+    pd.testing.assert_frame_equal(batches.frame, frame)
+    expected = [x, a, m.drop(["id", "grp_id"], axis=1).values] + \
+        [q[qc].drop(["id", "grp_id"], axis=1).values for qc in q]
+    for j, arr in enumerate(expected):
+        np.testing.assert_allclose(np.concatenate([i[j] for i in inputs]),
+                                   arr)
+    np.testing.assert_allclose(np.concatenate(ys), y)
+
+    # iterating ended the epoch, and the next draws new tokens
+    assert not np.array_equal(batches[0][0][0], x[:4])
@@ -0,0 +1,22 @@
+import numpy as np
+from commlit.helpers.synthetic import stand_in_nlp, gen_vocab, gen_corpus
+from commlit.word_vecs import gen_word_vec_rows
+from commlit.up_scale import AugmentationSampler
+
+def test_sampler_word_vec_rows():
+    # token vectors from doc.tensor, as en_core_web_sm
+    vocab = gen_vocab(n_words=300)
+    nlp = stand_in_nlp(vocab, tensor=True)
+    corpus = gen_corpus(6, vocab)
+    docs = list(nlp.pipe(corpus["excerpt"]))
+    vecs, offsets = gen_word_vec_rows(docs)
+    assert vecs.shape == (offsets[-1], 96)
+    assert len(offsets) == len(docs) + 1
+
+    sampler = AugmentationSampler(np.ones((6, 3)), corpus["target"].values,
+                                  corpus["standard_error"].values, n_rep=2,
+                                  vecs=vecs, offsets=offsets, n_row=20,
+                                  batch_size=4)
+    (v, x), y = sampler[0]
+    assert v.shape == (4, 20, 96, 1)
+    assert x.shape == (4, 3) and y.shape == (4,)
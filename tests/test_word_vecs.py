@@ -0,0 +1,21 @@
+import numpy as np
+import pytest
+from commlit.helpers.synthetic import stand_in_nlp, gen_vocab, gen_corpus
+from commlit.word_vecs import gen_word_vec_feat, gen_batch_word_vec_feat, \
+    gen_word_vec_matrix
+
+VOCAB = gen_vocab(n_words=300)
+
+@pytest.mark.parametrize("tensor", [False, True])
+def test_word_vec_feat(tensor):
+    # tensor=True has no vectors table, as en_core_web_sm
+    nlp = stand_in_nlp(VOCAB, tensor=tensor)
+    docs = list(nlp.pipe(gen_corpus(4, VOCAB)["excerpt"])) + [nlp("")]
+    feat = gen_word_vec_feat(docs[0])
+    batch = gen_batch_word_vec_feat(docs)
+    assert len(feat) == 96 * 3
+    assert batch.shape == (5, 96 * 3)
+    assert np.allclose(batch.iloc[0].values, list(feat.values()),
+                       equal_nan=True)
+    assert batch.iloc[-1].isna().all()
+    assert gen_word_vec_matrix(docs[0], nrows=50).shape == (50, 96)